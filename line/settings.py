@@ -27,6 +27,9 @@ DEBUG = True
 
 ALLOWED_HOSTS = []
 
+# 可以访问连接池等运行状态接口的IP
+INTERNAL_IPS = ['127.0.0.1']
+
 
 # Application definition
 
@@ -42,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'lufei.middlewares.middleware.ProfilingMiddleware',
+    'lufei.middlewares.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -129,10 +134,61 @@ USE_TZ = True
 STATIC_URL = '/static/'
 
 
+REDIS = {
+    'HOST': '192.168.20.58',
+    'PORT': 6379,
+    'MAX_CONNECTIONS': 50,
+    'BLOCKING_TIMEOUT': 5,
+    'SOCKET_TIMEOUT': 5,
+    'SOCKET_CONNECT_TIMEOUT': 3,
+    'HEALTH_CHECK_INTERVAL': 30,
+    # 'PARSER': 'hiredis',
+    # 统计每个请求的redis命令数和耗时，见 lufei.middlewares.middleware.ProfilingMiddleware
+    'CONNECTION_CLASS': 'lufei.utils.profiling.InstrumentedConnection',
+}
+
+PROFILING = {
+    'ENABLED': True,
+    # 线上可以调低，只统计部分请求
+    'SAMPLE_RATE': 1.0,
+    'SERVER_TIMING': True,
+}
+
+# 每个请求的SQL数预算和N+1检查，视图用 query_budget 声明预算，见 lufei.utils.query_budget
+QUERY_BUDGET = {
+    'ENABLED': False,
+    'RAISE': False,
+    'REPEAT_LIMIT': 3,
+}
+
+
 LUFFY_SHOPPING_CAR = "luffy_shopping_car"
 
 ACCOUNT_COUPON = "account_coupon"
 
+LUFFY_COURSE_CATALOG = "luffy_course_catalog"
+
+LUFFY_AUTH_TOKEN = "luffy_auth_token"
+
+LUFFY_COURSE_VERSION = "luffy_course_version"
+
+LUFFY_COURSE_OUTLINE = "luffy_course_outline"
+
+LUFFY_COUPON = "luffy_coupon"
+
+LUFFY_ORDER_TIMEOUT = "luffy_order_timeout"
+
+# 待支付订单的超时时间(秒)
+LUFFY_ORDER_TIMEOUT_SECONDS = 30 * 60
+
+LUFFY_ARTICLE_COUNTER = "luffy_article_counter"
+
+LUFFY_ARTICLE_FEED = "luffy_article_feed"
+
+LUFFY_SEARCH = "luffy_search"
+
+LUFFY_DASHBOARD = "luffy_dashboard"
+
 
 REST_FRAMEWORK = {
     "DEFAULT_VERSIONING_CLASS": "rest_framework.versioning.URLPathVersioning",
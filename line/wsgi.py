@@ -14,3 +14,12 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "line.settings")
 
 application = get_wsgi_application()
+
+# 预加载购物车的redis脚本
+import logging
+from lufei.utils.shopping_car import load_scripts
+try:
+    load_scripts()
+except Exception:
+    # redis暂时不可用时，脚本会在第一次执行时自动加载；记录下来，配置错误不会被忽略
+    logging.getLogger(__name__).exception("预加载购物车redis脚本失败")
@@ -1,5 +1,19 @@
 from django.contrib import admin
 from . import models
+from .utils.counters import ARTICLE_COUNTER_FIELDS
+
+
+class ArticleAdmin(admin.ModelAdmin):
+    # 计数由 flush_article_counters 直接在数据库中累加，编辑文章时不能用加载时的旧值覆盖
+    readonly_fields = ARTICLE_COUNTER_FIELDS
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            obj.save(update_fields=[field.name for field in obj._meta.concrete_fields
+                                    if not field.primary_key and field.name not in ARTICLE_COUNTER_FIELDS])
+        else:
+            obj.save()
+
 
 # Register your models here.
 admin.site.register(models.CourseCategory)
@@ -16,7 +30,7 @@ admin.site.register(models.CourseOutline)
 admin.site.register(models.CourseChapter)
 admin.site.register(models.CourseSection)
 admin.site.register(models.ArticleSource)
-admin.site.register(models.Article)
+admin.site.register(models.Article, ArticleAdmin)
 admin.site.register(models.Collection)
 admin.site.register(models.Comment)
 admin.site.register(models.Account)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class LufeiConfig(AppConfig):
     name = 'lufei'
+
+    def ready(self):
+        # 注册信号
+        from lufei import signals
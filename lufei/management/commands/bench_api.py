@@ -0,0 +1,150 @@
+import json
+import socket
+import subprocess
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.test.utils import override_settings, setup_databases, teardown_databases
+
+import redis
+from lufei.utils import loadtest
+from lufei.utils.pool import POOL, create_pool
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class Command(BaseCommand):
+    help = ("接口压测: 在测试数据库中生成数据，redis使用fakeredis或临时启动的redis-server，"
+            "多线程按权重请求登录、购物车、结算和下单接口，输出各接口的p50/p95/p99和每秒请求数(JSON)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=8, help="并发用户数(线程数)")
+        parser.add_argument('--duration', type=float, default=None, help="压测时长(秒)")
+        parser.add_argument('--requests', type=int, default=200, help="每个用户的请求数，指定--duration时不限")
+        parser.add_argument('--warmup', type=int, default=10, help="每个用户预热的请求数，不计入结果")
+        parser.add_argument('--courses', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--redis', choices=('fake', 'server'), default='fake',
+                            help="fake: fakeredis; server: 临时启动redis-server")
+        parser.add_argument('--redis-server', default='redis-server', help="redis-server可执行文件")
+        parser.add_argument('--keepdb', action='store_true', help="保留测试数据库")
+        parser.add_argument('--output', help="结果写入文件，不指定时输出到标准输出")
+        parser.add_argument('--compare', help="与之前的结果文件比较")
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help="p95增加或吞吐下降超过这个比例时命令失败")
+
+    def handle(self, *args, **options):
+        if not any(app == 'lufei' for app, _ in MigrationLoader(connection).disk_migrations):
+            raise CommandError("lufei没有迁移文件，测试数据库中不会建表，请先执行 makemigrations lufei")
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        server = self.start_redis(options)
+        old_config = setup_databases(options['verbosity'], interactive=False, keepdb=options['keepdb'])
+        try:
+            # 与测试相同，关闭DEBUG，否则每条SQL都会记录在 connection.queries 中
+            with override_settings(DEBUG=False, ALLOWED_HOSTS=["testserver"]):
+                result = self.run(options)
+        finally:
+            teardown_databases(old_config, options['verbosity'], keepdb=options['keepdb'])
+            POOL.configure(create_pool)
+            if server:
+                server.terminate()
+                server.wait()
+
+        data = json.dumps(result, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(data + "\n")
+            self.write_table(result)
+        else:
+            self.stdout.write(data)
+
+        if baseline:
+            self.check_regressions(baseline, result, options['threshold'])
+
+    def start_redis(self, options):
+        """
+        :return: 启动的redis-server进程，使用fakeredis时为None
+        """
+        if options['redis'] == 'fake':
+            try:
+                import fakeredis
+            except ImportError:
+                raise CommandError("需要安装fakeredis，或者使用 --redis server")
+            fake_server = fakeredis.FakeServer()
+            POOL.configure(lambda: fakeredis.FakeRedis(server=fake_server).connection_pool)
+            return None
+
+        port = free_port()
+        try:
+            server = subprocess.Popen([options['redis_server'], "--port", str(port), "--save", "", "--appendonly", "no"],
+                                      stdout=subprocess.DEVNULL)
+        except OSError as e:
+            raise CommandError("无法启动redis-server: %s" % e)
+        conn = redis.Redis(port=port)
+        for _ in range(50):
+            try:
+                conn.ping()
+                break
+            except redis.ConnectionError:
+                time.sleep(0.1)
+        else:
+            server.terminate()
+            raise CommandError("redis-server没有在5秒内启动")
+        POOL.configure(lambda: redis.ConnectionPool(host="127.0.0.1", port=port))
+        return server
+
+    def run(self, options):
+        accounts, price_policies = loadtest.seed(options['users'], options['courses'])
+        # 在redis换成测试实例之后才能导入，导入时会加载lua脚本
+        from line.wsgi import application
+
+        duration = options['duration']
+        result = loadtest.run(application, accounts, price_policies, duration=duration,
+                              requests=None if duration else options['requests'],
+                              warmup=options['warmup'], seed=options['seed'])
+        result["config"] = {
+            "users": options['users'],
+            "duration": duration,
+            "requests": None if duration else options['requests'],
+            "courses": options['courses'],
+            "database": connection.vendor,
+            "redis": options['redis'],
+        }
+        result["commit"] = self.git_commit()
+        return result
+
+    def git_commit(self):
+        try:
+            return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def write_table(self, result):
+        self.stdout.write("%-24s %8s %8s %9s %9s %9s %6s" % ("endpoint", "count", "rps", "p50(ms)", "p95(ms)",
+                                                             "p99(ms)", "errors"))
+        for endpoint, stats in sorted(result["endpoints"].items()) + [("total", result["total"])]:
+            self.stdout.write("%-24s %8d %8.1f %9.2f %9.2f %9.2f %6d" % (
+                endpoint, stats["count"], stats["rps"], stats["p50"], stats["p95"], stats["p99"], stats["errors"]))
+
+    def check_regressions(self, baseline, result, threshold):
+        regressions = []
+        # 写到标准错误，标准输出只有JSON
+        for endpoint, metric, old, new, change, regressed in loadtest.compare(baseline, result, threshold):
+            self.stderr.write("%-24s %-4s %10.2f -> %10.2f %+7.1f%%%s" % (
+                endpoint, metric, old, new, change * 100, "  退化" if regressed else ""))
+            if regressed:
+                regressions.append("%s %s" % (endpoint, metric))
+        if regressions:
+            raise CommandError("性能退化超过%.0f%%: %s" % (threshold * 100, ", ".join(regressions)))
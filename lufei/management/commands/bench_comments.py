@@ -0,0 +1,106 @@
+import random
+import time
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Max
+from django.test.utils import CaptureQueriesContext
+
+from lufei import models
+from lufei.utils.bench import summary
+from lufei.utils.comment_tree import COMMENT_FIELDS, build_tree, comment_queryset, comment_subtree
+
+# 压测数据挂在一个不存在的文章上
+BENCH_OBJECT_ID = 2 ** 31 - 1
+
+
+class Command(BaseCommand):
+    help = "评论树压测: 物化路径分页查询 vs 逐层查询 vs 全部加载后在python中组装"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--comments', type=int, default=10000)
+        parser.add_argument('--max-depth', type=int, default=8, help="生成数据的最大层级")
+        parser.add_argument('--rounds', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def seed(self, content_type, account, count, max_depth):
+        """
+        生成随机评论树，直接指定id以便一次bulk_create就写好path
+        """
+        next_id = (models.Comment.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+        comments = []
+        for comment_id in range(next_id, next_id + count):
+            parent = random.choice(comments) if comments and random.random() < 0.8 else None
+            if parent is not None and parent.depth >= max_depth:
+                parent = None
+            comments.append(models.Comment(
+                id=comment_id,
+                content_type=content_type,
+                object_id=BENCH_OBJECT_ID,
+                p_node_id=parent.id if parent else None,
+                content="comment %s" % comment_id,
+                account=account,
+                path="%s%0*d/" % (parent.path if parent else '', models.Comment.PATH_WIDTH, comment_id),
+                depth=parent.depth + 1 if parent else 0,
+            ))
+        models.Comment.objects.bulk_create(comments, batch_size=1000)
+        return comments
+
+    def measure(self, name, func, rounds):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        timings = []
+        for _ in range(rounds):
+            start = time.time()
+            func()
+            timings.append(time.time() - start)
+        result = summary(timings)
+        self.stdout.write("%-28s queries=%-6s mean=%.2fms p95=%.2fms" % (
+            name, len(queries), result['mean'], result['p95']))
+
+    def level_by_level(self, queryset):
+        """每层一条查询，取出整棵树"""
+        rows = list(queryset.filter(p_node__isnull=True).values(*COMMENT_FIELDS))
+        level, result = rows, rows
+        while level:
+            level = list(queryset.filter(p_node_id__in=[row['id'] for row in level]).values(*COMMENT_FIELDS))
+            result.extend(level)
+        return result
+
+    def load_all(self, queryset):
+        """全部加载，在python中按父节点组装"""
+        rows = list(queryset.values(*COMMENT_FIELDS))
+        rows.sort(key=lambda row: row['path'])
+        return build_tree(rows)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        content_type = ContentType.objects.get_for_model(models.Article)
+        account = models.Account(username="bench_comments_%s" % int(time.time()), password="bench")
+        account.save()
+
+        try:
+            start = time.time()
+            comments = self.seed(content_type, account, options['comments'], min(options['max_depth'], models.Comment.MAX_DEPTH))
+            self.stdout.write("生成 %s 条评论, 耗时 %.1fs" % (len(comments), time.time() - start))
+
+            queryset = comment_queryset(content_type=content_type, object_id=BENCH_OBJECT_ID)
+            rounds = options['rounds']
+            middle = sorted(comment.path for comment in comments)[len(comments) // 2]
+            # 回复最多的根评论，path的第一段就是根评论的id
+            sizes = {}
+            for comment in comments:
+                root_id = int(comment.path[:models.Comment.PATH_WIDTH])
+                sizes[root_id] = sizes.get(root_id, 0) + 1
+            root = next(comment for comment in comments if comment.id == max(sizes, key=sizes.get))
+
+            self.measure("path: first page", lambda: comment_subtree(queryset, size=50), rounds)
+            self.measure("path: middle page", lambda: comment_subtree(queryset, cursor=middle, size=50), rounds)
+            self.measure("path: depth<=2 page", lambda: comment_subtree(queryset, max_depth=2, size=50), rounds)
+            self.measure("path: largest subtree page", lambda: comment_subtree(queryset, root=root, size=50), rounds)
+            self.measure("level by level (all)", lambda: self.level_by_level(queryset), max(1, rounds // 10))
+            self.measure("load all + python (all)", lambda: self.load_all(queryset), max(1, rounds // 10))
+        finally:
+            models.Comment.objects.filter(content_type=content_type, object_id=BENCH_OBJECT_ID).delete()
+            account.delete()
@@ -0,0 +1,66 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lufei.utils.bench import summary
+from lufei.utils.coupon_stock import CLAIMED, CouponStock
+
+
+class Command(BaseCommand):
+    help = "领券压测: 多线程抢同一张券，校验不超发、每个账户只领一张"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stock', type=int, default=1000, help="优惠券数量")
+        parser.add_argument('--accounts', type=int, default=5000, help="参与抢券的账户数")
+        parser.add_argument('--threads', type=int, default=32)
+        parser.add_argument('--repeat', type=int, default=2, help="每个账户的请求次数")
+
+    def handle(self, *args, **options):
+        # 使用单独的key，不影响线上数据
+        stock = CouponStock(prefix="bench_luffy_coupon")
+        coupon_id = 1
+        stock.conn.delete(stock.stock_key(coupon_id), stock.claimed_key(coupon_id), stock.queue)
+        stock.conn.set(stock.stock_key(coupon_id), options['stock'])
+
+        accounts = list(range(1, options['accounts'] + 1)) * options['repeat']
+        results, timings = [], []
+        lock = threading.Lock()
+
+        def worker(items):
+            local_results, local_timings = [], []
+            for account_id in items:
+                start = time.time()
+                local_results.append((account_id, stock.claim(coupon_id, account_id)))
+                local_timings.append(time.time() - start)
+            with lock:
+                results.extend(local_results)
+                timings.extend(local_timings)
+
+        threads = [threading.Thread(target=worker, args=(accounts[i::options['threads']],))
+                   for i in range(options['threads'])]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+
+        try:
+            claimed = [account_id for account_id, result in results if result == CLAIMED]
+            remaining = stock.remaining(coupon_id)
+            queued = stock.conn.llen(stock.queue)
+            members = stock.conn.scard(stock.claimed_key(coupon_id))
+
+            self.stdout.write("请求 %s 次, 耗时 %.2fs, %.0f 次/秒" % (len(results), elapsed, len(results) / elapsed))
+            self.stdout.write("延迟 mean=%(mean).3fms p50=%(p50).3fms p95=%(p95).3fms p99=%(p99).3fms" % summary(timings))
+            self.stdout.write("领取成功 %s, 剩余库存 %s, 队列 %s, 已领账户 %s" % (len(claimed), remaining, queued, members))
+
+            expected = min(options['stock'], options['accounts'])
+            if len(claimed) != expected or len(set(claimed)) != len(claimed):
+                raise CommandError("超发或重复领取: 期望 %s, 实际 %s" % (expected, len(claimed)))
+            if remaining != options['stock'] - expected or queued != expected or members != expected:
+                raise CommandError("库存、队列与领取记录不一致")
+            self.stdout.write("未超发")
+        finally:
+            stock.conn.delete(stock.stock_key(coupon_id), stock.claimed_key(coupon_id), stock.queue)
@@ -0,0 +1,109 @@
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+
+from lufei import models
+from lufei.utils.bench import summary
+from lufei.utils.catalog import catalog
+from lufei.utils.payment import CONN, create_order
+from lufei.utils.settlement import build_course_settlement, build_my_coupon
+from lufei.utils.shopping_car import ShoppingCar
+
+
+class Command(BaseCommand):
+    help = "并发下单压测: 每个线程一个测试账户，全部用贝里支付，统计吞吐量和每单的SQL数"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help="并发线程数")
+        parser.add_argument('--orders', type=int, default=50, help="每个线程的下单数")
+        parser.add_argument('--courses', type=int, default=5, help="每个订单的课程数")
+
+    def get_courses(self, count):
+        course_ids = models.PricePolicy.objects.filter(
+            content_type__model='course').values_list('object_id', flat=True).distinct()[:count]
+        courses = [catalog.get(course_id) for course_id in course_ids]
+        if len(courses) < count:
+            raise CommandError("有价格策略的课程不足%s个" % count)
+        return courses
+
+    def prepare(self, account_id, courses):
+        """写入购物车和结算信息，返回实付金额"""
+        shopping_car = ShoppingCar(account_id)
+        data, total = [], 0
+        for course in courses:
+            price_policy = course["price_policy_list"][0]
+            cart_course = {
+                "id": course["id"],
+                "img": course["course_img"],
+                "title": course["name"],
+                "price_policy_list": course["price_policy_list"],
+                "default_price_policy": price_policy["id"],
+            }
+            shopping_car.add(cart_course)
+            data.append(build_course_settlement(course["id"], cart_course, price_policy["id"], []))
+            total += price_policy["price"]
+        data.append(build_my_coupon([]))
+        CONN.hset(settings.ACCOUNT_COUPON, account_id, json.dumps(data))
+        return int(total)
+
+    def pay(self, account_id, courses):
+        balance = self.prepare(account_id, courses)
+        return create_order(account_id, payment_type=3, balance=balance)
+
+    def worker(self, account_id, courses, orders, timings, errors):
+        try:
+            for _ in range(orders):
+                start = time.time()
+                try:
+                    self.pay(account_id, courses)
+                    timings.append(time.time() - start)
+                except Exception as e:
+                    errors.append(str(e))
+        finally:
+            connections.close_all()
+
+    def handle(self, *args, **options):
+        courses = self.get_courses(options['courses'])
+        if any(int(course["price_policy_list"][0]["price"]) != course["price_policy_list"][0]["price"]
+               for course in courses):
+            raise CommandError("压测使用贝里整数支付，请选择价格为整数的课程")
+
+        accounts = []
+        for i in range(options['threads']):
+            account = models.Account(username="bench_pay_%s_%s" % (int(time.time()), i), password="bench",
+                                     balance=10 ** 9)
+            account.save()
+            accounts.append(account)
+
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                self.pay(accounts[0].id, courses)
+            self.stdout.write("每个订单(%s个课程)的SQL数: %s" % (len(courses), len(queries)))
+
+            timings, errors = [], []
+            threads = [
+                threading.Thread(target=self.worker, args=(account.id, courses, options['orders'], timings, errors))
+                for account in accounts
+            ]
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.time() - start
+
+            self.stdout.write("线程数: %s, 成功订单: %s, 失败: %s, 耗时: %.2fs, 吞吐量: %.1f 单/秒" % (
+                len(threads), len(timings), len(errors), elapsed, len(timings) / elapsed))
+            self.stdout.write("延迟 mean=%(mean).2fms p50=%(p50).2fms p95=%(p95).2fms p99=%(p99).2fms" % summary(timings))
+            for error in set(errors):
+                self.stderr.write(error)
+        finally:
+            for account in accounts:
+                CONN.delete(ShoppingCar.key_for(account.id))
+                CONN.hdel(settings.ACCOUNT_COUPON, account.id)
+            models.Account.objects.filter(id__in=[account.id for account in accounts]).delete()
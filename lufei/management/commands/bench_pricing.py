@@ -0,0 +1,89 @@
+import itertools
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lufei.utils.bench import summary
+from lufei.utils.pricing import best_assignment, coupon_discount
+
+CART_SIZES = (1, 10, 50, 100, 200)
+COUPON_COUNTS = (1, 10, 100, 1000)
+
+
+def random_coupon(coupon_id):
+    coupon_type = random.choice((0, 1, 2))
+    return {
+        "id": coupon_id,
+        "content_type": coupon_type,
+        "money_equivalent_value": random.randint(5, 300) if coupon_type != 2 else 0,
+        "off_percent": random.randint(50, 95) if coupon_type == 2 else None,
+        "minimum_consume": random.choice((0, 100, 300, 500, 1000)) if coupon_type == 1 else 0,
+    }
+
+
+def random_cart(cart_size, coupon_count):
+    """
+    cart_size个课程，coupon_count张券，约一半为通用券，其余随机绑定到课程
+    """
+    courses = [{"id": i, "price": float(random.randint(99, 2999)), "coupons": []} for i in range(cart_size)]
+    global_coupons = []
+    for coupon_id in range(coupon_count):
+        coupon = random_coupon(coupon_id)
+        if random.random() < 0.5:
+            global_coupons.append(coupon)
+        else:
+            random.choice(courses)["coupons"].append(coupon)
+    return courses, global_coupons
+
+
+def brute_force(courses, global_coupons):
+    """
+    穷举所有组合，只用于校验小规模的结果
+    """
+    best = None
+    options = [[None] + course["coupons"] for course in courses]
+    for choice in itertools.product(*options):
+        original_price = subtotal = 0
+        for course, coupon in zip(courses, choice):
+            original_price += course["price"]
+            subtotal += course["price"] - (coupon_discount(course["price"], coupon) if coupon else 0)
+        for coupon in [None] + global_coupons:
+            total = subtotal - (coupon_discount(subtotal, coupon, original_price) if coupon else 0)
+            if best is None or total < best:
+                best = total
+    return round(best, 2)
+
+
+class Command(BaseCommand):
+    help = "优惠券计算引擎基准测试: 购物车1-200个课程 x 优惠券1-1000张"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=200, help="每种规模的计算次数")
+        parser.add_argument('--verify', type=int, default=200, help="与穷举结果对比的随机小规模用例数")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+
+        for _ in range(options['verify']):
+            courses, global_coupons = random_cart(random.randint(1, 3), random.randint(1, 8))
+            expected = brute_force(courses, global_coupons)
+            actual = best_assignment(courses, global_coupons)["total"]
+            if abs(expected - actual) > 0.01:
+                raise CommandError("结果不是最优: 穷举 %s, 引擎 %s" % (expected, actual))
+        if options['verify']:
+            self.stdout.write("%s个随机用例与穷举结果一致" % options['verify'])
+
+        self.stdout.write("%8s %8s %10s %10s %10s" % ("courses", "coupons", "mean(ms)", "p95(ms)", "p99(ms)"))
+        for cart_size in CART_SIZES:
+            for coupon_count in COUPON_COUNTS:
+                carts = [random_cart(cart_size, coupon_count) for _ in range(options['rounds'])]
+                timings = []
+                for courses, global_coupons in carts:
+                    start = time.time()
+                    best_assignment(courses, global_coupons)
+                    timings.append(time.time() - start)
+                result = summary(timings)
+                self.stdout.write("%8s %8s %10.3f %10.3f %10.3f" % (
+                    cart_size, coupon_count, result["mean"], result["p95"], result["p99"]))
@@ -0,0 +1,63 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from lufei.utils.bench import summary
+from lufei.utils.search import ARTICLE, COURSE, SearchIndex
+
+WORDS = ["python", "django", "linux", "mysql", "redis", "vue", "flask", "go", "java", "web",
+         "全栈", "开发", "数据分析", "人工智能", "机器学习", "爬虫", "运维", "自动化", "前端", "后端",
+         "入门", "进阶", "实战", "项目", "架构", "算法", "网络", "编程", "框架", "数据库",
+         "零基础", "就业", "面试", "源码", "性能", "优化", "部署", "测试", "安全", "设计模式"]
+
+
+def sentence(length):
+    return "".join(random.choice(WORDS) + random.choice(["", " ", "，"]) for _ in range(length))
+
+
+class Command(BaseCommand):
+    help = "搜索压测: 建索引吞吐(批量/逐个增量)和查询延迟，使用单独的key前缀"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--docs', type=int, default=20000)
+        parser.add_argument('--incremental', type=int, default=1000, help="逐个增量更新的文档数")
+        parser.add_argument('--queries', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        index = SearchIndex(prefix="bench_luffy_search")
+        documents = [("%s:%s" % (random.choice([COURSE, ARTICLE]), i), sentence(4), sentence(30), sentence(200))
+                     for i in range(1, options['docs'] + 1)]
+
+        try:
+            index.clear()
+            start = time.time()
+            index.bulk_index(documents)
+            elapsed = time.time() - start
+            self.stdout.write("批量建索引 %s 个文档 %.2fs, %.0f 文档/秒, 词典 %s 个词" % (
+                len(documents), elapsed, len(documents) / elapsed, index.conn.zcard(index.terms)))
+
+            timings = []
+            for doc in random.sample(documents, min(options['incremental'], len(documents))):
+                start = time.time()
+                index.index(doc[0], sentence(4), sentence(30), sentence(200))
+                timings.append(time.time() - start)
+            self.stdout.write("增量更新 mean=%(mean).2fms p50=%(p50).2fms p95=%(p95).2fms p99=%(p99).2fms" % summary(timings))
+
+            for name, make_query, doc_type, prefix in (
+                    ("单词", lambda: random.choice(WORDS), None, False),
+                    ("多词", lambda: " ".join(random.sample(WORDS, 3)), None, False),
+                    ("前缀", lambda: random.choice(WORDS)[:1], None, True),
+                    ("按类型", lambda: " ".join(random.sample(WORDS, 2)), COURSE, False)):
+                timings = []
+                for _ in range(options['queries']):
+                    query = make_query()
+                    start = time.time()
+                    index.search(query, doc_type=doc_type, prefix=prefix)
+                    timings.append(time.time() - start)
+                self.stdout.write(("查询(%s) " % name) +
+                                  "mean=%(mean).2fms p50=%(p50).2fms p95=%(p95).2fms p99=%(p99).2fms" % summary(timings))
+        finally:
+            index.clear()
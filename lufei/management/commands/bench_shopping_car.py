@@ -0,0 +1,74 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from lufei.utils.bench import summary
+from lufei.utils.shopping_car import CONN, ShoppingCar, load_scripts
+
+
+class Command(BaseCommand):
+    help = "对比修改默认价格策略的延迟: 旧的json整体读写 vs redis脚本"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--courses', type=int, default=50, help="购物车中的课程数")
+        parser.add_argument('--requests', type=int, default=2000, help="每种方式的请求次数")
+
+    def seed(self, courses):
+        car = {}
+        for i in range(1, courses + 1):
+            car[str(i)] = {
+                "id": i,
+                "img": "/static/course/%s.png" % i,
+                "title": "bench course %s" % i,
+                "price_policy_list": [
+                    {"id": i * 10 + 1, "valid_period": "1个月", "price": 99.0},
+                    {"id": i * 10 + 2, "valid_period": "3个月", "price": 199.0},
+                ],
+                "default_price_policy": i * 10 + 1,
+            }
+        return car
+
+    def legacy(self, key, field, course_id, price_policy_id):
+        """修改前的实现: HGET整个购物车 -> 修改 -> HSET整个购物车"""
+        car = json.loads(CONN.hget(key, field).decode('utf-8'))
+        for policy in car[course_id]["price_policy_list"]:
+            if policy['id'] == price_policy_id:
+                car[course_id]["default_price_policy"] = price_policy_id
+                break
+        CONN.hset(key, field, json.dumps(car))
+
+    def report(self, name, timings):
+        self.stdout.write("%(name)-8s mean=%(mean).3fms p50=%(p50).3fms p95=%(p95).3fms p99=%(p99).3fms" % dict(
+            summary(timings), name=name))
+
+    def handle(self, *args, **options):
+        courses, requests = options['courses'], options['requests']
+        car = self.seed(courses)
+
+        legacy_key, legacy_field = "bench_luffy_shopping_car", "bench"
+        shopping_car = ShoppingCar("bench")
+        shopping_car.key = "bench_%s" % shopping_car.key
+        CONN.hset(legacy_key, legacy_field, json.dumps(car))
+        CONN.hmset(shopping_car.key, {k: json.dumps(v) for k, v in car.items()})
+        load_scripts()
+
+        try:
+            legacy_timings, script_timings = [], []
+            for n in range(requests):
+                course_id = n % courses + 1
+                price_policy_id = course_id * 10 + n % 2 + 1
+
+                start = time.time()
+                self.legacy(legacy_key, legacy_field, str(course_id), price_policy_id)
+                legacy_timings.append(time.time() - start)
+
+                start = time.time()
+                shopping_car.set_default_price_policy(course_id, price_policy_id)
+                script_timings.append(time.time() - start)
+        finally:
+            CONN.delete(legacy_key, shopping_car.key)
+
+        self.stdout.write("购物车课程数: %s, 请求次数: %s" % (courses, requests))
+        self.report("legacy", legacy_timings)
+        self.report("script", script_timings)
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from lufei.utils.search import article_documents, course_documents, search_index
+
+
+class Command(BaseCommand):
+    help = "全量重建课程和文章的搜索索引，之后由信号增量更新"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="每次pipeline写入的命令数")
+
+    def handle(self, *args, **options):
+        start = time.time()
+        documents = course_documents() + article_documents()
+        loaded = time.time()
+
+        search_index.clear()
+        count = search_index.bulk_index(documents, batch_size=options['batch_size'])
+        elapsed = time.time() - loaded
+
+        self.stdout.write("读取 %s 个文档 %.2fs, 建索引 %.2fs, %.0f 文档/秒, 词典 %s 个词" % (
+            len(documents), loaded - start, elapsed, count / elapsed if elapsed else 0,
+            search_index.conn.zcard(search_index.terms)))
@@ -0,0 +1,36 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from lufei.utils.order_timeout import cancel_orders, order_timeout
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "从超时队列中批量取出到期的待支付订单并取消，可以运行多个实例"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="每个事务取消的订单数")
+        parser.add_argument('--interval', type=float, default=1.0, help="没有到期订单时等待的秒数")
+        parser.add_argument('--once', action='store_true', help="处理完当前到期的订单后退出")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            order_ids = order_timeout.pop_due(options['batch_size'])
+            if order_ids:
+                try:
+                    total += cancel_orders(order_ids)
+                except Exception:
+                    # 取消失败时不确认，租约到期后会重新放回队列
+                    logger.exception("取消超时订单失败: %s", order_ids)
+                    time.sleep(options['interval'])
+                    continue
+                order_timeout.ack(order_ids)
+                self.stdout.write("已取消 %s 个超时订单" % total)
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['interval'])
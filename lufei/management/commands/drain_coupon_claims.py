@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from lufei import models
+from lufei.utils.coupon_stock import coupon_stock
+
+
+class Command(BaseCommand):
+    help = "把领券队列中的记录批量写入CouponRecord，只能运行一个实例"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--interval', type=float, default=1.0, help="队列为空时等待的秒数")
+        parser.add_argument('--once', action='store_true', help="清空队列后退出")
+
+    def drain(self, batch_size):
+        """
+        写入一批领取记录，先写库再删除队列中的记录
+        进程在两步之间退出时，下次会重复读到这批记录，写入前按(优惠券,账户)去重
+        :return: 处理的记录数
+        """
+        items = coupon_stock.pending(batch_size)
+        if not items:
+            return 0
+
+        with transaction.atomic():
+            existing = set(models.CouponRecord.objects.filter(
+                coupon_id__in=set(item["coupon_id"] for item in items),
+                account_id__in=set(item["account_id"] for item in items),
+            ).values_list('coupon_id', 'account_id'))
+
+            records = []
+            for item in items:
+                key = (item["coupon_id"], item["account_id"])
+                if key in existing:
+                    continue
+                existing.add(key)
+                records.append(models.CouponRecord(
+                    coupon_id=item["coupon_id"],
+                    account_id=item["account_id"],
+                    get_time=parse_datetime(item["get_time"]),
+                    status=0,
+                ))
+            models.CouponRecord.objects.bulk_create(records)
+
+        coupon_stock.ack(len(items))
+        return len(items)
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            count = self.drain(options['batch_size'])
+            total += count
+            if count:
+                self.stdout.write("已写入 %s 条领取记录" % total)
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['interval'])
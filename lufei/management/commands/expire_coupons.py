@@ -0,0 +1,57 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from lufei import models
+
+UNUSED = 0
+EXPIRED = 2
+
+
+class Command(BaseCommand):
+    help = "把已过有效期的未使用优惠券标记为已过期，每次只更新一小批，避免长时间锁表"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="每条UPDATE最多更新的记录数")
+        parser.add_argument('--sleep', type=float, default=0.05, help="两批之间暂停的秒数")
+
+    def expire(self, queryset, batch_size, sleep):
+        """
+        分批把queryset中的记录改为已过期: 先按索引取一批id，再按id更新
+        :return: 更新的记录数
+        """
+        total = 0
+        while True:
+            ids = list(queryset.filter(status=UNUSED).values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return total
+            total += models.CouponRecord.objects.filter(id__in=ids, status=UNUSED).update(status=EXPIRED)
+            if sleep:
+                time.sleep(sleep)
+
+    def handle(self, *args, **options):
+        batch_size, sleep = options['batch_size'], options['sleep']
+        today = timezone.localtime(timezone.now()).date()
+        start = time.time()
+
+        # 固定有效期的券: 有效期结束日期早于今天
+        fixed = list(models.Coupon.objects.filter(valid_end_date__lt=today).values_list('id', flat=True))
+        fixed_total = 0
+        for i in range(0, len(fixed), batch_size):
+            fixed_total += self.expire(
+                models.CouponRecord.objects.filter(coupon_id__in=fixed[i:i + batch_size]), batch_size, sleep)
+
+        # 自领取时开始计算有效期的券: 领取日期 + 有效天数 早于今天
+        relative_total = 0
+        relative = models.Coupon.objects.filter(
+            valid_end_date__isnull=True, coupon_valid_days__isnull=False).values_list('id', 'coupon_valid_days')
+        for coupon_id, valid_days in relative:
+            cutoff = timezone.make_aware(datetime.datetime.combine(
+                today - datetime.timedelta(days=valid_days), datetime.time.min))
+            relative_total += self.expire(
+                models.CouponRecord.objects.filter(coupon_id=coupon_id, get_time__lt=cutoff), batch_size, sleep)
+
+        self.stdout.write("过期优惠券: 固定有效期 %s, 领取后计算有效期 %s, 耗时 %.1fs" % (
+            fixed_total, relative_total, time.time() - start))
@@ -0,0 +1,25 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from lufei.utils.catalog_io import FORMATS, JSONL, export_documents, write_documents
+
+
+class Command(BaseCommand):
+    help = "导出整个课程目录(分类、课程、详情、价格策略、章节、课时、作业)，JSON Lines或CSV，每行一个课程"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="输出文件，默认为标准输出")
+        parser.add_argument('--format', choices=FORMATS, default=JSONL)
+        parser.add_argument('--chunk-size', type=int, default=500, help="每次从数据库读取的课程数")
+
+    def handle(self, *args, **options):
+        start = time.time()
+        if options['path'] == '-':
+            count = write_documents(export_documents(options['chunk_size']), sys.stdout, options['format'])
+        else:
+            with open(options['path'], 'w', encoding='utf-8', newline='') as stream:
+                count = write_documents(export_documents(options['chunk_size']), stream, options['format'])
+        elapsed = time.time() - start
+        self.stderr.write("导出 %s 个课程, 耗时 %.2fs, %.0f 课程/秒" % (count, elapsed, count / elapsed if elapsed else 0))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from lufei.utils.counters import article_counter
+
+
+class Command(BaseCommand):
+    help = "把redis中累加的文章计数合并写入数据库，只运行一个实例"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="每条UPDATE语句更新的文章数")
+        parser.add_argument('--interval', type=float, default=10.0, help="两次落库之间等待的秒数")
+        parser.add_argument('--once', action='store_true', help="落库一次后退出")
+
+    def handle(self, *args, **options):
+        while True:
+            count = article_counter.flush(options['batch_size'])
+            if count:
+                self.stdout.write("已更新 %s 篇文章的计数" % count)
+            if options['once']:
+                break
+            time.sleep(options['interval'])
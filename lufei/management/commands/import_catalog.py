@@ -0,0 +1,67 @@
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django import db
+from django.core.management.base import BaseCommand, CommandError
+
+from lufei.utils.catalog_io import FORMATS, JSONL, CatalogImporter, parse_chunk, read_chunks
+from lufei.utils.course_version import course_version
+
+
+class Command(BaseCommand):
+    help = "导入课程目录: 多进程解析校验，主进程按块bulk_create，已存在的课程跳过"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, default=JSONL)
+        parser.add_argument('--chunk-size', type=int, default=500, help="每块的课程数，每块一个事务")
+        parser.add_argument('--workers', type=int, default=4, help="解析校验的进程数")
+        parser.add_argument('--max-errors', type=int, default=100, help="错误超过这个数时停止")
+
+    def handle(self, *args, **options):
+        fmt = options['format']
+        importer = CatalogImporter()
+        imported, errors, lines = [], [], 0
+        start = time.time()
+
+        # 子进程不能共用父进程的数据库连接，解析校验也不需要访问数据库
+        db.connections.close_all()
+        with open(options['path'], encoding='utf-8', newline='') as stream, \
+                ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            # 最多同时解析 workers*2 块，文件不会被一次读入内存
+            pending = deque()
+            chunks = read_chunks(stream, fmt, options['chunk_size'])
+            for chunk in chunks:
+                pending.append(executor.submit(parse_chunk, chunk, fmt))
+                if len(pending) < options['workers'] * 2:
+                    continue
+                lines += self.import_parsed(importer, pending.popleft().result(), imported, errors, options)
+                self.progress(lines, imported, errors, start)
+            while pending:
+                lines += self.import_parsed(importer, pending.popleft().result(), imported, errors, options)
+                self.progress(lines, imported, errors, start)
+
+        if imported:
+            course_version.bump(imported, course_list=True)
+        for line_number, error in errors:
+            self.stderr.write("第%s行: %s" % (line_number, error))
+        self.stdout.write("完成, 新增 %s 个课程, %s 个错误。搜索索引请执行 build_search_index 重建" % (
+            len(imported), len(errors)))
+
+    def import_parsed(self, importer, result, imported, errors, options):
+        documents, parse_errors = result
+        errors.extend(parse_errors)
+        course_ids, import_errors = importer.import_chunk(documents) if documents else ([], [])
+        imported.extend(course_ids)
+        errors.extend(import_errors)
+        if len(errors) > options['max_errors']:
+            for line_number, error in errors:
+                self.stderr.write("第%s行: %s" % (line_number, error))
+            raise CommandError("错误过多，已停止。之前的块已经写入")
+        return len(documents) + len(parse_errors)
+
+    def progress(self, lines, imported, errors, start):
+        elapsed = time.time() - start
+        self.stdout.write("已处理 %s 行, 新增 %s 个课程, %s 个错误, %.0f 课程/秒" % (
+            lines, len(imported), len(errors), len(imported) / elapsed if elapsed else 0))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from lufei import models
+from lufei.utils.coupon_stock import coupon_stock
+
+
+class Command(BaseCommand):
+    help = "把在领取时间内的优惠券库存加载到redis，建议每天开始领取前运行"
+
+    def add_arguments(self, parser):
+        parser.add_argument('coupon_ids', nargs='*', type=int, help="只加载这些优惠券")
+        parser.add_argument('--force', action='store_true', help="按数据库重新计算已加载的库存")
+
+    def handle(self, *args, **options):
+        today = timezone.localtime(timezone.now()).date()
+        coupons = models.Coupon.objects.filter(open_date__lte=today, close_date__gte=today)
+        if options['coupon_ids']:
+            coupons = coupons.filter(id__in=options['coupon_ids'])
+
+        for coupon in coupons:
+            loaded = coupon_stock.load(coupon, force=options['force'])
+            self.stdout.write("%s %s: 剩余 %s" % (
+                "加载" if loaded else "跳过", coupon, coupon_stock.remaining(coupon.id)))
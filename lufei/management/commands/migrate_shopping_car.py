@@ -0,0 +1,42 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from lufei.utils.shopping_car import CONN, ShoppingCar
+
+
+class Command(BaseCommand):
+    help = "将旧的购物车数据(luffy_shopping_car中每个用户一个json)迁移为每个用户一个hash"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="每次HSCAN读取的用户数")
+        parser.add_argument('--keep', action='store_true', help="迁移后保留旧数据")
+        parser.add_argument('--dry-run', action='store_true', help="只统计，不写入")
+
+    def handle(self, *args, **options):
+        old_key = settings.LUFFY_SHOPPING_CAR
+        if CONN.type(old_key) not in (b'hash', b'none'):
+            self.stderr.write("%s 不是hash，无法迁移" % old_key)
+            return
+
+        users = courses = 0
+        for user_id, blob in CONN.hscan_iter(old_key, count=options['batch_size']):
+            user_id = user_id.decode('utf-8')
+            course_dict = json.loads(blob.decode('utf-8'))
+            users += 1
+            courses += len(course_dict)
+            if options['dry_run']:
+                continue
+
+            pipe = CONN.pipeline()
+            if course_dict:
+                # 已经在新结构中的课程(迁移期间用户新加入的)不覆盖
+                key = ShoppingCar.key_for(user_id)
+                for course_id, course in course_dict.items():
+                    pipe.hsetnx(key, course_id, json.dumps(course))
+            if not options['keep']:
+                pipe.hdel(old_key, user_id)
+            pipe.execute()
+
+        self.stdout.write("迁移用户: %s, 课程: %s%s" % (users, courses, " (dry-run)" if options['dry_run'] else ""))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from lufei.utils.feed import POSITIONS, article_feed
+
+
+class Command(BaseCommand):
+    help = "全量重建文章信息流，可以定时执行以校正增量更新遗漏的数据"
+
+    def handle(self, *args, **options):
+        article_feed.build()
+        for position in POSITIONS:
+            self.stdout.write("位置 %s: %s 篇文章" % (position, article_feed.conn.zcard(article_feed.key_for(position))))
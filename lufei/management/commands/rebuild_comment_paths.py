@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Case, CharField, IntegerField, Value, When
+
+from lufei import models
+
+
+class Command(BaseCommand):
+    help = "为已有评论生成物化路径(path/depth)，逐层分批更新"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--reset', action='store_true', help="重新生成所有评论的路径")
+
+    def update(self, rows):
+        """
+        :param rows: [(id, path, depth)]，一条UPDATE更新一批
+        """
+        models.Comment.objects.filter(id__in=[row[0] for row in rows]).update(
+            path=Case(*[When(id=row[0], then=Value(row[1])) for row in rows], output_field=CharField()),
+            depth=Case(*[When(id=row[0], then=Value(row[2])) for row in rows], output_field=IntegerField()),
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        width = models.Comment.PATH_WIDTH
+        if options['reset']:
+            models.Comment.objects.update(path='', depth=0)
+
+        total = 0
+        # 根评论
+        while True:
+            ids = list(models.Comment.objects.filter(path='', p_node__isnull=True).values_list(
+                'id', flat=True)[:batch_size])
+            if not ids:
+                break
+            self.update([(comment_id, "%0*d/" % (width, comment_id), 0) for comment_id in ids])
+            total += len(ids)
+
+        # 父评论已有路径的回复，逐层向下
+        while True:
+            rows = list(models.Comment.objects.filter(
+                path='', p_node__isnull=False, p_node__depth__lt=models.Comment.MAX_DEPTH).exclude(
+                p_node__path='').values_list('id', 'p_node__path', 'p_node__depth')[:batch_size])
+            if not rows:
+                break
+            self.update([
+                (comment_id, "%s%0*d/" % (parent_path, width, comment_id), parent_depth + 1)
+                for comment_id, parent_path, parent_depth in rows
+            ])
+            total += len(rows)
+            self.stdout.write("已更新 %s 条评论" % total)
+
+        self.stdout.write("完成，共更新 %s 条评论" % total)
+        # 超过最大层级的回复放不进path
+        skipped = models.Comment.objects.filter(path='').count()
+        if skipped:
+            self.stdout.write("有 %s 条评论超过 %s 层，没有生成路径" % (skipped, models.Comment.MAX_DEPTH))
@@ -0,0 +1,43 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django import db
+from django.core.management.base import BaseCommand
+
+from lufei import models
+from lufei.utils.dashboard import dashboard
+
+
+def rebuild_chunk(account_ids):
+    dashboard.refresh(account_ids)
+    return len(account_ids)
+
+
+class Command(BaseCommand):
+    help = "重建所有账户的我的课程/学习进度读模型，按账户分块由多个进程并行生成"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help="每块的账户数")
+        parser.add_argument('--workers', type=int, default=4, help="进程数，为1时在当前进程中执行")
+
+    def handle(self, *args, **options):
+        account_ids = list(models.Account.objects.order_by('id').values_list('id', flat=True))
+        size = options['chunk_size']
+        chunks = [account_ids[i:i + size] for i in range(0, len(account_ids), size)]
+
+        start = time.time()
+        done = 0
+        if options['workers'] > 1:
+            # 子进程不能共用父进程的数据库连接，redis连接池由ForkSafePool在子进程中重建
+            db.connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+                for count in executor.map(rebuild_chunk, chunks):
+                    done += count
+                    self.stdout.write("已重建 %s/%s 个账户" % (done, len(account_ids)))
+        else:
+            for chunk in chunks:
+                done += rebuild_chunk(chunk)
+                self.stdout.write("已重建 %s/%s 个账户" % (done, len(account_ids)))
+
+        elapsed = time.time() - start
+        self.stdout.write("完成, 耗时 %.2fs, %.0f 账户/秒" % (elapsed, done / elapsed if elapsed else 0))
@@ -0,0 +1,120 @@
+import time
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Value, When
+from django.utils import timezone
+
+from lufei import models
+from lufei.utils.payment import generate_number
+
+# 待结算的奖惩状态: 新提交 / 按时提交 / 未按时提交
+UNSETTLED = (0, 1, 2)
+REWARDED = 3
+PUNISHED = 4
+UNCHECKED = 5
+
+
+class Command(BaseCommand):
+    help = "批量结算已通过作业的奖学金: 按学习计划的推荐日期判断是否按时提交，按时的发放该作业的奖学金"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help="每批处理的作业记录数，每批一个事务")
+        parser.add_argument('--dry-run', action='store_true', help="只统计，不写入")
+
+    def chunk_queryset(self, last_id, chunk_size):
+        """
+        按id做keyset分页，一条SQL取出作业记录、学员账户、奖学金和学习计划中的推荐日期
+        """
+        recommend_date = models.CourseSchedule.objects.filter(
+            homework_id=OuterRef('homework_id'),
+            study_record__enrolled_degree_course_id=OuterRef('student_id'),
+        ).values('recommend_date')[:1]
+
+        return models.HomeworkRecord.objects.filter(
+            id__gt=last_id,
+            status=1,
+            reward_status__in=UNSETTLED,
+        ).annotate(
+            recommend_date=Subquery(recommend_date),
+        ).order_by('id').values_list(
+            'id', 'date', 'student__account_id', 'homework__scholarship_value', 'recommend_date',
+        )[:chunk_size]
+
+    def settle_chunk(self, rows, content_type, write=True):
+        """
+        一批作业记录在一个事务中结算
+        :param write: 为False时只分类，不写入
+        :return: (奖励数, 处罚数, 无法检测数)
+        """
+        status = {REWARDED: [], PUNISHED: [], UNCHECKED: []}
+        rewards = []
+        for record_id, date, account_id, scholarship_value, recommend_date in rows:
+            if recommend_date is None:
+                status[UNCHECKED].append(record_id)
+            elif timezone.localtime(date).date() <= recommend_date:
+                status[REWARDED].append(record_id)
+                if scholarship_value:
+                    rewards.append((record_id, account_id, scholarship_value))
+            else:
+                status[PUNISHED].append(record_id)
+
+        if not write:
+            return len(status[REWARDED]), len(status[PUNISHED]), len(status[UNCHECKED])
+
+        if rewards:
+            amounts = {}
+            for record_id, account_id, scholarship_value in rewards:
+                amounts[account_id] = amounts.get(account_id, 0) + scholarship_value
+
+            balances = dict(models.Account.objects.select_for_update().filter(
+                id__in=amounts).values_list('id', 'balance'))
+
+            transactions = []
+            for record_id, account_id, scholarship_value in rewards:
+                balances[account_id] += scholarship_value
+                transactions.append(models.TransactionRecord(
+                    account_id=account_id,
+                    amount=scholarship_value,
+                    balance=balances[account_id],
+                    transaction_type=0,
+                    content_type=content_type,
+                    object_id=record_id,
+                    transaction_number=generate_number("T"),
+                    memo="作业奖学金",
+                ))
+            models.TransactionRecord.objects.bulk_create(transactions)
+
+            models.Account.objects.filter(id__in=amounts).update(balance=F('balance') + Case(
+                *[When(id=account_id, then=Value(amount)) for account_id, amount in amounts.items()],
+                default=Value(0),
+                output_field=IntegerField()
+            ))
+
+        for reward_status, record_ids in status.items():
+            if record_ids:
+                models.HomeworkRecord.objects.filter(id__in=record_ids).update(reward_status=reward_status)
+
+        return len(status[REWARDED]), len(status[PUNISHED]), len(status[UNCHECKED])
+
+    def handle(self, *args, **options):
+        content_type = ContentType.objects.get_for_model(models.HomeworkRecord)
+        start = time.time()
+        last_id = 0
+        total = [0, 0, 0]
+        while True:
+            with transaction.atomic():
+                queryset = self.chunk_queryset(last_id, options['chunk_size'])
+                rows = list(queryset if options['dry_run'] else queryset.select_for_update())
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                counts = self.settle_chunk(rows, content_type, write=not options['dry_run'])
+
+            total = [a + b for a, b in zip(total, counts)]
+            self.stdout.write("已处理到作业记录 %s: 奖励 %s, 处罚 %s, 无学习计划 %s, 耗时 %.1fs" % (
+                last_id, total[0], total[1], total[2], time.time() - start))
+
+        self.stdout.write("结算完成%s: 奖励 %s, 处罚 %s, 无学习计划 %s, 耗时 %.1fs" % (
+            " (dry-run)" if options['dry_run'] else "", total[0], total[1], total[2], time.time() - start))
@@ -1,3 +1,9 @@
+import random
+import time
+
+from lufei.utils import profiling, query_budget, sql_hooks
+
+
 class MiddlewareMixin(object):
     def __init__(self, get_response=None):
         self.get_response = get_response
@@ -20,3 +26,64 @@ class CorMiddleware(MiddlewareMixin):
         response['Access-Control-Allow-Headers'] = "*"
         return response
 
+
+
+class ProfilingMiddleware(MiddlewareMixin):
+    """
+    统计每个接口的耗时直方图、SQL查询数/耗时、redis命令数/耗时，由 metrics/ 接口导出
+    放在MIDDLEWARE的第一个，配置见 settings.PROFILING
+    """
+
+    def __init__(self, get_response=None):
+        super(ProfilingMiddleware, self).__init__(get_response)
+        self.config = profiling.get_config()
+
+    def __call__(self, request):
+        config = self.config
+        if not config["ENABLED"] or (config["SAMPLE_RATE"] < 1 and random.random() >= config["SAMPLE_RATE"]):
+            return self.get_response(request)
+
+        recorder = profiling.start()
+        start = time.time()
+        try:
+            with sql_hooks.execute_wrapper(profiling.sql_wrapper):
+                response = self.get_response(request)
+        finally:
+            profiling.stop()
+        elapsed = time.time() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.func.__name__ if match else "unmatched"
+        profiling.metrics.record("%s %s" % (request.method, view), elapsed, recorder, response.status_code)
+        if config["SERVER_TIMING"]:
+            response['Server-Timing'] = "sql;desc=\"%s queries\";dur=%.2f, redis;desc=\"%s commands\";dur=%.2f, total;dur=%.2f" % (
+                recorder.sql_count, recorder.sql_time * 1000,
+                recorder.redis_count, recorder.redis_time * 1000, elapsed * 1000)
+        return response
+
+
+class QueryBudgetMiddleware(MiddlewareMixin):
+    """
+    检查每个请求的SQL数是否超出视图声明的 query_budget，以及同一形状的SQL是否重复执行(N+1)
+    默认关闭，配置见 settings.QUERY_BUDGET；测试中打开并设置RAISE，超出时测试失败
+    """
+
+    def __call__(self, request):
+        config = query_budget.get_config()
+        if not config["ENABLED"]:
+            return self.get_response(request)
+
+        log = query_budget.QueryLog(stack_depth=config["STACK_DEPTH"])
+        with sql_hooks.execute_wrapper(log):
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        view_class = getattr(match.func, 'view_class', None) if match else None
+        budget, repeat_limit = query_budget.budget_for(view_class, request.method)
+        problems = log.problems(budget, repeat_limit or config["REPEAT_LIMIT"])
+        if problems:
+            message = "%s %s\n%s" % (request.method, request.path, "\n".join(problems))
+            if config["RAISE"]:
+                raise query_budget.QueryBudgetExceeded(message)
+            query_budget.logger.warning(message)
+        return response
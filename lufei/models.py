@@ -301,7 +301,9 @@ class StudyRecord(models.Model):
         return '%s-%s' % (self.enrolled_degree_course, self.course_module)
 
     def save(self, *args, **kwargs):
-        if self.course_module.degree_course_id != self.enrolled_degree_course.degree_course_id:
+        # 一次查询校验模块属于报名的学位课程，批量生成请使用 lufei.utils.enrollment
+        if not Course.objects.filter(id=self.course_module_id,
+                                     degree_course__enrolleddegreecourse=self.enrolled_degree_course_id).exists():
             raise ValueError("学员要开通的模块必须与其报名的学位课程一致！")
 
         super(StudyRecord, self).save(*args, **kwargs)
@@ -418,10 +420,11 @@ class Article(models.Model):
     status = models.SmallIntegerField(choices=status_choices, default=0, verbose_name="状态")
     order = models.SmallIntegerField(default=0, verbose_name="权重", help_text="文章想置顶，可以把数字调大，不要超过1000")
     vid = models.CharField(max_length=128, verbose_name="视频VID", help_text="文章类型是视频, 则需要添加视频VID", blank=True, null=True)
-    comment_num = models.SmallIntegerField(default=0, verbose_name="评论数")
-    agree_num = models.SmallIntegerField(default=0, verbose_name="点赞数")
-    view_num = models.SmallIntegerField(default=0, verbose_name="观看数")
-    collect_num = models.SmallIntegerField(default=0, verbose_name="收藏数")
+    # 计数先累加在redis(lufei.utils.counters)，由 flush_article_counters 定期写入
+    comment_num = models.IntegerField(default=0, verbose_name="评论数")
+    agree_num = models.IntegerField(default=0, verbose_name="点赞数")
+    view_num = models.IntegerField(default=0, verbose_name="观看数")
+    collect_num = models.IntegerField(default=0, verbose_name="收藏数")
 
     date = models.DateTimeField(auto_now_add=True, verbose_name="创建日期")
 
@@ -466,12 +469,42 @@ class Comment(models.Model):
     agree_number = models.IntegerField(default=0, verbose_name="赞同数")
     date = models.DateTimeField(auto_now_add=True)
 
+    # 物化路径: 从根评论到本评论的id，每级固定宽度，如 0000000012/0000000034/
+    # 按path排序即为评论树的深度优先顺序，某条评论的子树为path以其path开头的评论
+    path = models.CharField(max_length=255, blank=True, default='', editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False, verbose_name="层级")
+
+    PATH_WIDTH = 10
+    # path最多能放下的层级(从0开始): 255 // 11 - 1 = 22，更深的回复在save时拒绝
+    MAX_DEPTH = 255 // (PATH_WIDTH + 1) - 1
+
     def __str__(self):
         return self.content
 
+    def save(self, *args, **kwargs):
+        if not self.path:
+            parent = None
+            if self.p_node_id:
+                parent = Comment.objects.filter(id=self.p_node_id).values_list('path', 'depth').first()
+            parent_path, parent_depth = parent if parent else ('', -1)
+            if parent and not parent_path:
+                # 父评论还没有路径(路径回填之前的数据)，子评论会被当成根评论
+                raise ValueError("父评论%s还没有路径，请先执行 rebuild_comment_paths" % self.p_node_id)
+            if parent_depth + 1 > self.MAX_DEPTH:
+                raise ValueError("评论最多回复%s层" % self.MAX_DEPTH)
+        super(Comment, self).save(*args, **kwargs)
+        if not self.path:
+            # 路径中包含自己的id，所以插入后再更新
+            self.path = "%s%0*d/" % (parent_path, self.PATH_WIDTH, self.id)
+            self.depth = parent_depth + 1
+            Comment.objects.filter(id=self.id).update(path=self.path, depth=self.depth)
+
     class Meta:
         verbose_name = "评论表"
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['content_type', 'object_id', 'path']),
+        ]
 
 # ######################## 购买课程相关 ########################
 
@@ -604,6 +637,11 @@ class Coupon(models.Model):
     class Meta:
         verbose_name = "优惠券生成规则"
         verbose_name_plural = verbose_name
+        # 过期扫描按有效期查找优惠券
+        indexes = [
+            models.Index(fields=['valid_end_date']),
+            models.Index(fields=['coupon_valid_days']),
+        ]
 
 
 class CouponRecord(models.Model):
@@ -620,6 +658,12 @@ class CouponRecord(models.Model):
     class Meta:
         verbose_name = "优惠券交易记录表"
         verbose_name_plural = verbose_name
+        indexes = [
+            # 用户的可用优惠券
+            models.Index(fields=['status', 'account']),
+            # 过期扫描: 自领取时开始计算有效期的券
+            models.Index(fields=['coupon', 'status', 'get_time']),
+        ]
 
 
     def __str__(self):
@@ -729,7 +773,7 @@ class UserAuthToken(models.Model):
     用户Token表
     """
     user = models.OneToOneField(to="Account")
-    token = models.CharField(max_length=40)
+    token = models.CharField(max_length=40, db_index=True)
     created = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -738,10 +782,16 @@ class UserAuthToken(models.Model):
 
     def save(self, *args, **kwargs):
         import datetime
+        from lufei.utils.auth.token_cache import token_cache
 
+        old_token = self.token
         self.token = self.generate_key()
         self.created = datetime.datetime.utcnow()
-        return super(UserAuthToken, self).save(*args, **kwargs)
+        ret = super(UserAuthToken, self).save(*args, **kwargs)
+
+        # 事务提交后旧token失效，新token放入缓存
+        token_cache.set_on_commit(self, old_token)
+        return ret
 
     def generate_key(self):
         import os
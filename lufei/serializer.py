@@ -1,11 +1,109 @@
 from rest_framework import serializers
 
+from . import models
+
 
 class AuthSerializer(serializers.Serializer):
     username = serializers.CharField(error_messages={'required':'用户名不能为空'})
     password = serializers.CharField(error_messages={'required':'密码不能为空'})
 
 
+class CouponSerializer(serializers.Serializer):
+    """
+    结算页的优惠券，数据来源于 settlement.get_account_coupons 的一行
+    """
+    id = serializers.IntegerField()
+    coupon_id = serializers.IntegerField()
+    name = serializers.CharField()
+    content_type = serializers.IntegerField(source='coupon_type')
+    money_equivalent_value = serializers.IntegerField()
+    off_percent = serializers.IntegerField(allow_null=True)
+    minimum_consume = serializers.IntegerField()
+    valid_begin_date = serializers.DateField(format='%Y-%m-%d')
+    valid_end_date = serializers.DateField(format='%Y-%m-%d')
+
+
+class PricePolicySerializer(serializers.ModelSerializer):
+    valid_period_display = serializers.CharField(source='get_valid_period_display')
+
+    class Meta:
+        model = models.PricePolicy
+        fields = ('id', 'valid_period', 'valid_period_display', 'price')
+
+
+class CourseListSerializer(serializers.ModelSerializer):
+    sub_category = serializers.CharField(source='sub_category.name')
+    course_type = serializers.CharField(source='get_course_type_display')
+    level = serializers.CharField(source='get_level_display')
+    price_policy = PricePolicySerializer(many=True)
+
+    class Meta:
+        model = models.Course
+        fields = ('id', 'name', 'course_img', 'brief', 'sub_category', 'course_type', 'level', 'pub_date',
+                  'period', 'order', 'price_policy')
+
+
+class TeacherSerializer(serializers.ModelSerializer):
+    role = serializers.CharField(source='get_role_display')
+
+    class Meta:
+        model = models.Teacher
+        fields = ('id', 'name', 'role', 'title', 'signature', 'image', 'brief')
+
+
+class CourseOutlineSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.CourseOutline
+        fields = ('id', 'title', 'order', 'content')
+
+
+class CourseSectionSerializer(serializers.ModelSerializer):
+    section_type = serializers.CharField(source='get_section_type_display')
+
+    class Meta:
+        model = models.CourseSection
+        fields = ('id', 'name', 'order', 'section_type', 'section_link', 'video_time', 'free_trail')
+
+
+class CourseChapterSerializer(serializers.ModelSerializer):
+    sections = CourseSectionSerializer(source='coursesections', many=True)
+
+    class Meta:
+        model = models.CourseChapter
+        fields = ('id', 'chapter', 'name', 'summary', 'sections')
+
+
+class RecommendCourseSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.Course
+        fields = ('id', 'name', 'course_img')
+
+
+class CourseDetailSerializer(CourseListSerializer):
+    """
+    课程详情，关联数据需要在queryset中select_related/prefetch_related，见 CourseDetailView
+    """
+    detail = serializers.SerializerMethodField()
+    chapters = CourseChapterSerializer(source='coursechapters', many=True)
 
+    class Meta(CourseListSerializer.Meta):
+        fields = CourseListSerializer.Meta.fields + ('detail', 'chapters')
 
+    def get_detail(self, obj):
+        try:
+            detail = obj.coursedetail
+        except models.CourseDetail.DoesNotExist:
+            return None
+        return {
+            "hours": detail.hours,
+            "course_slogan": detail.course_slogan,
+            "video_brief_link": detail.video_brief_link,
+            "why_study": detail.why_study,
+            "what_to_study_brief": detail.what_to_study_brief,
+            "career_improvement": detail.career_improvement,
+            "prerequisite": detail.prerequisite,
+            "teachers": TeacherSerializer(detail.teachers.all(), many=True).data,
+            "recommend_courses": RecommendCourseSerializer(detail.recommend_courses.all(), many=True).data,
+            "outlines": CourseOutlineSerializer(detail.courseoutline_set.all(), many=True).data,
+        }
 
@@ -0,0 +1,322 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from lufei import models
+from lufei.utils.catalog import catalog
+from lufei.utils.auth.token_cache import token_cache
+from lufei.utils.counters import article_counter
+from lufei.utils.course_version import course_version
+from lufei.utils.dashboard import dashboard
+from lufei.utils.outline import outline_tree
+from lufei.utils.feed import article_feed
+from lufei.utils.enrollment import provision, open_first_module
+from lufei.utils.order_timeout import PENDING, order_timeout
+from lufei.utils.search import ARTICLE, COURSE, index_on_commit
+
+
+@receiver([post_save, post_delete], sender=models.Course)
+def invalidate_course_catalog(sender, instance, **kwargs):
+    catalog.invalidate_on_commit(instance.id)
+
+
+@receiver([post_save, post_delete], sender=models.PricePolicy)
+def invalidate_price_policy_catalog(sender, instance, **kwargs):
+    if instance.content_type_id == ContentType.objects.get_for_model(models.Course).id:
+        catalog.invalidate_on_commit(instance.object_id)
+
+
+@receiver(post_delete, sender=models.UserAuthToken)
+def invalidate_auth_token(sender, instance, **kwargs):
+    # 删除用户时会级联删除token，同样会触发
+    token_cache.delete_on_commit(instance.token)
+
+
+# ######################## 课程数据版本号(ETag) ########################
+
+def course_ids_of_detail(course_detail_ids):
+    return models.CourseDetail.objects.filter(id__in=course_detail_ids).values_list('course_id', flat=True)
+
+
+def course_ids_recommending(course_id):
+    """
+    推荐了这个课程的课程，课程详情中有推荐课程的名称和图片
+    """
+    return models.CourseDetail.objects.filter(recommend_courses=course_id).values_list('course_id', flat=True)
+
+
+def course_ids_of_teacher(teacher_id):
+    return models.CourseDetail.objects.filter(teachers=teacher_id).values_list('course_id', flat=True)
+
+
+# 删除课程和讲师用pre_delete: post_delete时多对多的关联已经被级联删除，查不到受影响的课程
+# pre_delete在删除的事务中发送，bump_on_commit在删除提交后才执行
+
+@receiver(post_save, sender=models.Course)
+def bump_course_version(sender, instance, created, **kwargs):
+    course_ids = [instance.id] if created else [instance.id] + list(course_ids_recommending(instance.id))
+    course_version.bump_on_commit(course_ids, course_list=True)
+
+
+@receiver(pre_delete, sender=models.Course)
+def bump_deleted_course_version(sender, instance, **kwargs):
+    course_version.bump_on_commit([instance.id] + list(course_ids_recommending(instance.id)), course_list=True)
+
+
+@receiver([post_save, post_delete], sender=models.PricePolicy)
+def bump_price_policy_version(sender, instance, **kwargs):
+    if instance.content_type_id == ContentType.objects.get_for_model(models.Course).id:
+        course_version.bump_on_commit([instance.object_id], course_list=True)
+
+
+@receiver([post_save, post_delete], sender=models.CourseSubCategory)
+def bump_sub_category_version(sender, instance, **kwargs):
+    course_version.bump_on_commit([], course_list=True)
+
+
+@receiver([post_save, post_delete], sender=models.CourseDetail)
+def bump_course_detail_version(sender, instance, **kwargs):
+    course_version.bump_on_commit([instance.course_id])
+
+
+@receiver([post_save, post_delete], sender=models.CourseOutline)
+def bump_course_outline_version(sender, instance, **kwargs):
+    course_version.bump_on_commit(course_ids_of_detail([instance.course_detail_id]))
+
+
+@receiver([post_save, post_delete], sender=models.CourseChapter)
+def bump_course_chapter_version(sender, instance, **kwargs):
+    course_version.bump_on_commit([instance.course_id])
+
+
+@receiver([post_save, post_delete], sender=models.CourseSection)
+def bump_course_section_version(sender, instance, **kwargs):
+    # 级联删除时章节可能已经不存在，章节自己的信号会处理
+    course_ids = models.CourseChapter.objects.filter(id=instance.chapter_id).values_list('course_id', flat=True)
+    course_version.bump_on_commit(course_ids)
+
+
+@receiver([post_save, pre_delete], sender=models.Teacher)
+def bump_teacher_version(sender, instance, **kwargs):
+    course_version.bump_on_commit(course_ids_of_teacher(instance.id))
+
+
+@receiver(m2m_changed, sender=models.CourseDetail.teachers.through)
+@receiver(m2m_changed, sender=models.CourseDetail.recommend_courses.through)
+def bump_course_detail_m2m_version(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        course_version.bump_on_commit([instance.course_id])
+    else:
+        # 从讲师或被推荐课程一侧修改，pk_set为CourseDetail的id
+        course_version.bump_on_commit(course_ids_of_detail(pk_set or []))
+
+
+# ######################## 课程大纲缓存 ########################
+# 受影响的课程在事务中查出，提交后再重建，否则并发的读取会把提交前的数据写入缓存
+
+def rebuild_outline_details_on_commit(course_ids):
+    course_ids = list(course_ids)
+    transaction.on_commit(lambda: [outline_tree.rebuild_detail(course_id) for course_id in course_ids])
+
+
+@receiver(post_save, sender=models.Course)
+def rebuild_recommend_outline(sender, instance, created, **kwargs):
+    # 推荐课程的名称和图片在其它课程的大纲中
+    if not created:
+        rebuild_outline_details_on_commit(course_ids_recommending(instance.id))
+
+
+@receiver(post_save, sender=models.Course)
+def remove_offline_course_outline(sender, instance, created, **kwargs):
+    # 只缓存上线课程的大纲，下线或预上线时删除，再次上线后第一次读取时重建
+    if instance.status != 0:
+        course_id = instance.id
+        transaction.on_commit(lambda: outline_tree.remove(course_id))
+
+
+@receiver(pre_delete, sender=models.Course)
+def remove_course_outline(sender, instance, **kwargs):
+    course_id = instance.id
+    rebuild_outline_details_on_commit(course_ids_recommending(course_id))
+    transaction.on_commit(lambda: outline_tree.remove(course_id))
+
+
+@receiver([post_save, post_delete], sender=models.CourseDetail)
+def rebuild_course_detail_outline(sender, instance, **kwargs):
+    rebuild_outline_details_on_commit([instance.course_id])
+
+
+@receiver([post_save, post_delete], sender=models.CourseOutline)
+def rebuild_course_outline_outline(sender, instance, **kwargs):
+    rebuild_outline_details_on_commit(course_ids_of_detail([instance.course_detail_id]))
+
+
+@receiver([post_save, pre_delete], sender=models.Teacher)
+def rebuild_teacher_outline(sender, instance, **kwargs):
+    rebuild_outline_details_on_commit(course_ids_of_teacher(instance.id))
+
+
+@receiver(m2m_changed, sender=models.CourseDetail.teachers.through)
+@receiver(m2m_changed, sender=models.CourseDetail.recommend_courses.through)
+def rebuild_course_detail_m2m_outline(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    rebuild_outline_details_on_commit([instance.course_id] if not reverse else course_ids_of_detail(pk_set or []))
+
+
+@receiver(post_save, sender=models.CourseChapter)
+def rebuild_course_chapter_outline(sender, instance, **kwargs):
+    course_id, chapter_id = instance.course_id, instance.id
+    transaction.on_commit(lambda: outline_tree.rebuild_chapter(course_id, chapter_id))
+
+
+@receiver(post_delete, sender=models.CourseChapter)
+def remove_course_chapter_outline(sender, instance, **kwargs):
+    course_id, chapter_id = instance.course_id, instance.id
+    transaction.on_commit(lambda: outline_tree.remove_chapter(course_id, chapter_id))
+
+
+@receiver([post_save, post_delete], sender=models.CourseSection)
+def rebuild_course_section_outline(sender, instance, **kwargs):
+    chapter_id = instance.chapter_id
+    for course_id in models.CourseChapter.objects.filter(id=chapter_id).values_list('course_id', flat=True):
+        transaction.on_commit(lambda course_id=course_id: outline_tree.rebuild_chapter(course_id, chapter_id))
+
+
+# ######################## 学位课程报名 ########################
+
+@receiver(post_save, sender=models.EnrolledDegreeCourse)
+def provision_study_records(sender, instance, created, **kwargs):
+    if created:
+        provision(instance)
+
+
+@receiver(post_save, sender=models.DegreeRegistrationForm)
+def open_registration_first_module(sender, instance, created, **kwargs):
+    if created and instance.open_module:
+        open_first_module(instance.enrolled_degree)
+
+
+
+# ######################## 订单超时队列 ########################
+
+@receiver(post_save, sender=models.Order)
+def remove_order_timeout(sender, instance, created, **kwargs):
+    # 支付成功、主动取消等不再待支付的订单移出超时队列；超时取消用update，不会触发
+    if not created and instance.status != PENDING:
+        order_id = instance.id
+        transaction.on_commit(lambda: order_timeout.remove(order_id))
+
+
+# ######################## 文章信息流 ########################
+# 事务提交后再更新，回滚的修改不会出现在信息流中
+
+@receiver(post_save, sender=models.Article)
+def update_article_feed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: article_feed.update(instance))
+
+
+@receiver(post_delete, sender=models.Article)
+def remove_article_feed(sender, instance, **kwargs):
+    article_id = instance.id
+    transaction.on_commit(lambda: article_feed.remove(article_id))
+
+
+# ######################## 文章计数 ########################
+# 事务提交后再累加，回滚的评论/收藏不会计入
+
+def is_article(instance):
+    return instance.content_type_id == ContentType.objects.get_for_model(models.Article).id
+
+
+@receiver(post_save, sender=models.Comment)
+def count_article_comment(sender, instance, created, **kwargs):
+    if created and is_article(instance):
+        article_counter.incr_on_commit(instance.object_id, 'comment_num')
+
+
+@receiver(post_delete, sender=models.Comment)
+def uncount_article_comment(sender, instance, **kwargs):
+    if is_article(instance):
+        article_counter.incr_on_commit(instance.object_id, 'comment_num', -1)
+
+
+@receiver(post_save, sender=models.Collection)
+def count_article_collection(sender, instance, created, **kwargs):
+    if created and is_article(instance):
+        article_counter.incr_on_commit(instance.object_id, 'collect_num')
+
+
+@receiver(post_delete, sender=models.Collection)
+def uncount_article_collection(sender, instance, **kwargs):
+    if is_article(instance):
+        article_counter.incr_on_commit(instance.object_id, 'collect_num', -1)
+
+
+# ######################## 搜索索引 ########################
+# 事务提交后按数据库中的数据更新，同一个事务中的多次修改只索引一次
+
+@receiver([post_save, post_delete], sender=models.Course)
+def index_course(sender, instance, **kwargs):
+    index_on_commit(COURSE, [instance.id])
+
+
+@receiver([post_save, post_delete], sender=models.CourseDetail)
+def index_course_detail(sender, instance, **kwargs):
+    index_on_commit(COURSE, [instance.course_id])
+
+
+@receiver([post_save, post_delete], sender=models.Article)
+def index_article(sender, instance, **kwargs):
+    index_on_commit(ARTICLE, [instance.id])
+
+
+# ######################## 我的课程/学习进度 ########################
+# 放在学位课程报名的信号之后，报名时先生成学习记录再重建
+
+@receiver([post_save, post_delete], sender=models.EnrolledCourse)
+@receiver([post_save, post_delete], sender=models.EnrolledDegreeCourse)
+def refresh_enrollment_dashboard(sender, instance, **kwargs):
+    dashboard.refresh_on_commit([instance.account_id])
+
+
+@receiver([post_save, post_delete], sender=models.StudyRecord)
+def refresh_study_record_dashboard(sender, instance, **kwargs):
+    dashboard.refresh_on_commit(models.EnrolledDegreeCourse.objects.filter(
+        id=instance.enrolled_degree_course_id).values_list('account_id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=models.HomeworkRecord)
+def refresh_homework_record_dashboard(sender, instance, **kwargs):
+    dashboard.refresh_on_commit(models.EnrolledDegreeCourse.objects.filter(
+        id=instance.student_id).values_list('account_id', flat=True))
+
+
+# 课程名称/图片、学位课程名称/图片、作业数在很多账户的读模型中，只删除，读取时再重建
+
+@receiver(post_save, sender=models.Course)
+def invalidate_course_dashboard(sender, instance, created, **kwargs):
+    if created:
+        return
+    account_ids = set(models.EnrolledCourse.objects.filter(course_id=instance.id).values_list(
+        'account_id', flat=True))
+    account_ids.update(models.StudyRecord.objects.filter(course_module_id=instance.id).values_list(
+        'enrolled_degree_course__account_id', flat=True))
+    dashboard.invalidate_on_commit(account_ids)
+
+
+@receiver(post_save, sender=models.DegreeCourse)
+def invalidate_degree_course_dashboard(sender, instance, created, **kwargs):
+    if not created:
+        dashboard.invalidate_on_commit(models.EnrolledDegreeCourse.objects.filter(
+            degree_course_id=instance.id).values_list('account_id', flat=True).distinct())
+
+
+@receiver([post_save, post_delete], sender=models.Homework)
+def invalidate_homework_dashboard(sender, instance, **kwargs):
+    dashboard.invalidate_on_commit(models.StudyRecord.objects.filter(
+        course_module__coursechapters=instance.chapter_id).values_list(
+        'enrolled_degree_course__account_id', flat=True).distinct())
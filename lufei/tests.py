@@ -1,3 +1,523 @@
-from django.test import TestCase
+import datetime
+import json
+import random
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from lufei import models
+from lufei.management.commands.bench_pricing import brute_force
+from lufei.management.commands.drain_coupon_claims import Command as DrainCouponClaims
+from lufei.utils import catalog_io
+from lufei.utils.auth.token_cache import TokenCache
+from lufei.utils.coupon_stock import CLAIMED, coupon_stock
+from lufei.utils.dashboard import dashboard
+from lufei.utils.enrollment import open_first_module, provision
+from lufei.utils.loadtest import compare
+from lufei.utils.pool import POOL, create_pool
+from lufei.utils.pricing import best_assignment
+from lufei.utils.query_budget import QueryBudgetExceeded, QueryLog, assert_queries, shape
+from lufei.utils.search import ARTICLE, SearchIndex
+
+try:
+    import fakeredis
+    import lupa  # fakeredis执行lua脚本需要
+except ImportError:
+    fakeredis = None
+
+TOKEN = "a3f9c2e1b7d04c5e8f6a2b1c9d0e7f3a"
+
+
+class ShapeTest(SimpleTestCase):
+
+    def test_in_list_and_numbers(self):
+        self.assertEqual(
+            shape("SELECT * FROM t WHERE id IN (%s, %s, %s) LIMIT 21"),
+            shape("SELECT *  FROM t WHERE id IN (%s, %s) LIMIT 5"),
+        )
+
+    def test_different_tables(self):
+        self.assertNotEqual(shape("SELECT * FROM a WHERE id = %s"), shape("SELECT * FROM b WHERE id = %s"))
+
+    def test_repeated(self):
+        log = QueryLog()
+        for _ in range(4):
+            log(lambda sql, params, many, context: None, "SELECT * FROM t WHERE id = %s", [1], False, {})
+        self.assertEqual(len(log.repeated(3)), 1)
+        self.assertEqual(log.repeated(4), [])
+
+
+class CompareTest(SimpleTestCase):
+
+    def result(self, p95, rps):
+        stats = {"p95": p95, "rps": rps}
+        return {"endpoints": {"GET shopping_car/": stats}, "total": stats}
+
+    def test_regression(self):
+        rows = compare(self.result(10, 100), self.result(15, 100), 0.2)
+        self.assertEqual([(endpoint, metric) for endpoint, metric, _, _, _, regressed in rows if regressed],
+                         [("GET shopping_car/", "p95"), ("total", "p95")])
+
+    def test_within_threshold(self):
+        rows = compare(self.result(10, 100), self.result(11, 90), 0.2)
+        self.assertFalse(any(row[-1] for row in rows))
+
+
+class PricingTest(SimpleTestCase):
+    """
+    优惠券组合与穷举结果一致
+    """
+
+    def coupon(self, coupon_id, coupon_type, value=0, minimum_consume=0, off_percent=None):
+        return {"id": coupon_id, "content_type": coupon_type, "money_equivalent_value": value,
+                "minimum_consume": minimum_consume, "off_percent": off_percent}
+
+    def small_cart(self, rng):
+        """
+        价格、面额、门槛取值很少，经常出现并列和恰好等于门槛的情况；课程券只绑定部分课程
+        """
+        courses = [{"id": i, "price": float(rng.choice((100, 200, 300))), "coupons": []}
+                   for i in range(rng.randint(1, 3))]
+        global_coupons = []
+        for coupon_id in range(rng.randint(0, 6)):
+            coupon_type = rng.choice((0, 1, 2))
+            coupon = self.coupon(
+                coupon_id, coupon_type,
+                value=rng.choice((20, 50, 100)) if coupon_type != 2 else 0,
+                minimum_consume=rng.choice((0, 100, 200, 300, 400, 600)) if coupon_type == 1 else 0,
+                off_percent=rng.choice((50, 80, 90)) if coupon_type == 2 else None,
+            )
+            if rng.random() < 0.5:
+                global_coupons.append(coupon)
+            else:
+                rng.choice(courses)["coupons"].append(coupon)
+        return courses, global_coupons
+
+    def test_matches_brute_force(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            courses, global_coupons = self.small_cart(rng)
+            self.assertAlmostEqual(best_assignment(courses, global_coupons)["total"],
+                                   brute_force(courses, global_coupons), places=2,
+                                   msg=(courses, global_coupons))
+
+    def test_full_cut_threshold_boundary(self):
+        courses = [{"id": 1, "price": 300.0, "coupons": [self.coupon(1, 1, 50, minimum_consume=300),
+                                                          self.coupon(2, 1, 80, minimum_consume=301)]}]
+        result = best_assignment(courses, [])
+        self.assertEqual((result["courses"][1]["coupon"], result["total"]), (1, 250))
+
+        # 通用满减券的门槛按原价合计计算，不是课程券抵扣后的价格
+        courses = [{"id": 1, "price": 300.0, "coupons": [self.coupon(1, 0, 100)]}]
+        result = best_assignment(courses, [self.coupon(2, 1, 50, minimum_consume=300)])
+        self.assertEqual((result["global_coupon"], result["total"]), (2, 150))
+
+    def test_tie_and_unbound_course(self):
+        courses = [
+            {"id": 1, "price": 200.0, "coupons": [self.coupon(1, 0, 100), self.coupon(2, 2, off_percent=50)]},
+            {"id": 2, "price": 100.0, "coupons": []},
+        ]
+        result = best_assignment(courses, [])
+        self.assertIn(result["courses"][1]["coupon"], (1, 2))
+        self.assertEqual(result["courses"][2], {"coupon": None, "price": 100})
+        self.assertEqual(result["total"], 200)
+
+
+@unittest.skipIf(fakeredis is None, "需要安装 fakeredis 和 lupa")
+class TokenCacheTest(SimpleTestCase):
+
+    def wait(self, condition):
+        deadline = time.time() + 3
+        while not condition():
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def test_revoke_other_process(self):
+        server = fakeredis.FakeServer()
+        caches = [TokenCache(conn=fakeredis.FakeRedis(server=server)) for _ in range(2)]
+        user = models.Account(id=1, username="alex", uid="alex")
+        caches[0].set(models.UserAuthToken(id=1, user=user, token=TOKEN))
+
+        # 另一个进程的缓存: 订阅后第二次读取命中进程内缓存
+        other = caches[1]
+        other.get(TOKEN)
+        self.wait(lambda: other.stats()["listening"])
+        other.get(TOKEN)
+        other.get(TOKEN)
+        self.assertEqual(other.stats()["local"], 1)
+
+        caches[0].delete(TOKEN)
+        self.wait(lambda: other.local.get(TOKEN) is None)
+        self.assertIsNone(other.get(TOKEN))
+        self.assertEqual(other.stats()["miss"], 1)
+
+
+@unittest.skipIf(fakeredis is None, "需要安装 fakeredis 和 lupa")
+class FakeRedisTestCase(TestCase):
+    fixtures = ['lufei_test']
+
+    @classmethod
+    def setUpClass(cls):
+        # 加载fixtures时信号会写redis，要在加载之前换成fakeredis
+        server = fakeredis.FakeServer()
+        POOL.configure(lambda: fakeredis.FakeRedis(server=server).connection_pool)
+        super(FakeRedisTestCase, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(FakeRedisTestCase, cls).tearDownClass()
+        POOL.configure(create_pool)
+
+
+@override_settings(QUERY_BUDGET={"ENABLED": True, "RAISE": True})
+class QueryBudgetTest(FakeRedisTestCase):
+    """
+    每个接口都在视图声明的 query_budget 内，且没有N+1
+    """
+
+    def api(self, method, path, data=None, token=True):
+        path = "/api/v1/%s" % path
+        if token:
+            path += ("&" if "?" in path else "?") + "token=" + TOKEN
+        if method == "get":
+            response = self.client.get(path, data)
+        else:
+            response = getattr(self.client, method)(path, json.dumps(data or {}), content_type="application/json")
+        self.assertIn(response.status_code, (200, 304))
+        return response
+
+    def test_auth(self):
+        self.assertEqual(self.api("post", "auth/", {"username": "alex", "password": "123"}, token=False).data["code"], 1002)
+
+    def test_courses(self):
+        self.assertEqual(len(self.api("get", "courses/", token=False).data["data"]), 4)
+        self.api("get", "courses/1/", token=False)
+        self.api("get", "courses/1/outline/", token=False)
+
+    def test_offline_course_outline(self):
+        models.Course.objects.filter(id=3).update(status=1)
+        self.assertEqual(self.client.get("/api/v1/courses/3/outline/").status_code, 404)
+        self.assertEqual(self.client.get("/api/v1/courses/3/").status_code, 404)
+
+    def test_shopping_car_and_account(self):
+        self.api("post", "shopping_car/", {"course_id": 1, "price_policy_id": 1})
+        self.api("post", "shopping_car/", {"course_id": 2, "price_policy_id": 3})
+        for course_id in (None, "abc"):
+            self.assertEqual(self.api("post", "shopping_car/", {"course_id": course_id, "price_policy_id": 3})
+                             .data["code"], 1001)
+        self.api("put", "shopping_car/", {"course_id": 2, "price_policy_id": 4})
+        for price_policy_id in (None, "abc"):
+            self.assertEqual(self.api("put", "shopping_car/", {"course_id": 2, "price_policy_id": price_policy_id})
+                             .data["code"], 1001)
+        self.api("get", "shopping_car/")
+        self.api("post", "accounts/", {"course_id": 1, "de_price_policy_id": 1})
+        self.api("get", "accounts/")
+        self.api("delete", "shopping_car/", {"course_id": 2})
+
+    def test_settlement_queries_independent_of_coupons(self):
+        self.api("post", "shopping_car/", {"course_id": 1, "price_policy_id": 1})
+        # 第一次请求会缓存token和课程目录
+        self.api("post", "accounts/", {"course_id": 1, "de_price_policy_id": 1})
+
+        def settle():
+            with assert_queries() as post_log:
+                self.api("post", "accounts/", {"course_id": 1, "de_price_policy_id": 1})
+            with assert_queries() as get_log:
+                self.api("get", "accounts/")
+            return len(post_log), len(get_log)
+
+        before = settle()
+        models.CouponRecord.objects.bulk_create([
+            models.CouponRecord(coupon_id=coupon_id, account_id=1, get_time="2018-01-01T00:00:00Z")
+            for coupon_id in (1, 2) for _ in range(20)
+        ])
+        after = settle()
+        self.assertEqual(before, after)
+        self.assertEqual(len(self.api("get", "accounts/").data[-1]["my_coupon_list"]), 21)
+
+    def test_batch_account_and_pay(self):
+        for course_id in range(1, 5):
+            self.api("post", "shopping_car/", {"course_id": course_id, "price_policy_id": course_id * 2 - 1})
+        self.assertEqual(self.api("post", "accounts/batch/", {"courses": []}).data["code"], 1001)
+        self.api("post", "accounts/batch/", {"courses": [
+            {"course_id": course_id, "price_policy_id": course_id * 2 - 1} for course_id in range(1, 5)]})
+        self.assertEqual(self.api("post", "pay/", {"payment_type": 3, "balance": -100, "auto_coupon": True}).data["code"],
+                         1001)
+        self.assertFalse(models.Order.objects.exists())
+
+        # 4个课程各99，课程1用满减券(满50减20)，再用通用券减10: 396 - 20 - 10 = 366，再用100贝里
+        data = self.api("post", "pay/", {"payment_type": 3, "balance": 100, "auto_coupon": True,
+                                          "actual_amount": 266}).data
+        self.assertEqual(data["code"], 1000)
+        order = models.Order.objects.get(order_number=data["data"]["order_number"])
+        self.assertEqual((order.actual_amount, order.status, order.account_id), (266, 1, 1))
+        self.assertEqual(models.OrderDetail.objects.filter(order=order).count(), 4)
+        self.assertEqual(models.Account.objects.get(id=1).balance, 900)
+        self.assertEqual(set(models.CouponRecord.objects.filter(id__in=[1, 2]).values_list('status', 'order_id')),
+                         {(1, order.id)})
+        self.assertEqual(models.TransactionRecord.objects.get(object_id=order.id, transaction_type=1).amount, 100)
+
+    def test_coupon_claim(self):
+        self.api("post", "coupons/claim/", {"coupon_id": 1})
+
+    def test_coupon_claim_no_oversell(self):
+        today = datetime.date.today()
+        coupon = models.Coupon.objects.create(name="限量券", money_equivalent_value=10, quantity=10, open_date=today,
+                                              close_date=today, valid_begin_date=today,
+                                              valid_end_date=today + datetime.timedelta(days=30))
+        models.Account.objects.bulk_create([
+            models.Account(id=100 + i, username="user%s" % i, uid="uid%s" % i, password="123") for i in range(30)])
+        coupon_stock.load(coupon)
+
+        # 30个账户各并发领两次，库存10张
+        account_ids = [100 + i for i in range(30)] * 2
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(lambda account_id: coupon_stock.claim(coupon.id, account_id), account_ids))
+        self.assertEqual(results.count(CLAIMED), 10)
+        self.assertEqual(coupon_stock.remaining(coupon.id), 0)
+
+        self.assertEqual(DrainCouponClaims().drain(1000), 10)
+        records = models.CouponRecord.objects.filter(coupon=coupon)
+        self.assertEqual(records.count(), 10)
+        self.assertEqual(len(set(records.values_list('account_id', flat=True))), 10)
+
+    def test_dashboard(self):
+        self.api("get", "dashboard/")
+
+    def test_articles(self):
+        self.api("get", "articles/", token=False)
+        self.api("get", "articles/1/counters/", token=False)
+        self.assertTrue(self.api("post", "articles/1/counters/", {"field": "agree_num"}).data["counted"])
+        self.assertFalse(self.api("post", "articles/1/counters/", {"field": "agree_num"}).data["counted"])
+        self.assertEqual(self.client.post("/api/v1/articles/1/counters/", {"field": "agree_num"}).status_code, 403)
+        self.assertEqual(self.client.post("/api/v1/articles/999/counters/?token=%s" % TOKEN,
+                                          {"field": "agree_num"}).status_code, 404)
+        self.api("get", "comments/?type=article&object_id=1", token=False)
+        self.api("get", "search/?q=python", token=False)
+
+    def test_comment_paths(self):
+        reply = models.Comment(content_type_id=models.Comment.objects.get(id=1).content_type_id, object_id=1,
+                               p_node_id=2, content="回复", account_id=1)
+        reply.save()
+        self.assertEqual((reply.path, reply.depth), ("0000000001/0000000002/%010d/" % reply.id, 2))
+
+        # 父评论还没有路径时拒绝，不能当成根评论
+        models.Comment.objects.filter(id=reply.id).update(path='')
+        with self.assertRaises(ValueError):
+            models.Comment(content_type_id=reply.content_type_id, object_id=1, p_node_id=reply.id,
+                           content="回复", account_id=1).save()
+
+        for query in ("depth=-1", "size=-5", "size=0"):
+            self.assertEqual(self.client.get("/api/v1/comments/?type=article&object_id=1&" + query).status_code, 400)
+
+    def test_internal(self):
+        self.api("get", "redis_pool/", token=False)
+        self.api("get", "metrics/", token=False)
+
+    def test_detects_n_plus_one(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with assert_queries():
+                [course.sub_category.name for course in models.Course.objects.all()]
+        with assert_queries(1):
+            [course.sub_category.name for course in models.Course.objects.select_related('sub_category')]
+
+
+class JobsTest(FakeRedisTestCase):
+    """
+    批处理任务的结果
+    """
+
+    def degree_world(self):
+        """
+        学位课程: 模块1有两个作业(推荐7天、3天)，模块2有一个作业；账户1已报名
+        """
+        degree = models.DegreeCourse.objects.create(name="Python全栈", course_img="img/d.png", brief="学位课",
+                                                    prerequisite="无")
+        self.modules, self.homeworks = [], []
+        for order, periods in ((1, (7, 3)), (2, (5,))):
+            module = models.Course.objects.create(name="模块%s" % order, course_img="img/m.png", sub_category_id=1,
+                                                  course_type=2, degree_course=degree, brief="模块", order=order)
+            chapter = models.CourseChapter.objects.create(course=module, chapter=1, name="第一章")
+            for index, period in enumerate(periods):
+                self.homeworks.append(models.Homework.objects.create(
+                    chapter=chapter, title="作业%s" % index, order=index, requirement="需求", threshold="踩分点",
+                    recommend_period=period, scholarship_value=100))
+            self.modules.append(module)
+
+        order = models.Order.objects.create(payment_type=3, order_number="O1", account_id=1, actual_amount=0, status=0)
+        detail = models.OrderDetail.objects.create(
+            order=order, content_type=ContentType.objects.get_for_model(models.DegreeCourse), object_id=degree.id,
+            original_price=0, price=0, valid_period_display="1个月", valid_period=30)
+        return models.EnrolledDegreeCourse.objects.create(account_id=1, degree_course=degree, mentor_fee_balance=0,
+                                                          order_detail=detail)
+
+    def test_enrollment_provisioning(self):
+        enrolled = self.degree_world()
+        # 报名时为每个模块生成未开通的学习记录
+        self.assertEqual(list(models.StudyRecord.objects.filter(enrolled_degree_course=enrolled).order_by(
+            'course_module__order').values_list('course_module_id', 'status')),
+            [(self.modules[0].id, 1), (self.modules[1].id, 1)])
+        self.assertEqual(provision(enrolled), 0)
+
+        # 开通第一个模块: 按作业顺序累加推荐周期生成学习计划，重复开通不会重复生成
+        self.assertEqual(open_first_module(enrolled, start_date=datetime.date(2018, 1, 1)), 2)
+        self.assertEqual(open_first_module(enrolled, start_date=datetime.date(2018, 1, 1)), 0)
+        self.assertEqual(list(models.CourseSchedule.objects.filter(
+            study_record__enrolled_degree_course=enrolled).order_by('recommend_date').values_list(
+            'homework_id', 'recommend_date')),
+            [(self.homeworks[0].id, datetime.date(2018, 1, 8)), (self.homeworks[1].id, datetime.date(2018, 1, 11))])
+        self.assertEqual(dict(models.StudyRecord.objects.filter(enrolled_degree_course=enrolled).values_list(
+            'course_module_id', 'status')), {self.modules[0].id: 2, self.modules[1].id: 1})
+
+    def test_settle_homework_rewards(self):
+        enrolled = self.degree_world()
+        open_first_module(enrolled, start_date=datetime.date(2018, 1, 1))
+        # 作业0推荐1月8日前提交，作业1推荐1月11日前提交，模块2没有开通、没有学习计划
+        submitted = (datetime.datetime(2018, 1, 8, 12), datetime.datetime(2018, 1, 12), datetime.datetime(2018, 1, 1))
+        records = []
+        for homework, date in zip(self.homeworks, submitted):
+            record = models.HomeworkRecord.objects.create(homework=homework, student=enrolled, mentor_id=2, status=1)
+            models.HomeworkRecord.objects.filter(id=record.id).update(date=timezone.make_aware(date))
+            records.append(record.id)
+
+        for _ in range(2):
+            call_command('settle_homework_rewards', stdout=StringIO())
+        self.assertEqual(list(models.HomeworkRecord.objects.filter(id__in=records).order_by('id').values_list(
+            'reward_status', flat=True)), [3, 4, 5])
+        # 只有按时提交的作业发放奖学金，重复执行不会重复发放
+        self.assertEqual(models.Account.objects.get(id=1).balance, 1100)
+        transaction = models.TransactionRecord.objects.get(transaction_type=0)
+        self.assertEqual((transaction.object_id, transaction.amount, transaction.balance), (records[0], 100, 1100))
+
+    def test_expire_coupons(self):
+        today = timezone.localtime(timezone.now()).date()
+        fixed = models.Coupon.objects.create(name="过期券", money_equivalent_value=10, open_date=today - datetime.timedelta(
+            days=60), close_date=today - datetime.timedelta(days=30), valid_begin_date=today - datetime.timedelta(
+            days=60), valid_end_date=today - datetime.timedelta(days=1))
+        relative = models.Coupon.objects.create(name="领取后7天有效", money_equivalent_value=10, open_date=today,
+                                                close_date=today, coupon_valid_days=7)
+        now = timezone.now()
+        records = {}
+        for name, coupon, days, status in (("fixed", fixed, 0, 0), ("fixed_used", fixed, 0, 1),
+                                           ("relative_old", relative, 10, 0), ("relative_old2", relative, 30, 0),
+                                           ("relative_new", relative, 1, 0), ("global", 1, 100, 0)):
+            records[name] = models.CouponRecord.objects.create(
+                coupon_id=getattr(coupon, 'id', coupon), account_id=2, status=status,
+                get_time=now - datetime.timedelta(days=days)).id
+
+        # 每批只更新一条，验证分批循环能处理完
+        call_command('expire_coupons', batch_size=1, sleep=0, stdout=StringIO())
+        status = dict(models.CouponRecord.objects.values_list('id', 'status'))
+        self.assertEqual({name: status[record_id] for name, record_id in records.items()}, {
+            "fixed": 2, "fixed_used": 1, "relative_old": 2, "relative_old2": 2, "relative_new": 0, "global": 0})
+        # fixture中的券有效期到2099年
+        self.assertEqual((status[1], status[2]), (0, 0))
+
+    def test_search_ranking(self):
+        documents = [
+            ("course:1", "python入门", "基础语法"),
+            ("course:2", "web开发", "使用python和django"),
+            ("article:3", "django教程", "python web"),
+        ]
+        index, bulk = SearchIndex(prefix="test_luffy_search"), SearchIndex(prefix="test_luffy_search_bulk")
+        for search_index in (index, bulk):
+            search_index.clear()
+            self.addCleanup(search_index.clear)
+        for document in documents:
+            index.index(*document)
+        self.assertEqual(bulk.bulk_index(documents), 3)
+
+        def ranking(search_index, query, doc_type=None):
+            return [(doc_type_, doc_id, round(score, 6)) for doc_type_, doc_id, score in
+                    search_index.search(query, doc_type=doc_type)]
+
+        # 标题中的词权重高；词频相同时文档越短分数越高
+        self.assertEqual([doc[:2] for doc in ranking(index, "python ")],
+                         [("course", 1), ("article", 3), ("course", 2)])
+        self.assertEqual([doc[:2] for doc in ranking(index, "python", doc_type=ARTICLE)], [("article", 3)])
+        # 最后一个词按前缀匹配
+        self.assertEqual([doc[:2] for doc in ranking(index, "dja")], [])
+        self.assertEqual([doc[:2] for doc in ranking(index, "dj")], [("article", 3), ("course", 2)])
+        # 增量索引和全量索引的结果一致
+        for query in ("python ", "web", "dj"):
+            self.assertEqual(ranking(index, query), ranking(bulk, query))
+
+        index.remove("course:1")
+        index.index("course:2", "python进阶", "使用python和django")
+        self.assertEqual([doc[:2] for doc in ranking(index, "python ")], [("course", 2), ("article", 3)])
+        self.assertEqual(ranking(index, "入门"), [])
+
+    def test_rebuild_dashboards(self):
+        enrolled = self.degree_world()
+        open_first_module(enrolled, start_date=datetime.date(2018, 1, 1))
+        models.HomeworkRecord.objects.create(homework=self.homeworks[0], student=enrolled, mentor_id=2, status=1)
+        order = models.Order.objects.create(payment_type=3, order_number="O2", account_id=2, actual_amount=99, status=0)
+        detail = models.OrderDetail.objects.create(
+            order=order, content_type=ContentType.objects.get_for_model(models.Course), object_id=1,
+            original_price=99, price=99, valid_period_display="1个月", valid_period=30)
+        models.EnrolledCourse.objects.create(account_id=2, course_id=1, valid_begin_date=datetime.date(2018, 1, 1),
+                                             valid_end_date=datetime.date(2018, 1, 31), order_detail=detail)
+        dashboard.invalidate([1, 2])
+
+        call_command('rebuild_dashboards', workers=1, chunk_size=1, stdout=StringIO())
+        for account_id in (1, 2):
+            self.assertGreater(dashboard.conn.ttl(dashboard.key_for(account_id)), 0)
+        data = json.loads(dashboard.conn.get(dashboard.key_for(1)).decode('utf-8'))
+        self.assertEqual(data["courses"], [])
+        degree, = data["degree_courses"]
+        self.assertEqual((degree["name"], degree["homework"], degree["progress"]),
+                         ("Python全栈", {"pending": 0, "passed": 1, "failed": 0}, 0))
+        self.assertEqual([(module["id"], module["status"], module["homework_total"], module["homework_passed"])
+                          for module in degree["modules"]],
+                         [(self.modules[0].id, 2, 2, 1), (self.modules[1].id, 1, 1, 0)])
+        data = json.loads(dashboard.conn.get(dashboard.key_for(2)).decode('utf-8'))
+        self.assertEqual(([course["id"] for course in data["courses"]], data["degree_courses"]), ([1], []))
+
+        # 删除后下次读取时重建
+        dashboard.invalidate([1])
+        self.assertIsNone(dashboard.conn.get(dashboard.key_for(1)))
+        self.assertEqual(dashboard.get(1)["degree_courses"][0]["modules"][0]["homework_passed"], 1)
+        self.assertIsNotNone(dashboard.conn.get(dashboard.key_for(1)))
+
+    def test_catalog_round_trip(self):
+        def normalize(document):
+            return json.loads(catalog_io.dumps(document))
+
+        original = [normalize(document) for document in catalog_io.export_documents(chunk_size=3)]
+        self.assertEqual([document["name"] for document in original],
+                         ["Python开发入门", "Django框架实战", "Linux运维基础", "MySQL数据库优化"])
+        self.assertEqual(original[0]["chapters"][0]["sections"][0]["section_link"], "vid_0001")
+
+        for fmt in catalog_io.FORMATS:
+            # 课程名已存在的会跳过，改名后导入
+            documents = [dict(document, name="%s(%s)" % (document["name"], fmt)) for document in original]
+            stream = StringIO()
+            self.assertEqual(catalog_io.write_documents(documents, stream, fmt), 4)
+            stream.seek(0)
+            importer = catalog_io.CatalogImporter()
+            for chunk in catalog_io.read_chunks(stream, fmt, 3):
+                parsed, errors = catalog_io.parse_chunk(chunk, fmt)
+                self.assertEqual(errors, [])
+                course_ids, errors = importer.import_chunk(parsed)
+                self.assertEqual((len(course_ids), errors), (len(parsed), []))
+
+            exported = {document["name"]: normalize(document) for document in catalog_io.export_documents()}
+            for document in documents:
+                self.assertEqual(exported[document["name"]], document)
+        self.assertEqual(models.CourseSubCategory.objects.count(), 1)
+
+        # 已存在的课程跳过；子类名已属于其它大类时报错，不会新建大类和课程
+        parsed, errors = catalog_io.parse_chunk([
+            (1, json.dumps(dict(original[0]))),
+            (2, json.dumps(dict(original[0], name="Shell编程", category="运维"))),
+        ], catalog_io.JSONL)
+        self.assertEqual(errors, [])
+        course_ids, errors = catalog_io.CatalogImporter().import_chunk(parsed)
+        self.assertEqual((course_ids, errors), ([], [(1, "课程已存在: Python开发入门"), (2, "子类python属于大类后端")]))
+        self.assertFalse(models.CourseCategory.objects.filter(name="运维").exists())
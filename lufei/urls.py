@@ -5,7 +5,20 @@ from . import views
 urlpatterns = [
     url(r'^auth/',views.AuthView.as_view()),
     url(r'^shopping_car/',views.ShoppingCarView.as_view()),
+    url(r'^accounts/batch/',views.BatchAccountView.as_view()),
     url(r'^accounts/',views.AccountView.as_view()),
+    url(r'^pay/',views.PayView.as_view()),
+    url(r'^dashboard/',views.DashboardView.as_view()),
+    url(r'^coupons/claim/',views.CouponClaimView.as_view()),
+    url(r'^comments/',views.CommentView.as_view()),
+    url(r'^articles/$',views.ArticleFeedView.as_view()),
+    url(r'^articles/(?P<pk>\d+)/counters/$',views.ArticleCounterView.as_view()),
+    url(r'^search/',views.SearchView.as_view()),
+    url(r'^courses/$',views.CourseView.as_view()),
+    url(r'^courses/(?P<pk>\d+)/$',views.CourseDetailView.as_view()),
+    url(r'^courses/(?P<pk>\d+)/outline/$',views.CourseOutlineView.as_view()),
+    url(r'^redis_pool/',views.RedisPoolView.as_view()),
+    url(r'^metrics/',views.MetricsView.as_view()),
 
 ]
 
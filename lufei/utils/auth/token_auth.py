@@ -6,6 +6,7 @@ from django.utils.translation import ugettext_lazy as _
 
 from rest_framework import HTTP_HEADER_ENCODING, exceptions
 from lufei.models import UserAuthToken
+from lufei.utils.auth.token_cache import token_cache
 
 
 class LuffyTokenAuthentication(BaseAuthentication):
@@ -22,9 +23,14 @@ class LuffyTokenAuthentication(BaseAuthentication):
         return self.authenticate_credentials(token)
 
     def authenticate_credentials(self, token):
+        cached = token_cache.get(token)
+        if cached:
+            return cached
+
         try:
             token_obj = UserAuthToken.objects.select_related('user').get(token=token)
         except Exception as e:
             raise exceptions.AuthenticationFailed(_('Invalid token.'))
 
+        token_cache.set(token_obj)
         return (token_obj.user, token_obj)
@@ -0,0 +1,168 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+import redis
+from lufei.utils.cache import LRUCache
+from lufei.utils.pool import POOL
+
+CONN = redis.Redis(connection_pool=POOL)
+
+logger = logging.getLogger(__name__)
+
+# 缓存的用户字段，其它字段(如balance)访问时再从数据库加载
+USER_FIELDS = ('id', 'username', 'uid', 'openid')
+
+
+class TokenCache(object):
+    """
+    token -> 用户 缓存
+    读取顺序: 进程内TTL缓存 -> redis(luffy_auth_token:<token>) -> 数据库
+    UserAuthToken.save 时更新，删除token或用户时清除，都在事务提交后执行
+
+    token失效时除了删除redis中的key，还在 luffy_auth_token:revoked 频道上广播，
+    每个进程有一个订阅线程，收到后清除本进程缓存中的token
+    订阅断开期间收不到广播，这时不使用进程内缓存，重新订阅后先清空
+    """
+
+    def __init__(self, conn=None, maxsize=10000, local_ttl=60, redis_ttl=24 * 60 * 60):
+        self.conn = conn or CONN
+        self.local = LRUCache(maxsize=maxsize, ttl=local_ttl)
+        self.redis_ttl = redis_ttl
+        self._lock = threading.Lock()
+        self.hits = {"local": 0, "redis": 0, "miss": 0}
+        # 订阅线程所在的进程，fork后的子进程要重新启动
+        self._listener_pid = None
+        self._listening = False
+        # 收到的失效广播数，从redis读取期间有广播时不写入进程内缓存，避免写回刚失效的token
+        self._revoked = 0
+
+    @staticmethod
+    def key_for(token):
+        return "%s:%s" % (settings.LUFFY_AUTH_TOKEN, token)
+
+    @property
+    def channel(self):
+        return "%s:revoked" % settings.LUFFY_AUTH_TOKEN
+
+    def _count(self, name):
+        with self._lock:
+            self.hits[name] += 1
+
+    def _ensure_listener(self):
+        if self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            self._listening = False
+            threading.Thread(target=self._listen, name="token-cache-revoked", daemon=True).start()
+
+    def _listen(self):
+        while True:
+            pubsub = self.conn.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                # 订阅之前缓存的token可能已经失效
+                self.local.clear()
+                self._listening = True
+                while True:
+                    message = pubsub.get_message(timeout=1)
+                    if message:
+                        self._revoked += 1
+                        self.local.delete(message['data'].decode('utf-8'))
+            except Exception:
+                logger.exception("token失效频道订阅断开，1秒后重新订阅")
+            finally:
+                self._listening = False
+                pubsub.close()
+            time.sleep(1)
+
+    def get(self, token):
+        """
+        获取token对应的 (user, token_obj)，缓存中没有返回None
+        """
+        self._ensure_listener()
+        if self._listening:
+            data = self.local.get(token)
+            if data is not None:
+                self._count("local")
+                return self.load(token, data)
+
+        revoked = self._revoked
+        data = self.conn.get(self.key_for(token))
+        if data:
+            self._count("redis")
+            data = json.loads(data.decode('utf-8'))
+            if self._listening and self._revoked == revoked:
+                self.local.set(token, data)
+            return self.load(token, data)
+
+        self._count("miss")
+        return None
+
+    def set(self, token_obj):
+        user = token_obj.user
+        data = {
+            "token_id": token_obj.id,
+            "user": [getattr(user, field) for field in USER_FIELDS],
+        }
+        self.conn.set(self.key_for(token_obj.token), json.dumps(data), ex=self.redis_ttl)
+
+    def delete(self, token):
+        self.local.delete(token)
+        pipe = self.conn.pipeline(transaction=False)
+        pipe.delete(self.key_for(token))
+        pipe.publish(self.channel, token)
+        pipe.execute()
+
+    def set_on_commit(self, token_obj, old_token=None):
+        """
+        在当前事务提交后更新，回滚时缓存不变；不在事务中时立即更新
+        """
+        def update():
+            if old_token:
+                self.delete(old_token)
+            self.set(token_obj)
+        transaction.on_commit(update)
+
+    def delete_on_commit(self, token):
+        transaction.on_commit(lambda: self.delete(token))
+
+    def load(self, token, data):
+        """
+        由缓存数据构造 Account 和 UserAuthToken 对象，未缓存的字段延迟加载
+        """
+        from lufei.models import Account, UserAuthToken
+
+        user = Account.from_db('default', USER_FIELDS, data["user"])
+        token_obj = UserAuthToken.from_db('default', ('id', 'user_id', 'token'), (data["token_id"], user.id, token))
+        token_obj.user = user
+        return user, token_obj
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.hits)
+        total = sum(stats.values())
+        stats["hit_rate"] = (stats["local"] + stats["redis"]) / float(total) if total else 0.0
+        stats["listening"] = self._listening
+        return stats
+
+    def prometheus(self):
+        """
+        Prometheus 文本格式
+        """
+        stats, pid = self.stats(), os.getpid()
+        lines = ['luffy_token_cache_total{result="%s",pid="%s"} %s' % (name, pid, stats[name])
+                 for name in ("local", "redis", "miss")]
+        lines.append('luffy_token_cache_hit_rate{pid="%s"} %s' % (pid, stats["hit_rate"]))
+        return "\n".join(lines) + "\n"
+
+
+token_cache = TokenCache()
@@ -0,0 +1,17 @@
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * percent / 100.0))
+    return values[index]
+
+
+def summary(timings):
+    """
+    延迟统计，单位毫秒
+    """
+    return {
+        "count": len(timings),
+        "mean": sum(timings) / len(timings) * 1000 if timings else 0,
+        "p50": percentile(timings, 50) * 1000 if timings else 0,
+        "p95": percentile(timings, 95) * 1000 if timings else 0,
+        "p99": percentile(timings, 99) * 1000 if timings else 0,
+    }
@@ -0,0 +1,85 @@
+import json
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+
+import redis
+from lufei import models
+from lufei.utils.cache import LRUCache
+from lufei.utils.pool import POOL
+
+CONN = redis.Redis(connection_pool=POOL)
+
+
+class CourseCatalog(object):
+    """
+    课程目录缓存: course_id -> 课程名称、图片、价格策略
+    读取顺序: 进程内LRU -> redis(luffy_course_catalog:<course_id>) -> 数据库
+    Course/PricePolicy 保存或删除的事务提交后由信号清除缓存
+    redis中的缓存有过期时间: 清除缓存时并发的读取可能把提交前的数据写回去，最多保留redis_ttl秒
+    """
+
+    def __init__(self, conn=None, maxsize=1024, ttl=60, redis_ttl=10 * 60):
+        self.conn = conn or CONN
+        self.key = settings.LUFFY_COURSE_CATALOG
+        self.local = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.redis_ttl = redis_ttl
+
+    def key_for(self, course_id):
+        return "%s:%s" % (self.key, course_id)
+
+    def get(self, course_id):
+        """
+        获取课程信息，课程不存在时抛出 Course.DoesNotExist
+        """
+        course_id = str(course_id)
+        course = self.local.get(course_id)
+        if course is not None:
+            return course
+
+        data = self.conn.get(self.key_for(course_id))
+        if data:
+            course = json.loads(data.decode('utf-8'))
+        else:
+            course = self.build(course_id)
+            self.conn.set(self.key_for(course_id), json.dumps(course), ex=self.redis_ttl)
+
+        self.local.set(course_id, course)
+        return course
+
+    def build(self, course_id):
+        """
+        从数据库构建课程信息
+        """
+        course_obj = models.Course.objects.only('id', 'name', 'course_img').get(id=course_id)
+        price_policy_objs = models.PricePolicy.objects.filter(
+            content_type=ContentType.objects.get_for_model(models.Course),
+            object_id=course_obj.id,
+        ).order_by('valid_period')
+
+        price_policy_list = []
+        for item in price_policy_objs:
+            price_policy_list.append({"id": item.id, 'valid_period': item.get_valid_period_display(), 'price': item.price})
+
+        return {
+            "id": course_obj.id,
+            "name": course_obj.name,
+            "course_img": course_obj.course_img,
+            "price_policy_list": price_policy_list,
+        }
+
+    def invalidate(self, course_id):
+        course_id = str(course_id)
+        self.local.delete(course_id)
+        self.conn.delete(self.key_for(course_id))
+
+    def invalidate_on_commit(self, course_id):
+        """
+        在当前事务提交后清除，不在事务中时立即清除
+        提交前清除的话，并发的读取会把提交前的数据重新写入缓存
+        """
+        transaction.on_commit(lambda: self.invalidate(course_id))
+
+
+catalog = CourseCatalog()
@@ -0,0 +1,336 @@
+import csv
+import json
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+
+from lufei import models
+
+JSONL = "jsonl"
+CSV = "csv"
+FORMATS = (JSONL, CSV)
+
+COURSE_FIELDS = ('name', 'course_img', 'course_type', 'brief', 'level', 'pub_date', 'period', 'order',
+                 'attachment_path', 'status', 'template_id')
+DETAIL_FIELDS = ('hours', 'course_slogan', 'video_brief_link', 'why_study', 'what_to_study_brief',
+                 'career_improvement', 'prerequisite')
+PRICE_POLICY_FIELDS = ('valid_period', 'price')
+CHAPTER_FIELDS = ('chapter', 'name', 'summary')
+SECTION_FIELDS = ('name', 'order', 'section_type', 'section_link', 'video_time', 'free_trail')
+HOMEWORK_FIELDS = ('title', 'order', 'homework_type', 'requirement', 'threshold', 'recommend_period',
+                   'scholarship_value', 'note', 'enabled')
+
+# CSV每行一个课程，嵌套的数据以JSON字符串存放在单元格中
+CSV_COLUMNS = ('category', 'sub_category', 'degree_course') + COURSE_FIELDS + (
+    'detail', 'price_policies', 'chapters')
+CSV_JSON_COLUMNS = ('detail', 'price_policies', 'chapters')
+
+
+def dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), cls=DjangoJSONEncoder)
+
+
+# ######################## 导出 ########################
+
+def export_documents(chunk_size=500):
+    """
+    按课程ID分块流式读出整个课程目录，每块的关联数据各一条查询
+    :return: 生成器，每个课程一个文档
+    """
+    course_content_type = ContentType.objects.get_for_model(models.Course)
+    last_id = 0
+    while True:
+        courses = list(models.Course.objects.filter(id__gt=last_id).order_by('id').values(
+            'id', 'sub_category__category__name', 'sub_category__name', 'degree_course__name', *COURSE_FIELDS)[:chunk_size])
+        if not courses:
+            break
+        last_id = courses[-1]['id']
+        course_ids = [course['id'] for course in courses]
+
+        details = {row.pop('course_id'): row for row in models.CourseDetail.objects.filter(
+            course_id__in=course_ids).values('course_id', *DETAIL_FIELDS)}
+
+        price_policies = {}
+        for row in models.PricePolicy.objects.filter(
+                content_type=course_content_type, object_id__in=course_ids).order_by('valid_period').values(
+                'object_id', *PRICE_POLICY_FIELDS):
+            price_policies.setdefault(row.pop('object_id'), []).append(row)
+
+        chapters, chapter_list = {}, {}
+        for row in models.CourseChapter.objects.filter(course_id__in=course_ids).order_by('chapter').values(
+                'id', 'course_id', *CHAPTER_FIELDS):
+            chapter_id, course_id = row.pop('id'), row.pop('course_id')
+            row['sections'], row['homeworks'] = [], []
+            chapters[chapter_id] = row
+            chapter_list.setdefault(course_id, []).append(row)
+        for row in models.CourseSection.objects.filter(chapter_id__in=chapters).order_by('order').values(
+                'chapter_id', *SECTION_FIELDS):
+            chapters[row.pop('chapter_id')]['sections'].append(row)
+        for row in models.Homework.objects.filter(chapter_id__in=chapters).order_by('order').values(
+                'chapter_id', *HOMEWORK_FIELDS):
+            chapters[row.pop('chapter_id')]['homeworks'].append(row)
+
+        for course in courses:
+            course_id = course.pop('id')
+            course['category'] = course.pop('sub_category__category__name')
+            course['sub_category'] = course.pop('sub_category__name')
+            course['degree_course'] = course.pop('degree_course__name')
+            course['detail'] = details.get(course_id)
+            course['price_policies'] = price_policies.get(course_id, [])
+            course['chapters'] = chapter_list.get(course_id, [])
+            yield course
+
+
+def write_documents(documents, stream, fmt):
+    """
+    :return: 写入的课程数
+    """
+    count = 0
+    if fmt == CSV:
+        writer = csv.DictWriter(stream, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        for document in documents:
+            row = dict(document)
+            for column in CSV_JSON_COLUMNS:
+                row[column] = dumps(row[column]) if row[column] is not None else ''
+            writer.writerow(row)
+            count += 1
+    else:
+        for document in documents:
+            stream.write(dumps(document))
+            stream.write("\n")
+            count += 1
+    return count
+
+
+# ######################## 导入: 解析和校验(在子进程中执行) ########################
+
+def clean_fields(model, names, data, blank_is_null=False):
+    """
+    用模型字段的clean做类型转换和校验(choices、max_length、不能为空...)，缺少的字段使用默认值
+    """
+    result = {}
+    for name in names:
+        field = model._meta.get_field(name)
+        if name in data:
+            value = data[name]
+            if blank_is_null and value == '' and field.null:
+                value = None
+        else:
+            value = field.get_default() if field.has_default() else None
+        try:
+            result[name] = field.clean(value, None)
+        except ValidationError as e:
+            raise ValueError("%s.%s: %s" % (model.__name__, name, "; ".join(e.messages)))
+    return result
+
+
+def parse_document(data, blank_is_null=False):
+    """
+    校验一个课程文档，返回只包含python值的文档(可以在进程间传递)
+    """
+    if not isinstance(data, dict):
+        raise ValueError("课程必须是一个对象")
+    for key in ('category', 'sub_category'):
+        if not data.get(key):
+            raise ValueError("缺少%s" % key)
+
+    course = clean_fields(models.Course, COURSE_FIELDS, data, blank_is_null)
+    if course['course_type'] == 2 and not data.get('degree_course'):
+        raise ValueError("学位课程必须关联学位课")
+
+    detail = data.get('detail')
+    chapters = []
+    for chapter in data.get('chapters') or []:
+        cleaned = clean_fields(models.CourseChapter, CHAPTER_FIELDS, chapter)
+        cleaned['sections'] = [clean_fields(models.CourseSection, SECTION_FIELDS, item)
+                               for item in chapter.get('sections') or []]
+        cleaned['homeworks'] = [clean_fields(models.Homework, HOMEWORK_FIELDS, item)
+                                for item in chapter.get('homeworks') or []]
+        links = [item['section_link'] for item in cleaned['sections'] if item['section_link'] is not None]
+        if len(set(links)) != len(links):
+            raise ValueError("第%s章的课时链接重复" % cleaned['chapter'])
+        if len(set(item['title'] for item in cleaned['homeworks'])) != len(cleaned['homeworks']):
+            raise ValueError("第%s章的作业题目重复" % cleaned['chapter'])
+        chapters.append(cleaned)
+    if len(set(chapter['chapter'] for chapter in chapters)) != len(chapters):
+        raise ValueError("章节序号重复")
+
+    price_policies = [clean_fields(models.PricePolicy, PRICE_POLICY_FIELDS, item)
+                      for item in data.get('price_policies') or []]
+    if len(set(item['valid_period'] for item in price_policies)) != len(price_policies):
+        raise ValueError("价格策略的有效期重复")
+
+    return {
+        "category": data['category'],
+        "sub_category": data['sub_category'],
+        "degree_course": data.get('degree_course') or None,
+        "course": course,
+        "detail": clean_fields(models.CourseDetail, DETAIL_FIELDS, detail) if detail else None,
+        "price_policies": price_policies,
+        "chapters": chapters,
+    }
+
+
+def parse_chunk(chunk, fmt):
+    """
+    :param chunk: [(行号, JSONL的一行 或 CSV的一行字典)]
+    :return: (校验通过的文档, [(行号, 错误)])
+    """
+    documents, errors = [], []
+    for line_number, raw in chunk:
+        try:
+            if fmt == CSV:
+                data = dict(raw)
+                for column in CSV_JSON_COLUMNS:
+                    data[column] = json.loads(data[column]) if data.get(column) else None
+                document = parse_document(data, blank_is_null=True)
+            else:
+                document = parse_document(json.loads(raw))
+        except (ValueError, TypeError, AttributeError) as e:
+            # json.JSONDecodeError 是 ValueError 的子类，结构不对(如章节不是对象)时是 TypeError/AttributeError
+            errors.append((line_number, str(e)))
+            continue
+        document['line'] = line_number
+        documents.append(document)
+    return documents, errors
+
+
+def csv_rows(stream):
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_chunks(stream, fmt, chunk_size):
+    """
+    流式读取文件，每chunk_size个课程一块
+    """
+    if fmt == CSV:
+        rows = csv_rows(stream)
+    else:
+        rows = ((line_number, line) for line_number, line in enumerate(stream, 1) if line.strip())
+    chunk = []
+    for item in rows:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ######################## 导入: 写入数据库(在主进程中执行) ########################
+
+class CatalogImporter(object):
+    """
+    按块批量写入校验过的课程文档，外键通过内存中的 名称 -> ID 映射解析，每块固定的查询数
+    bulk_create在MySQL下不会回填主键，插入后按唯一键再查一次ID
+    已存在的课程(按课程名)跳过
+    子类按 (大类名, 子类名) 解析；子类名全局唯一，已属于其它大类的子类名报错，不会把课程放到别的大类下
+    """
+
+    def __init__(self):
+        self.categories = dict(models.CourseCategory.objects.values_list('name', 'id'))
+        self.sub_categories = {(category, name): sub_category_id for category, name, sub_category_id in
+                               models.CourseSubCategory.objects.values_list('category__name', 'name', 'id')}
+        self.degree_courses = dict(models.DegreeCourse.objects.values_list('name', 'id'))
+        self.course_content_type = ContentType.objects.get_for_model(models.Course)
+
+    def resolve_categories(self, documents):
+        names = set(document['category'] for document in documents) - set(self.categories)
+        if names:
+            models.CourseCategory.objects.bulk_create([models.CourseCategory(name=name) for name in names])
+            self.categories.update(models.CourseCategory.objects.filter(name__in=names).values_list('name', 'id'))
+
+        sub_categories = {}
+        for document in documents:
+            key = (document['category'], document['sub_category'])
+            if key not in self.sub_categories:
+                sub_categories[document['sub_category']] = self.categories[document['category']]
+        if sub_categories:
+            models.CourseSubCategory.objects.bulk_create([
+                models.CourseSubCategory(name=name, category_id=category_id)
+                for name, category_id in sub_categories.items()])
+            self.sub_categories.update(
+                ((category, name), sub_category_id) for category, name, sub_category_id in
+                models.CourseSubCategory.objects.filter(name__in=sub_categories).values_list(
+                    'category__name', 'name', 'id'))
+
+    def import_chunk(self, documents):
+        """
+        :return: (导入的课程ID, [(行号, 错误)])
+        """
+        errors, accepted, names = [], [], set()
+        existing = set(models.Course.objects.filter(
+            name__in=[document['course']['name'] for document in documents]).values_list('name', flat=True))
+        # 子类名 -> 所属大类名，包括这块中将要新建的
+        owners = {name: category for category, name in self.sub_categories}
+        for document in documents:
+            name = document['course']['name']
+            owner = owners.get(document['sub_category'], document['category'])
+            if name in existing or name in names:
+                errors.append((document['line'], "课程已存在: %s" % name))
+            elif owner != document['category']:
+                errors.append((document['line'], "子类%s属于大类%s" % (document['sub_category'], owner)))
+            elif document['degree_course'] and document['degree_course'] not in self.degree_courses:
+                errors.append((document['line'], "学位课不存在: %s" % document['degree_course']))
+            else:
+                names.add(name)
+                owners[document['sub_category']] = document['category']
+                accepted.append(document)
+        if not accepted:
+            return [], errors
+
+        categories, sub_categories = dict(self.categories), dict(self.sub_categories)
+        try:
+            course_ids = self.insert(accepted, names)
+        except IntegrityError as e:
+            # 与数据库中已有的数据冲突(如课时链接、章节重复)，整块回滚
+            # 这块中新建的分类也回滚了，映射恢复到写入之前，否则后面的块会用到不存在的ID
+            self.categories, self.sub_categories = categories, sub_categories
+            return [], errors + [(document['line'], "写入失败: %s" % e) for document in accepted]
+        return course_ids, errors
+
+    def insert(self, accepted, names):
+        with transaction.atomic():
+            self.resolve_categories(accepted)
+            models.Course.objects.bulk_create([
+                models.Course(
+                    sub_category_id=self.sub_categories[(document['category'], document['sub_category'])],
+                    degree_course_id=self.degree_courses.get(document['degree_course']),
+                    **document['course']
+                ) for document in accepted])
+            course_ids = dict(models.Course.objects.filter(name__in=names).values_list('name', 'id'))
+
+            details, price_policies, chapters = [], [], []
+            for document in accepted:
+                course_id = course_ids[document['course']['name']]
+                if document['detail']:
+                    details.append(models.CourseDetail(course_id=course_id, **document['detail']))
+                price_policies.extend(models.PricePolicy(
+                    content_type=self.course_content_type, object_id=course_id, **item
+                ) for item in document['price_policies'])
+                chapters.extend(models.CourseChapter(
+                    course_id=course_id, **{key: chapter[key] for key in CHAPTER_FIELDS}
+                ) for chapter in document['chapters'])
+            models.CourseDetail.objects.bulk_create(details)
+            models.PricePolicy.objects.bulk_create(price_policies)
+            models.CourseChapter.objects.bulk_create(chapters)
+
+            chapter_ids = {(course_id, chapter): chapter_id for chapter_id, course_id, chapter in
+                           models.CourseChapter.objects.filter(course_id__in=course_ids.values()).values_list(
+                               'id', 'course_id', 'chapter')}
+            sections, homeworks = [], []
+            for document in accepted:
+                course_id = course_ids[document['course']['name']]
+                for chapter in document['chapters']:
+                    chapter_id = chapter_ids[(course_id, chapter['chapter'])]
+                    sections.extend(models.CourseSection(chapter_id=chapter_id, **item) for item in chapter['sections'])
+                    homeworks.extend(models.Homework(chapter_id=chapter_id, **item) for item in chapter['homeworks'])
+            models.CourseSection.objects.bulk_create(sections, batch_size=1000)
+            models.Homework.objects.bulk_create(homeworks, batch_size=1000)
+
+        return list(course_ids.values())
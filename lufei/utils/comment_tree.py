@@ -0,0 +1,52 @@
+from django.contrib.contenttypes.models import ContentType
+
+from lufei import models
+
+COMMENT_FIELDS = ('id', 'p_node_id', 'path', 'depth', 'content', 'account_id', 'account__username',
+                  'agree_number', 'disagree_number', 'date')
+
+
+def comment_queryset(content_object=None, content_type=None, object_id=None):
+    if content_object is not None:
+        content_type = ContentType.objects.get_for_model(content_object)
+        object_id = content_object.pk
+    return models.Comment.objects.filter(content_type=content_type, object_id=object_id)
+
+
+def comment_subtree(queryset, root=None, max_depth=None, cursor=None, size=50):
+    """
+    按物化路径取评论树的一页，一条走 (content_type, object_id, path) 索引的查询
+    :param queryset: comment_queryset 返回的某个对象的评论
+    :param root: 只取这条评论的子树(包括它自己)
+    :param max_depth: 相对root(或根评论)的最大层级，0为只取root/根评论
+    :param cursor: 上一页返回的next_cursor
+    :return: (评论树, next_cursor)，每条评论的children为其在本页中的回复
+    """
+    base_depth = 0
+    if root is not None:
+        queryset = queryset.filter(path__startswith=root.path)
+        base_depth = root.depth
+    if max_depth is not None:
+        queryset = queryset.filter(depth__lte=base_depth + max_depth)
+    if cursor:
+        queryset = queryset.filter(path__gt=cursor)
+
+    rows = list(queryset.order_by('path').values(*COMMENT_FIELDS)[:size + 1])
+    next_cursor = rows[size - 1]['path'] if len(rows) > size else None
+    return build_tree(rows[:size]), next_cursor
+
+
+def build_tree(rows):
+    """
+    把按path排序的评论组装成树，父评论不在本页的评论作为本页的顶层
+    """
+    nodes, tree = {}, []
+    for row in rows:
+        row['children'] = []
+        nodes[row['id']] = row
+        parent = nodes.get(row['p_node_id'])
+        if parent is not None:
+            parent['children'].append(row)
+        else:
+            tree.append(row)
+    return tree
@@ -0,0 +1,160 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+import redis
+from lufei import models
+from lufei.utils.pool import POOL
+
+CONN = redis.Redis(connection_pool=POOL)
+
+ARTICLE_COUNTER_FIELDS = ('view_num', 'agree_num', 'collect_num', 'comment_num')
+
+# 用户可以直接累加的计数 -> 同一用户再次计数的间隔(秒)，None为只能计一次
+USER_COUNTER_INTERVALS = {'view_num': 30 * 60, 'agree_num': None}
+
+# KEYS[1] 用户计数标记  KEYS[2] 增量hash  ARGV: hash字段, 间隔秒数(0为只计一次), 账户ID
+# 有间隔时标记是每个用户一个带过期时间的key，只计一次时是每篇文章一个set，账户ID是set的成员
+INCR_ONCE_LUA = """
+local ok
+if tonumber(ARGV[2]) > 0 then
+    ok = redis.call('SET', KEYS[1], 1, 'NX', 'EX', ARGV[2])
+else
+    ok = redis.call('SADD', KEYS[1], ARGV[3]) == 1
+end
+if not ok then
+    return nil
+end
+return redis.call('HINCRBY', KEYS[2], ARGV[1], 1)
+"""
+
+
+class ArticleCounter(object):
+    """
+    文章计数(观看/点赞/收藏/评论)先累加在redis，由 flush_article_counters 定期合并写入MySQL
+        luffy_article_counter           hash: "<文章ID>:<字段>" -> 未落库的增量
+        luffy_article_counter:flushing  hash: 正在落库的增量，落库成功后删除
+        luffy_article_counter:<字段>:<文章ID>:<账户ID>  用户观看的标记，过期后可以再次计数
+        luffy_article_counter:<字段>:<文章ID>  set: 点过赞的账户，只能计一次
+    热门文章的计数不再在每个请求里锁同一行
+    """
+
+    def __init__(self, conn=None, key=None):
+        self.conn = conn or CONN
+        self.key = key or settings.LUFFY_ARTICLE_COUNTER
+        self.flushing = "%s:flushing" % self.key
+        self.incr_once_script = self.conn.register_script(INCR_ONCE_LUA)
+
+    def incr(self, article_id, field, amount=1):
+        if field not in ARTICLE_COUNTER_FIELDS:
+            raise ValueError("unknown article counter: %s" % field)
+        return self.conn.hincrby(self.key, "%s:%s" % (article_id, field), amount)
+
+    def incr_on_commit(self, article_id, field, amount=1):
+        """
+        在当前事务提交后累加，回滚的评论/收藏不计数；不在事务中时立即累加
+        """
+        if field not in ARTICLE_COUNTER_FIELDS:
+            raise ValueError("unknown article counter: %s" % field)
+        transaction.on_commit(lambda: self.incr(article_id, field, amount))
+
+    def incr_once(self, article_id, field, account_id):
+        """
+        用户观看或点赞，同一用户在 USER_COUNTER_INTERVALS 的间隔内只计一次
+        :return: 是否计数
+        """
+        if field not in USER_COUNTER_INTERVALS:
+            raise ValueError("unknown user counter: %s" % field)
+        interval = USER_COUNTER_INTERVALS[field] or 0
+        if interval:
+            marker = "%s:%s:%s:%s" % (self.key, field, article_id, account_id)
+        else:
+            marker = "%s:%s:%s" % (self.key, field, article_id)
+        result = self.incr_once_script(keys=[marker, self.key],
+                                       args=["%s:%s" % (article_id, field), interval, account_id])
+        return result is not None
+
+    def pending(self, article_ids):
+        """
+        未落库的增量(包括正在落库的)
+        :return: {文章ID: {字段: 增量}}
+        """
+        article_ids = list(article_ids)
+        fields = ["%s:%s" % (article_id, field) for article_id in article_ids for field in ARTICLE_COUNTER_FIELDS]
+        if not fields:
+            return {}
+        pipe = self.conn.pipeline()
+        pipe.hmget(self.key, fields)
+        pipe.hmget(self.flushing, fields)
+        live, flushing = pipe.execute()
+
+        result = {}
+        for index, article_id in enumerate(article_ids):
+            deltas = {}
+            for offset, field in enumerate(ARTICLE_COUNTER_FIELDS):
+                i = index * len(ARTICLE_COUNTER_FIELDS) + offset
+                deltas[field] = int(live[i] or 0) + int(flushing[i] or 0)
+            result[article_id] = deltas
+        return result
+
+    def apply(self, rows):
+        """
+        把未落库的增量加到文章数据上
+        :param rows: 包含id和计数字段的字典列表，如 values() 的结果
+        """
+        pending = self.pending(row['id'] for row in rows)
+        for row in rows:
+            for field, delta in pending[row['id']].items():
+                if field in row:
+                    row[field] += delta
+        return rows
+
+    def take(self):
+        """
+        把当前的增量移到flushing中，上次落库失败留下的flushing优先处理
+        :return: {文章ID: {字段: 增量}}
+        """
+        if not self.conn.exists(self.flushing):
+            try:
+                # RENAMENX原子的切换，之后的incr写入新的hash
+                if not self.conn.renamenx(self.key, self.flushing):
+                    return {}
+            except redis.ResponseError:
+                # 没有未落库的增量
+                return {}
+
+        deltas = {}
+        for name, value in self.conn.hscan_iter(self.flushing, count=1000):
+            article_id, field = name.decode('utf-8').split(':')
+            value = int(value)
+            if value:
+                deltas.setdefault(int(article_id), {})[field] = value
+        return deltas
+
+    def done(self):
+        self.conn.delete(self.flushing)
+
+    def flush(self, batch_size=500):
+        """
+        把增量合并写入MySQL，每批文章一条 UPDATE ... CASE 语句
+        落库失败时flushing保留，下次flush重试；落库成功但删除flushing前退出会重复计入一次
+        :return: 更新的文章数
+        """
+        deltas = self.take()
+        article_ids = sorted(deltas)
+        # 所有批次在一个事务中，失败时整体重试，不会有部分批次被计入两次
+        with transaction.atomic():
+            for start in range(0, len(article_ids), batch_size):
+                batch = article_ids[start:start + batch_size]
+                updates = {}
+                for field in ARTICLE_COUNTER_FIELDS:
+                    whens = [When(id=article_id, then=Value(deltas[article_id][field]))
+                             for article_id in batch if deltas[article_id].get(field)]
+                    if whens:
+                        updates[field] = F(field) + Case(*whens, default=Value(0), output_field=IntegerField())
+                models.Article.objects.filter(id__in=batch).update(**updates)
+        self.done()
+        return len(article_ids)
+
+
+article_counter = ArticleCounter()
@@ -0,0 +1,109 @@
+import datetime
+import json
+
+from django.conf import settings
+from django.utils import timezone
+
+import redis
+from lufei import models
+from lufei.utils.pool import POOL
+
+CONN = redis.Redis(connection_pool=POOL)
+
+# 领券: 校验库存和是否领过、扣库存、记录领取人、写入待落库队列，一次原子执行
+# 返回 1: 领取成功  0: 已领完  -1: 已经领过  -2: 不在领取时间内(库存未加载)
+CLAIM_LUA = """
+local stock = redis.call('GET', KEYS[1])
+if not stock then
+    return -2
+end
+if redis.call('SISMEMBER', KEYS[2], ARGV[1]) == 1 then
+    return -1
+end
+if tonumber(stock) <= 0 then
+    return 0
+end
+redis.call('DECR', KEYS[1])
+redis.call('SADD', KEYS[2], ARGV[1])
+redis.call('RPUSH', KEYS[3], ARGV[2])
+return 1
+"""
+
+CLAIMED = 1
+SOLD_OUT = 0
+ALREADY_CLAIMED = -1
+NOT_OPEN = -2
+
+claim_script = CONN.register_script(CLAIM_LUA)
+
+
+class CouponStock(object):
+    """
+    优惠券库存
+        luffy_coupon:stock:<coupon_id>    剩余数量
+        luffy_coupon:claimed:<coupon_id>  已领取的账户ID集合，每个账户只能领一张
+        luffy_coupon_claim_queue          领取记录队列，由 drain_coupon_claims 批量写入CouponRecord
+    领券只访问redis，数据库不在领券的请求路径上
+    """
+
+    def __init__(self, conn=None, prefix=None, queue=None):
+        self.conn = conn or CONN
+        self.prefix = prefix or settings.LUFFY_COUPON
+        self.queue = queue or "%s_claim_queue" % self.prefix
+
+    def stock_key(self, coupon_id):
+        return "%s:stock:%s" % (self.prefix, coupon_id)
+
+    def claimed_key(self, coupon_id):
+        return "%s:claimed:%s" % (self.prefix, coupon_id)
+
+    def claim(self, coupon_id, account_id, now=None):
+        now = now or timezone.now()
+        record = json.dumps({"coupon_id": int(coupon_id), "account_id": account_id, "get_time": now.isoformat()})
+        return claim_script(
+            keys=[self.stock_key(coupon_id), self.claimed_key(coupon_id), self.queue],
+            args=[account_id, record],
+            client=self.conn,
+        )
+
+    def remaining(self, coupon_id):
+        stock = self.conn.get(self.stock_key(coupon_id))
+        return int(stock) if stock is not None else None
+
+    def load(self, coupon, force=False):
+        """
+        把优惠券的剩余库存和已领取的账户加载到redis，在领取结束时间过期
+        已加载过的优惠券不会覆盖(避免把已扣减的库存加回来)，除非force
+        :return: 是否加载
+        """
+        stock_key, claimed_key = self.stock_key(coupon.id), self.claimed_key(coupon.id)
+        if not force and self.conn.exists(stock_key):
+            return False
+
+        claimed = list(models.CouponRecord.objects.filter(coupon=coupon).values_list('account_id', flat=True))
+        # 已领取但还在队列中的记录也要算上
+        claimed = set(claimed) | set(int(item) for item in self.conn.smembers(claimed_key))
+        expire_at = timezone.make_aware(datetime.datetime.combine(
+            coupon.close_date + datetime.timedelta(days=1), datetime.time.min))
+
+        pipe = self.conn.pipeline()
+        pipe.set(stock_key, max(0, coupon.quantity - len(claimed)))
+        pipe.delete(claimed_key)
+        if claimed:
+            pipe.sadd(claimed_key, *claimed)
+        pipe.expireat(stock_key, expire_at)
+        pipe.expireat(claimed_key, expire_at)
+        pipe.execute()
+        return True
+
+    def pending(self, count):
+        """
+        队列头部的count条领取记录，写入数据库后再调用 ack 删除
+        """
+        return [json.loads(item.decode('utf-8')) for item in self.conn.lrange(self.queue, 0, count - 1)]
+
+    def ack(self, count):
+        self.conn.ltrim(self.queue, count, -1)
+
+
+coupon_stock = CouponStock()
@@ -0,0 +1,57 @@
+import hashlib
+
+from django.conf import settings
+from django.db import transaction
+
+import redis
+from lufei.utils.pool import POOL
+
+CONN = redis.Redis(connection_pool=POOL)
+
+
+class CourseVersion(object):
+    """
+    课程数据的版本号，课程或其关联数据(详情、章节、课时、讲师、价格策略...)修改时由信号加1
+    redis hash luffy_course_version: {course_id: 版本号, "list": 课程列表的版本号}
+    版本号用于生成ETag，客户端的ETag与当前版本一致时直接返回304，不查数据库
+    """
+    LIST = "list"
+
+    def __init__(self, conn=None):
+        self.conn = conn or CONN
+        self.key = settings.LUFFY_COURSE_VERSION
+
+    def get(self, field):
+        version = self.conn.hget(self.key, field)
+        return int(version) if version else 0
+
+    def bump(self, course_ids, course_list=False):
+        """
+        :param course_ids: 数据有变化的课程
+        :param course_list: 是否影响课程列表
+        """
+        pipe = self.conn.pipeline(transaction=False)
+        for course_id in set(course_ids):
+            pipe.hincrby(self.key, course_id, 1)
+        if course_list:
+            pipe.hincrby(self.key, self.LIST, 1)
+        pipe.execute()
+
+    def bump_on_commit(self, course_ids, course_list=False):
+        """
+        在当前事务提交后加1，不在事务中时立即加1
+        提交前加1的话，并发的请求会把新的ETag和提交前的数据一起返回，客户端之后一直得到304
+        :param course_ids: 在事务中查出，可以是QuerySet
+        """
+        course_ids = list(course_ids)
+        transaction.on_commit(lambda: self.bump(course_ids, course_list))
+
+    def etag(self, field, version, *extra):
+        """
+        :param extra: 影响响应内容的其它参数，如分页参数
+        """
+        value = ":".join(str(item) for item in (field, version) + extra)
+        return '"%s"' % hashlib.md5(value.encode('utf-8')).hexdigest()
+
+
+course_version = CourseVersion()
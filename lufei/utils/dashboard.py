@@ -0,0 +1,155 @@
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+import redis
+from lufei import models
+from lufei.utils.pool import POOL
+
+CONN = redis.Redis(connection_pool=POOL)
+
+HOMEWORK_STATUS = {0: "pending", 1: "passed", 2: "failed"}
+
+
+def dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), cls=DjangoJSONEncoder)
+
+
+def build_dashboards(account_ids):
+    """
+    一批账户的"我的课程"和学习进度，查询数与账户数无关
+    :return: {账户ID: 文档}
+    """
+    account_ids = list(account_ids)
+    dashboards = {account_id: {"courses": [], "degree_courses": []} for account_id in account_ids}
+
+    courses = models.EnrolledCourse.objects.filter(account_id__in=account_ids).order_by('-enrolled_date').values(
+        'account_id', 'course_id', 'course__name', 'course__course_img',
+        'valid_begin_date', 'valid_end_date', 'status')
+    for row in courses:
+        dashboards[row['account_id']]["courses"].append({
+            "id": row['course_id'],
+            "name": row['course__name'],
+            "course_img": row['course__course_img'],
+            "valid_begin_date": row['valid_begin_date'],
+            "valid_end_date": row['valid_end_date'],
+            "status": row['status'],
+        })
+
+    degrees = {}
+    for row in models.EnrolledDegreeCourse.objects.filter(account_id__in=account_ids).order_by('-enrolled_date').values(
+            'id', 'account_id', 'degree_course_id', 'degree_course__name', 'degree_course__course_img',
+            'valid_begin_date', 'valid_end_date', 'study_status'):
+        degree = {
+            "id": row['degree_course_id'],
+            "name": row['degree_course__name'],
+            "course_img": row['degree_course__course_img'],
+            "valid_begin_date": row['valid_begin_date'],
+            "valid_end_date": row['valid_end_date'],
+            "study_status": row['study_status'],
+            "modules": [],
+            "homework": {"pending": 0, "passed": 0, "failed": 0},
+            "progress": 0,
+        }
+        degrees[row['id']] = degree
+        dashboards[row['account_id']]["degree_courses"].append(degree)
+
+    if degrees:
+        modules = {}
+        for row in models.StudyRecord.objects.filter(enrolled_degree_course_id__in=degrees).order_by(
+                'course_module__order', 'course_module_id').values(
+                'enrolled_degree_course_id', 'course_module_id', 'course_module__name', 'status', 'open_date',
+                'end_date'):
+            module = {
+                "id": row['course_module_id'],
+                "name": row['course_module__name'],
+                "status": row['status'],
+                "open_date": row['open_date'],
+                "end_date": row['end_date'],
+                "homework_total": 0,
+                "homework_passed": 0,
+            }
+            modules[(row['enrolled_degree_course_id'], row['course_module_id'])] = module
+            degrees[row['enrolled_degree_course_id']]["modules"].append(module)
+
+        module_ids = set(module_id for _, module_id in modules)
+        totals = dict(models.Homework.objects.filter(chapter__course_id__in=module_ids, enabled=True).values_list(
+            'chapter__course_id').annotate(count=Count('id')).order_by())
+        for (_, module_id), module in modules.items():
+            module["homework_total"] = totals.get(module_id, 0)
+
+        homework = models.HomeworkRecord.objects.filter(student_id__in=degrees).values_list(
+            'student_id', 'homework__chapter__course_id', 'status').annotate(count=Count('id')).order_by()
+        for student_id, module_id, status, count in homework:
+            degrees[student_id]["homework"][HOMEWORK_STATUS[status]] += count
+            if status == 1 and (student_id, module_id) in modules:
+                modules[(student_id, module_id)]["homework_passed"] += count
+
+        for degree in degrees.values():
+            if degree["modules"]:
+                finished = sum(1 for module in degree["modules"] if module["status"] == 0)
+                degree["progress"] = round(finished / len(degree["modules"]), 4)
+
+    updated_at = timezone.now()
+    for dashboard in dashboards.values():
+        dashboard["updated_at"] = updated_at
+    return dashboards
+
+
+class Dashboard(object):
+    """
+    每个账户的"我的课程"和学习进度读模型，luffy_dashboard:<account_id> 一个JSON字符串
+    报名、学习记录、作业记录变化时由信号在事务提交后重建，读取只需一次GET
+    课程/学位课程改名、作业增删时受影响的账户可能很多，只删除读模型，下次读取时再重建
+    读模型有过期时间(redis_ttl)，漏掉的修改最多保留这么久
+    """
+
+    def __init__(self, conn=None, redis_ttl=24 * 60 * 60):
+        self.conn = conn or CONN
+        self.redis_ttl = redis_ttl
+
+    @staticmethod
+    def key_for(account_id):
+        return "%s:%s" % (settings.LUFFY_DASHBOARD, account_id)
+
+    def get(self, account_id):
+        data = self.conn.get(self.key_for(account_id))
+        if data is not None:
+            return json.loads(data.decode('utf-8'))
+        return json.loads(self.refresh([account_id])[account_id])
+
+    def refresh(self, account_ids):
+        """
+        :return: {账户ID: JSON}
+        """
+        documents = {account_id: dumps(dashboard) for account_id, dashboard in build_dashboards(account_ids).items()}
+        if documents:
+            pipe = self.conn.pipeline(transaction=False)
+            for account_id, data in documents.items():
+                pipe.set(self.key_for(account_id), data, ex=self.redis_ttl)
+            pipe.execute()
+        return documents
+
+    def refresh_on_commit(self, account_ids):
+        """
+        在当前事务提交后重建，不在事务中时立即重建
+        """
+        account_ids = list(account_ids)
+        transaction.on_commit(lambda: self.refresh(account_ids))
+
+    def invalidate(self, account_ids, batch_size=1000):
+        account_ids = list(account_ids)
+        for start in range(0, len(account_ids), batch_size):
+            self.conn.delete(*[self.key_for(account_id) for account_id in account_ids[start:start + batch_size]])
+
+    def invalidate_on_commit(self, account_ids):
+        account_ids = list(account_ids)
+        if account_ids:
+            transaction.on_commit(lambda: self.invalidate(account_ids))
+
+
+dashboard = Dashboard()
@@ -0,0 +1,94 @@
+import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from lufei import models
+from lufei.utils.dashboard import dashboard
+
+
+def degree_modules(degree_course_id):
+    """
+    学位课程的所有模块，按课程顺序
+    """
+    return list(models.Course.objects.filter(
+        degree_course_id=degree_course_id, course_type=2).order_by('order', 'id').values_list('id', flat=True))
+
+
+def provision(enrolled_degree_course, batch_size=500):
+    """
+    报名学位课程后，为每个模块生成一条学习记录(未开通)
+    模块由 degree_course_id 一次查出，天然满足 StudyRecord.save 中的校验，所以可以直接bulk_create
+    已经存在的学习记录不会重复生成
+    :return: 新生成的学习记录数
+    """
+    module_ids = degree_modules(enrolled_degree_course.degree_course_id)
+    existing = set(models.StudyRecord.objects.filter(
+        enrolled_degree_course=enrolled_degree_course).values_list('course_module_id', flat=True))
+
+    records = [
+        models.StudyRecord(enrolled_degree_course=enrolled_degree_course, course_module_id=module_id, status=1)
+        for module_id in module_ids if module_id not in existing
+    ]
+    models.StudyRecord.objects.bulk_create(records, batch_size=batch_size)
+    # bulk_create不会触发信号
+    dashboard.refresh_on_commit([enrolled_degree_course.account_id])
+    return len(records)
+
+
+def open_modules(enrolled_degree_course, module_ids, start_date=None, batch_size=500):
+    """
+    开通模块: 学习记录改为在学，并为模块中的每个作业生成学习计划
+    作业的推荐交作业日期从start_date开始，按章节和作业顺序累加各作业的推荐完成周期
+    :return: 新生成的学习计划数
+    """
+    module_ids = list(module_ids)
+    start_date = start_date or timezone.localtime(timezone.now()).date()
+
+    with transaction.atomic():
+        # 一次校验所有模块都属于报名的学位课程
+        valid = models.Course.objects.filter(
+            id__in=module_ids, degree_course_id=enrolled_degree_course.degree_course_id).count()
+        if valid != len(set(module_ids)):
+            raise ValueError("学员要开通的模块必须与其报名的学位课程一致！")
+
+        study_records = dict(models.StudyRecord.objects.filter(
+            enrolled_degree_course=enrolled_degree_course,
+            course_module_id__in=module_ids,
+        ).values_list('course_module_id', 'id'))
+
+        scheduled = set(models.CourseSchedule.objects.filter(
+            study_record_id__in=study_records.values()).values_list('homework_id', flat=True))
+
+        homeworks = models.Homework.objects.filter(
+            chapter__course_id__in=module_ids,
+            enabled=True,
+        ).order_by('chapter__course_id', 'chapter__chapter', 'order').values_list(
+            'id', 'chapter__course_id', 'recommend_period')
+
+        schedules = []
+        recommend_date = {}
+        for homework_id, module_id, recommend_period in homeworks:
+            recommend_date[module_id] = recommend_date.get(module_id, start_date) + datetime.timedelta(
+                days=recommend_period)
+            if module_id not in study_records or homework_id in scheduled:
+                continue
+            schedules.append(models.CourseSchedule(
+                study_record_id=study_records[module_id],
+                homework_id=homework_id,
+                recommend_date=recommend_date[module_id],
+            ))
+        models.CourseSchedule.objects.bulk_create(schedules, batch_size=batch_size)
+
+        models.StudyRecord.objects.filter(id__in=study_records.values(), status=1).update(
+            status=2, open_date=start_date)
+        dashboard.refresh_on_commit([enrolled_degree_course.account_id])
+
+    return len(schedules)
+
+
+def open_first_module(enrolled_degree_course, start_date=None):
+    module_ids = degree_modules(enrolled_degree_course.degree_course_id)[:1]
+    if not module_ids:
+        return 0
+    return open_modules(enrolled_degree_course, module_ids, start_date=start_date)
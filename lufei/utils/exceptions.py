@@ -3,4 +3,7 @@ class PricePolicyDoesNotExist(Exception):
     pass
 
 class KeyDoesNotExist(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class PaymentError(Exception):
+    pass
@@ -0,0 +1,211 @@
+import datetime
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.functions import TruncSecond
+from django.utils import timezone
+
+import redis
+from lufei import models
+from lufei.utils.pool import POOL
+
+CONN = redis.Redis(connection_pool=POOL)
+
+logger = logging.getLogger(__name__)
+
+ONLINE = 0
+POSITIONS = [position for position, _ in models.Article.position_choices]
+
+# 权重占高位、上架时间(秒)占低10位，权重不超过32767时仍在double的精确范围内
+ORDER_WEIGHT = 10 ** 10
+
+
+def score_of(article):
+    return article.order * ORDER_WEIGHT + int(article.pub_date.timestamp())
+
+
+def member_of(article_id):
+    # 补齐位数，同分时按ID倒序
+    return "%010d" % int(article_id)
+
+
+def parse_cursor(cursor):
+    """
+    :return: (分数, 文章ID)，游标格式不对时抛出 ValueError
+    """
+    score, article_id = cursor.split(':')
+    # 权重可以为负数，分数也可能为负
+    score, article_id = int(score), int(article_id)
+    if article_id < 0:
+        raise ValueError("invalid cursor: %s" % cursor)
+    return score, article_id
+
+
+class ArticleFeed(object):
+    """
+    文章信息流，每个位置一个按(权重, 上架时间)排序的zset，只包含状态为在线且未到下架时间的文章
+        luffy_article_feed:<position>  zset: 文章ID -> 分数
+        luffy_article_feed:window      hash: 文章ID -> "上架时间戳:下架时间戳"，读取时过滤不在上架时间内的文章
+    分页用上一页最后一篇文章作游标，ZREVRANK定位后取下一页，翻到多深都是 O(log N)
+    还没有构建过时(luffy_article_feed:built 不存在)从数据库分页，同时在后台线程中构建，
+    luffy_article_feed:building 保证所有worker中同一时间只有一个线程在构建；
+    构建失败时记录日志，锁保留到过期(BUILD_LOCK_TIMEOUT)后才会再次尝试
+    """
+    BUILD_LOCK_TIMEOUT = 10 * 60
+
+    def __init__(self, conn=None, key=None):
+        self.conn = conn or CONN
+        self.key = key or settings.LUFFY_ARTICLE_FEED
+        self.window = "%s:window" % self.key
+        self.built = "%s:built" % self.key
+        self.building = "%s:building" % self.key
+
+    def key_for(self, position):
+        return "%s:%s" % (self.key, position)
+
+    def build(self):
+        """
+        全量重建所有位置，先写入临时key再RENAME，重建过程中读取不受影响
+        """
+        now = timezone.now()
+        articles = models.Article.objects.filter(status=ONLINE, offline_date__gt=now).only(
+            'id', 'position', 'order', 'pub_date', 'offline_date')
+        feeds, windows = {position: {} for position in POSITIONS}, {}
+        for article in articles.iterator():
+            feeds.setdefault(article.position, {})[member_of(article.id)] = score_of(article)
+            windows[article.id] = "%d:%d" % (article.pub_date.timestamp(), article.offline_date.timestamp())
+
+        pipe = self.conn.pipeline()
+        for position, members in feeds.items():
+            tmp = "%s:tmp" % self.key_for(position)
+            pipe.delete(tmp)
+            if members:
+                pipe.zadd(tmp, members)
+                pipe.rename(tmp, self.key_for(position))
+            else:
+                pipe.delete(self.key_for(position))
+        pipe.delete(self.window)
+        if windows:
+            pipe.hmset(self.window, windows)
+        pipe.set(self.built, 1)
+        pipe.execute()
+
+    def build_in_background(self):
+        """
+        抢到锁时在后台线程中全量构建，没抢到说明其它进程正在构建或上次构建失败还没到重试时间
+        """
+        if not self.conn.set(self.building, 1, nx=True, ex=self.BUILD_LOCK_TIMEOUT):
+            return
+
+        def run():
+            try:
+                self.build()
+            except Exception:
+                logger.exception("文章信息流构建失败，%s秒后重试", self.BUILD_LOCK_TIMEOUT)
+            else:
+                self.conn.delete(self.building)
+            finally:
+                connection.close()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def update(self, article):
+        """
+        文章保存后增量更新: 从所有位置移除，在线且未下架的加入所在位置
+        """
+        pipe = self.conn.pipeline()
+        for position in POSITIONS:
+            pipe.zrem(self.key_for(position), member_of(article.id))
+        if article.status == ONLINE and article.offline_date > timezone.now():
+            pipe.zadd(self.key_for(article.position), {member_of(article.id): score_of(article)})
+            pipe.hset(self.window, article.id, "%d:%d" % (
+                article.pub_date.timestamp(), article.offline_date.timestamp()))
+        else:
+            pipe.hdel(self.window, article.id)
+        pipe.execute()
+
+    def remove(self, article_id):
+        pipe = self.conn.pipeline()
+        for position in POSITIONS:
+            pipe.zrem(self.key_for(position), member_of(article_id))
+        pipe.hdel(self.window, article_id)
+        pipe.execute()
+
+    def page(self, position, cursor=None, size=20, now=None):
+        """
+        :param cursor: 上一页返回的next_cursor
+        :return: (文章ID列表, next_cursor)
+        """
+        cursor = parse_cursor(cursor) if cursor else None
+        now = now or time.time()
+        if not self.conn.exists(self.built):
+            self.build_in_background()
+            return self.page_from_db(position, cursor, size, now)
+        key = self.key_for(position)
+
+        start = 0
+        if cursor:
+            score, article_id = cursor
+            rank = self.conn.zrevrank(key, member_of(article_id))
+            if rank is None:
+                # 游标文章已移出时，从分数比它低的文章开始
+                rank = self.conn.zcount(key, "(%s" % score, "+inf") - 1
+            start = rank + 1
+
+        article_ids, expired, next_cursor = [], [], None
+        while len(article_ids) < size:
+            # 多取一些，抵掉还没到上架时间的文章
+            members = self.conn.zrevrange(key, start, start + size * 2 - 1, withscores=True)
+            if not members:
+                break
+            start += len(members)
+            windows = self.conn.hmget(self.window, [int(member) for member, _ in members])
+            for (member, score), window in zip(members, windows):
+                pub, offline = (int(value) for value in window.split(b':')) if window else (0, 0)
+                if offline <= now:
+                    expired.append(member)
+                elif pub <= now:
+                    article_ids.append(int(member))
+                    next_cursor = "%d:%s" % (score, member.decode('utf-8'))
+                    if len(article_ids) == size:
+                        break
+
+        if expired:
+            # 已过下架时间的文章顺便移出
+            pipe = self.conn.pipeline()
+            pipe.zrem(key, *expired)
+            pipe.hdel(self.window, *[int(member) for member in expired])
+            pipe.execute()
+        if len(article_ids) < size:
+            next_cursor = None
+        return article_ids, next_cursor
+
+    def page_from_db(self, position, cursor=None, size=20, now=None):
+        """
+        与page相同的顺序和游标，直接查数据库，只在信息流构建完成前使用
+        zset中的分数只精确到秒，这里同样按(权重, 截断到秒的上架时间, ID)倒序
+        """
+        now = datetime.datetime.fromtimestamp(now or time.time(), tz=timezone.utc)
+        queryset = models.Article.objects.filter(
+            status=ONLINE, position=position, pub_date__lte=now, offline_date__gt=now).annotate(
+            pub_second=TruncSecond('pub_date'))
+        if cursor:
+            score, article_id = cursor
+            order, timestamp = divmod(score, ORDER_WEIGHT)
+            second = datetime.datetime.fromtimestamp(timestamp, tz=timezone.utc)
+            queryset = queryset.filter(
+                Q(order__lt=order) |
+                Q(order=order, pub_second__lt=second) |
+                Q(order=order, pub_second=second, id__lt=article_id))
+        articles = list(queryset.order_by('-order', '-pub_second', '-id').only('id', 'order', 'pub_date')[:size])
+        next_cursor = None
+        if len(articles) == size:
+            next_cursor = "%d:%s" % (score_of(articles[-1]), member_of(articles[-1].id))
+        return [article.id for article in articles], next_cursor
+
+
+article_feed = ArticleFeed()
@@ -0,0 +1,331 @@
+import binascii
+import datetime
+import hashlib
+import io
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import urlencode
+
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+
+from lufei import models
+from lufei.utils.bench import summary
+
+# 价格为整数，下单时全部用贝里支付
+PRICES = ((30, 99), (60, 179))
+
+
+def seed(users, courses, coupons=3, prefix="bench"):
+    """
+    压测数据: 课程和价格策略、账户和token、每个账户若干张通用券
+    全部用bulk_create，不触发信号，缓存在第一次访问时从数据库加载
+    :return: [(账户ID, 用户名, 密码, token)], {课程ID: [(价格策略ID, 价格)]}
+    """
+    now = timezone.now()
+    today = now.date()
+    course_type = ContentType.objects.get_for_model(models.Course)
+
+    category = models.CourseCategory.objects.create(name="%s_category" % prefix)
+    sub_category = models.CourseSubCategory.objects.create(category=category, name="%s_sub_category" % prefix)
+    models.Course.objects.bulk_create([
+        models.Course(name="%s_course_%s" % (prefix, i), course_img="img/%s_%s.png" % (prefix, i),
+                      sub_category=sub_category, course_type=0, brief="%s课程%s" % (prefix, i), order=i)
+        for i in range(courses)
+    ])
+    # bulk_create在MySQL下不会回填主键，再按唯一字段查一次
+    course_ids = list(models.Course.objects.filter(sub_category=sub_category).values_list('id', flat=True))
+    models.PricePolicy.objects.bulk_create([
+        models.PricePolicy(content_type=course_type, object_id=course_id, valid_period=valid_period, price=price)
+        for course_id in course_ids for valid_period, price in PRICES
+    ])
+    price_policies = {course_id: [] for course_id in course_ids}
+    for policy_id, course_id, price in models.PricePolicy.objects.filter(
+            content_type=course_type, object_id__in=course_ids).order_by('valid_period').values_list(
+            'id', 'object_id', 'price'):
+        price_policies[course_id].append((policy_id, int(price)))
+
+    usernames = ["%s_user_%s" % (prefix, i) for i in range(users)]
+    models.Account.objects.bulk_create([
+        models.Account(username=username, uid=hashlib.md5(username.encode('utf-8')).hexdigest(), password=prefix,
+                       balance=10 ** 9)
+        for username in usernames
+    ])
+    account_ids = dict(models.Account.objects.filter(username__in=usernames).values_list('username', 'id'))
+    # UserAuthToken.save 会重新生成token，这里直接写入
+    tokens = {username: binascii.hexlify(os.urandom(20)).decode() for username in usernames}
+    models.UserAuthToken.objects.bulk_create([
+        models.UserAuthToken(user_id=account_ids[username], token=tokens[username], created=now)
+        for username in usernames
+    ])
+
+    coupon = models.Coupon.objects.create(
+        name="%s_coupon" % prefix, coupon_type=0, money_equivalent_value=10, quantity=users * coupons,
+        open_date=today, close_date=today + datetime.timedelta(days=30),
+        valid_begin_date=today, valid_end_date=today + datetime.timedelta(days=30))
+    models.CouponRecord.objects.bulk_create([
+        models.CouponRecord(coupon=coupon, account_id=account_id, get_time=now)
+        for account_id in account_ids.values() for _ in range(coupons)
+    ], batch_size=1000)
+
+    accounts = [(account_ids[username], username, prefix, tokens[username]) for username in usernames]
+    return accounts, price_policies
+
+
+class Stats(object):
+    """
+    各接口的耗时和结果，多个线程共用
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.errors = {}
+        self.codes = {}
+
+    def record(self, endpoint, elapsed, status, code):
+        with self.lock:
+            self.timings.setdefault(endpoint, []).append(elapsed)
+            if status >= 400:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            codes = self.codes.setdefault(endpoint, {})
+            codes[str(code)] = codes.get(str(code), 0) + 1
+
+    def report(self, elapsed):
+        """
+        :param elapsed: 压测总时长(秒)，用于计算每秒请求数
+        """
+        endpoints = {}
+        for endpoint, timings in sorted(self.timings.items()):
+            endpoints[endpoint] = dict(
+                summary(timings),
+                rps=len(timings) / elapsed,
+                errors=self.errors.get(endpoint, 0),
+                codes=self.codes[endpoint],
+            )
+        timings = [timing for items in self.timings.values() for timing in items]
+        total = dict(summary(timings), rps=len(timings) / elapsed, errors=sum(self.errors.values()))
+        return {"elapsed": elapsed, "endpoints": endpoints, "total": total}
+
+
+class WSGIClient(object):
+    """
+    直接调用WSGI application，不经过网络，包括全部中间件
+    """
+
+    def __init__(self, application, stats, prefix="/api/v1/"):
+        self.application = application
+        self.stats = stats
+        self.prefix = prefix
+
+    def request(self, method, path, data=None, token=None, record=True):
+        """
+        :return: (HTTP状态码, 响应JSON)
+        """
+        query = {"token": token} if token else {}
+        body = b""
+        if method == "GET":
+            query.update(data or {})
+        elif data is not None:
+            body = json.dumps(data).encode('utf-8')
+        environ = {
+            "REQUEST_METHOD": method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": self.prefix + path,
+            "QUERY_STRING": urlencode(query),
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(body)),
+            "SERVER_NAME": "testserver",
+            "SERVER_PORT": "80",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "HTTP_HOST": "testserver",
+            "REMOTE_ADDR": "127.0.0.1",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": io.StringIO(),
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        status = []
+
+        def start_response(status_line, headers, exc_info=None):
+            status.append(int(status_line.split()[0]))
+
+        start = time.time()
+        result = self.application(environ, start_response)
+        try:
+            content = b"".join(result)
+        finally:
+            # 触发request_finished，与真实服务器一样归还数据库连接
+            if hasattr(result, 'close'):
+                result.close()
+        elapsed = time.time() - start
+
+        try:
+            response = json.loads(content.decode('utf-8'))
+        except ValueError:
+            response = {}
+        code = response.get("code") if isinstance(response, dict) else None
+        if record:
+            self.stats.record("%s %s" % (method, path.split('?')[0]), elapsed, status[0], code)
+        return status[0], response
+
+
+class VirtualUser(object):
+    """
+    一个压测用户，按权重随机执行任务(与locust的TaskSet相同)
+    购物车和结算状态记在本地，只执行当前状态下可以执行的任务
+    """
+    # (权重, 任务)
+    TASKS = (
+        (1, "login"),
+        (4, "view_cart"),
+        (3, "add_to_cart"),
+        (1, "change_price_policy"),
+        (2, "settle"),
+        (2, "view_settlement"),
+        (1, "checkout"),
+    )
+
+    def __init__(self, client, account, price_policies, rng):
+        self.client = client
+        self.account_id, self.username, self.password, self.token = account
+        self.price_policies = price_policies
+        self.course_ids = list(price_policies)
+        self.rng = rng
+        # 购物车中的课程ID -> 价格策略(ID, 价格)
+        self.cart = {}
+        # 已结算的课程ID
+        self.settled = None
+
+    def available(self, task):
+        if task in ("change_price_policy", "settle"):
+            return bool(self.cart)
+        if task in ("view_settlement", "checkout"):
+            return self.settled is not None
+        return True
+
+    def run_task(self, record=True):
+        tasks = [(weight, task) for weight, task in self.TASKS if self.available(task)]
+        point = self.rng.uniform(0, sum(weight for weight, _ in tasks))
+        for weight, task in tasks:
+            point -= weight
+            if point <= 0:
+                break
+        getattr(self, task)(record)
+
+    def login(self, record):
+        self.client.request("POST", "auth/", {"username": self.username, "password": self.password}, record=record)
+
+    def view_cart(self, record):
+        self.client.request("GET", "shopping_car/", token=self.token, record=record)
+
+    def add_to_cart(self, record):
+        course_id = self.rng.choice(self.course_ids)
+        policy = self.rng.choice(self.price_policies[course_id])
+        status, response = self.client.request(
+            "POST", "shopping_car/", {"course_id": course_id, "price_policy_id": policy[0]},
+            token=self.token, record=record)
+        if response.get("code") == 1000:
+            self.cart[course_id] = policy
+
+    def change_price_policy(self, record):
+        course_id = self.rng.choice(list(self.cart))
+        policy = self.rng.choice(self.price_policies[course_id])
+        status, response = self.client.request(
+            "PUT", "shopping_car/", {"course_id": course_id, "price_policy_id": policy[0]},
+            token=self.token, record=record)
+        if response.get("code") == 1000:
+            self.cart[course_id] = policy
+
+    def settle(self, record):
+        course_id = self.rng.choice(list(self.cart))
+        status, response = self.client.request(
+            "POST", "accounts/", {"course_id": course_id, "de_price_policy_id": self.cart[course_id][0]},
+            token=self.token, record=record)
+        if response.get("code") == 1000:
+            self.settled = course_id
+
+    def view_settlement(self, record):
+        self.client.request("GET", "accounts/", token=self.token, record=record)
+
+    def checkout(self, record):
+        course_id = self.settled
+        status, response = self.client.request(
+            "POST", "pay/", {"payment_type": 3, "balance": self.cart[course_id][1]},
+            token=self.token, record=record)
+        # 下单成功后课程从购物车和结算中心移除，失败时结算信息也可能已经失效
+        self.settled = None
+        if response.get("code") == 1000:
+            self.cart.pop(course_id, None)
+
+
+def run(application, accounts, price_policies, duration=None, requests=None, warmup=0, seed=0):
+    """
+    每个账户一个线程，执行 requests 个任务或持续 duration 秒
+    :return: Stats.report 的结果
+    """
+    stats = Stats()
+    client = WSGIClient(application, stats)
+    barrier = threading.Barrier(len(accounts) + 1)
+
+    def worker(index, account):
+        from django.db import connections
+
+        user = VirtualUser(client, account, price_policies, random.Random(seed + index))
+        try:
+            try:
+                for _ in range(warmup):
+                    user.run_task(record=False)
+            except Exception:
+                # 其它线程和主线程不再等待
+                barrier.abort()
+                raise
+            barrier.wait()
+            deadline = time.time() + duration if duration else None
+            done = 0
+            while (requests is None or done < requests) and (deadline is None or time.time() < deadline):
+                user.run_task()
+                done += 1
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker, args=(index, account)) for index, account in enumerate(accounts)]
+    for thread in threads:
+        thread.start()
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        for thread in threads:
+            thread.join()
+        raise RuntimeError("预热失败，见线程中的异常")
+    start = time.time()
+    for thread in threads:
+        thread.join()
+    return stats.report(time.time() - start)
+
+
+def compare(baseline, current, threshold):
+    """
+    与基准结果比较各接口的p95和每秒请求数
+    :param threshold: 允许的变差比例，0.2 为p95增加或吞吐下降超过20%算退化
+    :return: [(接口, 指标, 基准, 当前, 变化比例, 是否退化)]
+    """
+    rows = []
+    endpoints = dict(current["endpoints"], total=current["total"])
+    baseline_endpoints = dict(baseline["endpoints"], total=baseline["total"])
+    for endpoint, stats in sorted(endpoints.items()):
+        old = baseline_endpoints.get(endpoint)
+        if not old:
+            continue
+        for metric, worse in (("p95", 1), ("rps", -1)):
+            if not old[metric]:
+                continue
+            change = (stats[metric] - old[metric]) / old[metric]
+            rows.append((endpoint, metric, old[metric], stats[metric], change, change * worse > threshold))
+    return rows
@@ -0,0 +1,134 @@
+import time
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+import redis
+from lufei import models
+from lufei.utils.payment import generate_number
+from lufei.utils.pool import POOL
+
+CONN = redis.Redis(connection_pool=POOL)
+
+# 取出到期的订单: 先把租约已过期的(处理中进程退出了)放回队列，再把到期的订单移到处理中并设置租约
+# KEYS: 待取消队列, 处理中  ARGV: 当前时间, 数量, 租约到期时间
+POP_DUE_LUA = """
+local stale = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, order_id in ipairs(stale) do
+    redis.call('ZADD', KEYS[1], ARGV[1], order_id)
+    redis.call('ZREM', KEYS[2], order_id)
+end
+local order_ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, order_id in ipairs(order_ids) do
+    redis.call('ZADD', KEYS[2], ARGV[3], order_id)
+    redis.call('ZREM', KEYS[1], order_id)
+end
+return order_ids
+"""
+
+pop_due_script = CONN.register_script(POP_DUE_LUA)
+
+PENDING = 1
+TIMEOUT_CANCELED = 5
+
+
+class OrderTimeoutQueue(object):
+    """
+    待支付订单的超时队列
+        luffy_order_timeout             zset: 订单ID -> 超时时间戳
+        luffy_order_timeout:processing  zset: 订单ID -> 租约到期时间戳，worker确认后删除
+    worker只按时间戳从redis取到期的订单，不需要轮询MySQL
+    """
+
+    def __init__(self, conn=None, lease=60):
+        self.conn = conn or CONN
+        self.key = settings.LUFFY_ORDER_TIMEOUT
+        self.processing = "%s:processing" % self.key
+        self.lease = lease
+
+    def push(self, order_id, deadline):
+        """
+        :param deadline: 超时时间(datetime)
+        """
+        self.conn.zadd(self.key, {order_id: deadline.timestamp()})
+
+    def remove(self, order_id):
+        """
+        订单已支付或主动取消时移出队列
+        """
+        pipe = self.conn.pipeline()
+        pipe.zrem(self.key, order_id)
+        pipe.zrem(self.processing, order_id)
+        pipe.execute()
+
+    def pop_due(self, count, now=None):
+        now = now or time.time()
+        order_ids = pop_due_script(
+            keys=[self.key, self.processing], args=[now, count, now + self.lease], client=self.conn)
+        return [int(order_id) for order_id in order_ids]
+
+    def ack(self, order_ids):
+        if order_ids:
+            self.conn.zrem(self.processing, *order_ids)
+
+
+def cancel_orders(order_ids, now=None):
+    """
+    在一个事务中取消一批超时未支付的订单:
+    订单改为超时取消 -> 释放订单使用的优惠券 -> 退回下单时扣除的贝里
+    已经支付或取消的订单跳过
+    :return: 取消的订单数
+    """
+    now = now or timezone.now()
+    order_content_type = ContentType.objects.get_for_model(models.Order)
+    with transaction.atomic():
+        order_ids = list(models.Order.objects.select_for_update().filter(
+            id__in=order_ids, status=PENDING).values_list('id', flat=True))
+        if not order_ids:
+            return 0
+
+        models.Order.objects.filter(id__in=order_ids).update(status=TIMEOUT_CANCELED, cancel_time=now)
+        models.CouponRecord.objects.filter(order_id__in=order_ids, status=1).update(
+            status=0, order=None, used_time=None)
+
+        spent = list(models.TransactionRecord.objects.filter(
+            transaction_type=1,
+            content_type=order_content_type,
+            object_id__in=order_ids,
+        ).values_list('object_id', 'account_id', 'amount'))
+        if spent:
+            amounts = {}
+            for order_id, account_id, amount in spent:
+                amounts[account_id] = amounts.get(account_id, 0) + amount
+
+            balances = dict(models.Account.objects.select_for_update().filter(
+                id__in=amounts).values_list('id', 'balance'))
+
+            refunds = []
+            for order_id, account_id, amount in spent:
+                balances[account_id] += amount
+                refunds.append(models.TransactionRecord(
+                    account_id=account_id,
+                    amount=amount,
+                    balance=balances[account_id],
+                    transaction_type=2,
+                    content_type=order_content_type,
+                    object_id=order_id,
+                    transaction_number=generate_number("T"),
+                    memo="订单超时取消，退回贝里",
+                ))
+            models.TransactionRecord.objects.bulk_create(refunds)
+
+            models.Account.objects.filter(id__in=amounts).update(balance=F('balance') + Case(
+                *[When(id=account_id, then=Value(amount)) for account_id, amount in amounts.items()],
+                default=Value(0),
+                output_field=IntegerField()
+            ))
+
+    return len(order_ids)
+
+
+order_timeout = OrderTimeoutQueue()
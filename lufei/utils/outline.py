@@ -0,0 +1,199 @@
+import json
+
+from django.conf import settings
+from django.db.models import Prefetch
+
+import redis
+from lufei import models
+from lufei.utils.cache import LRUCache
+from lufei.utils.pool import POOL
+
+CONN = redis.Redis(connection_pool=POOL)
+
+DETAIL = "detail"
+CHAPTER = "chapter:%s"
+
+
+def dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+class CourseOutlineTree(object):
+    """
+    课程大纲(课程表)的物化缓存
+    每个课程一个redis hash luffy_course_outline:<course_id>:
+        detail       -> 课程详情、讲师、推荐课程、大纲
+        chapter:<id> -> 一个章节及其所有课时
+    章节/课时修改只重建对应章节的field，详情/大纲/讲师修改只重建detail，读取只需一次HGETALL
+    进程内再缓存一份组装好的文档，信号只能清除当前进程的，其它进程靠ttl过期
+
+    每次增量更新都给 luffy_course_outline:<course_id>:version 加1，build 读数据库前记下版本号，
+    写入时WATCH版本号，期间有修改就放弃写入，避免用修改前读到的数据覆盖修改
+    hash有过期时间(redis_ttl)，漏掉的修改最多保留这么久
+    只缓存上线的课程，课程下线时由信号删除
+    """
+
+    def __init__(self, conn=None, maxsize=512, ttl=30, redis_ttl=24 * 60 * 60):
+        self.conn = conn or CONN
+        self.local = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.redis_ttl = redis_ttl
+
+    @staticmethod
+    def key_for(course_id):
+        return "%s:%s" % (settings.LUFFY_COURSE_OUTLINE, course_id)
+
+    @classmethod
+    def version_key_for(cls, course_id):
+        return "%s:version" % cls.key_for(course_id)
+
+    def get_version(self, course_id):
+        version = self.conn.get(self.version_key_for(course_id))
+        return int(version) if version else 0
+
+    def bump_version(self, course_id):
+        pipe = self.conn.pipeline(transaction=False)
+        pipe.incr(self.version_key_for(course_id))
+        pipe.expire(self.version_key_for(course_id), self.redis_ttl)
+        pipe.execute()
+
+    def get(self, course_id):
+        """
+        获取课程大纲，课程不存在或没有上线时抛出 Course.DoesNotExist
+        """
+        course_id = int(course_id)
+        tree = self.local.get(course_id)
+        if tree is not None:
+            return tree
+
+        fields = self.conn.hgetall(self.key_for(course_id))
+        if fields:
+            fields = {k.decode('utf-8'): json.loads(v.decode('utf-8')) for k, v in fields.items()}
+        else:
+            fields = self.build(course_id)
+
+        tree = self.assemble(course_id, fields)
+        self.local.set(course_id, tree)
+        return tree
+
+    def assemble(self, course_id, fields):
+        chapters = [value for field, value in fields.items() if field.startswith("chapter:")]
+        chapters.sort(key=lambda item: item["chapter"])
+        return {"id": course_id, "detail": fields.get(DETAIL), "chapters": chapters}
+
+    def build(self, course_id):
+        """
+        从数据库构建整个课程的大纲并写入redis，只构建上线的课程，与课程详情接口一致
+        """
+        version = self.get_version(course_id)
+        if not models.Course.objects.filter(id=course_id, status=0).exists():
+            raise models.Course.DoesNotExist("课程不存在: %s" % course_id)
+
+        fields = {DETAIL: self.build_detail(course_id)}
+        for chapter in self.chapter_queryset().filter(course_id=course_id):
+            fields[CHAPTER % chapter.id] = self.serialize_chapter(chapter)
+
+        key = self.key_for(course_id)
+        with self.conn.pipeline() as pipe:
+            try:
+                pipe.watch(self.version_key_for(course_id))
+                current = pipe.get(self.version_key_for(course_id))
+                if (int(current) if current else 0) == version:
+                    pipe.multi()
+                    pipe.delete(key)
+                    pipe.hmset(key, {k: dumps(v) for k, v in fields.items()})
+                    pipe.expire(key, self.redis_ttl)
+                    pipe.execute()
+            except redis.WatchError:
+                # 构建期间有修改，这次的结果只返回不写入，下次读取时重新构建
+                pass
+        return fields
+
+    def chapter_queryset(self):
+        return models.CourseChapter.objects.prefetch_related(
+            Prefetch('coursesections', queryset=models.CourseSection.objects.order_by('order'))
+        )
+
+    def serialize_chapter(self, chapter):
+        return {
+            "id": chapter.id,
+            "chapter": chapter.chapter,
+            "name": chapter.name,
+            "summary": chapter.summary,
+            "sections": [
+                {
+                    "id": section.id,
+                    "name": section.name,
+                    "order": section.order,
+                    "section_type": section.section_type,
+                    "section_link": section.section_link,
+                    "video_time": section.video_time,
+                    "free_trail": section.free_trail,
+                } for section in chapter.coursesections.all()
+            ],
+        }
+
+    def build_detail(self, course_id):
+        detail = models.CourseDetail.objects.filter(course_id=course_id).prefetch_related(
+            'teachers',
+            'recommend_courses',
+            Prefetch('courseoutline_set', queryset=models.CourseOutline.objects.order_by('order')),
+        ).first()
+        if not detail:
+            return None
+
+        return {
+            "hours": detail.hours,
+            "course_slogan": detail.course_slogan,
+            "video_brief_link": detail.video_brief_link,
+            "why_study": detail.why_study,
+            "what_to_study_brief": detail.what_to_study_brief,
+            "career_improvement": detail.career_improvement,
+            "prerequisite": detail.prerequisite,
+            "teachers": [
+                {"id": item.id, "name": item.name, "title": item.title, "image": item.image, "brief": item.brief}
+                for item in detail.teachers.all()
+            ],
+            "recommend_courses": [
+                {"id": item.id, "name": item.name, "course_img": item.course_img}
+                for item in detail.recommend_courses.all()
+            ],
+            "outlines": [
+                {"id": item.id, "title": item.title, "order": item.order, "content": item.content}
+                for item in detail.courseoutline_set.all()
+            ],
+        }
+
+    # ######################## 增量更新 ########################
+    # 由信号在事务提交后调用；课程还没有构建过大纲时只更新版本号，第一次读取时再构建
+
+    def rebuild_detail(self, course_id):
+        self.local.delete(int(course_id))
+        self.bump_version(course_id)
+        key = self.key_for(course_id)
+        if self.conn.exists(key):
+            self.conn.hset(key, DETAIL, dumps(self.build_detail(course_id)))
+
+    def rebuild_chapter(self, course_id, chapter_id):
+        self.local.delete(int(course_id))
+        self.bump_version(course_id)
+        key = self.key_for(course_id)
+        if not self.conn.exists(key):
+            return
+        chapter = self.chapter_queryset().filter(id=chapter_id).first()
+        if chapter:
+            self.conn.hset(key, CHAPTER % chapter_id, dumps(self.serialize_chapter(chapter)))
+        else:
+            self.conn.hdel(key, CHAPTER % chapter_id)
+
+    def remove_chapter(self, course_id, chapter_id):
+        self.local.delete(int(course_id))
+        self.bump_version(course_id)
+        self.conn.hdel(self.key_for(course_id), CHAPTER % chapter_id)
+
+    def remove(self, course_id):
+        self.local.delete(int(course_id))
+        self.bump_version(course_id)
+        self.conn.delete(self.key_for(course_id))
+
+
+outline_tree = CourseOutlineTree()
@@ -0,0 +1,214 @@
+import datetime
+import json
+import uuid
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+import redis
+from lufei import models
+from lufei.utils.dashboard import dashboard
+from lufei.utils.exceptions import PaymentError
+from lufei.utils.pool import POOL
+from lufei.utils.pricing import best_assignment, coupon_discount
+from lufei.utils.shopping_car import ShoppingCar
+
+CONN = redis.Redis(connection_pool=POOL)
+
+# 有效期显示 -> 天数，如 "1个月" -> 30
+VALID_PERIOD_DAYS = {display: days for days, display in models.PricePolicy.valid_period_choices}
+
+
+def generate_number(prefix):
+    return "%s%s%s" % (prefix, timezone.now().strftime('%Y%m%d%H%M%S'), uuid.uuid4().hex[:12])
+
+
+def load_settlement(account_id):
+    """
+    读取AccountView/BatchAccountView写入redis的结算信息
+    :return: ({course_id: 课程结算信息}, {优惠券记录ID: 通用券})
+    """
+    data = CONN.hget(settings.ACCOUNT_COUPON, account_id)
+    if not data:
+        raise PaymentError("结算信息不存在")
+
+    courses, global_coupons = {}, {}
+    for item in json.loads(data.decode('utf-8')):
+        if "my_coupon_list" in item:
+            for coupon in item["my_coupon_list"]:
+                global_coupons.update(coupon)
+        else:
+            courses.update(item)
+    return courses, global_coupons
+
+
+def calculate(courses, global_coupons, course_coupon_ids, global_coupon_id, balance):
+    """
+    根据结算信息计算每个课程的折后价格和实付金额
+    :param course_coupon_ids: {course_id: 课程券记录ID}
+    :param global_coupon_id: 通用券记录ID
+    :param balance: 使用的贝里
+    :return: (课程明细列表, 实付金额, 使用的优惠券记录ID列表)
+    """
+    details, used_coupons = [], []
+    for course_id, course in courses.items():
+        price = course["price"]
+        coupon_id = course_coupon_ids.get(course_id)
+        if coupon_id:
+            coupons = {}
+            for coupon in course["course_coupon_list"]:
+                coupons.update(coupon)
+            if str(coupon_id) not in coupons:
+                raise PaymentError("课程优惠券不可用: %s" % coupon_id)
+            price -= coupon_discount(price, coupons[str(coupon_id)])
+            used_coupons.append(int(coupon_id))
+
+        details.append({
+            "course_id": int(course_id),
+            "original_price": course["price"],
+            "price": round(price, 2),
+            "valid_period_display": course["valid_period"],
+            "valid_period": VALID_PERIOD_DAYS[course["valid_period"]],
+        })
+
+    total = sum(item["price"] for item in details)
+    if global_coupon_id:
+        if str(global_coupon_id) not in global_coupons:
+            raise PaymentError("通用优惠券不可用: %s" % global_coupon_id)
+        original_price = sum(item["original_price"] for item in details)
+        total -= coupon_discount(total, global_coupons[str(global_coupon_id)], original_price)
+        used_coupons.append(int(global_coupon_id))
+
+    if balance < 0:
+        raise PaymentError("使用的贝里不能为负数")
+    if balance > total:
+        raise PaymentError("使用的贝里超过了订单金额")
+    return details, round(total - balance, 2), used_coupons
+
+
+def best_coupons(courses, global_coupons):
+    """
+    为结算信息计算最优的优惠券组合
+    :return: ({course_id: 课程券记录ID}, 通用券记录ID)
+    """
+    items = []
+    for course_id, course in courses.items():
+        coupons = []
+        for coupon in course["course_coupon_list"]:
+            coupons.extend(coupon.values())
+        items.append({"id": course_id, "price": course["price"], "coupons": coupons})
+
+    result = best_assignment(items, list(global_coupons.values()))
+    course_coupon_ids = {course_id: item["coupon"] for course_id, item in result["courses"].items() if item["coupon"]}
+    return course_coupon_ids, result["global_coupon"]
+
+
+def create_order(account_id, payment_type, course_coupon_ids=None, global_coupon_id=None, balance=0, actual_amount=None,
+                 auto_coupon=False):
+    """
+    创建订单，在一个事务中完成，SQL数与课程数无关：
+    锁账户 -> 锁优惠券 -> 订单 -> bulk_create订单详情 -> 优惠券批量更新 -> 扣贝里 -> bulk_create交易记录 -> 开通课程
+    实付金额为0时订单直接完成，否则为待支付
+    :param auto_coupon: 忽略传入的优惠券，自动使用最优的优惠券组合
+    """
+    if payment_type not in dict(models.Order.payment_type_choices):
+        raise PaymentError("不支持的支付方式: %s" % payment_type)
+    courses, global_coupons = load_settlement(account_id)
+    if not courses:
+        raise PaymentError("没有要结算的课程")
+    if auto_coupon:
+        course_coupon_ids, global_coupon_id = best_coupons(courses, global_coupons)
+    details, amount, used_coupons = calculate(
+        courses, global_coupons, course_coupon_ids or {}, global_coupon_id, balance)
+    if actual_amount is not None and round(float(actual_amount), 2) != amount:
+        raise PaymentError("订单金额已变化，请重新结算")
+
+    now = timezone.now()
+    course_content_type = ContentType.objects.get_for_model(models.Course)
+    with transaction.atomic():
+        account = models.Account.objects.select_for_update().only('id', 'balance').get(id=account_id)
+        if balance > account.balance:
+            raise PaymentError("贝里余额不足")
+
+        if used_coupons:
+            locked = models.CouponRecord.objects.select_for_update().filter(
+                id__in=used_coupons, account_id=account_id, status=0).values_list('id', flat=True)
+            if len(locked) != len(used_coupons):
+                raise PaymentError("优惠券已被使用")
+
+        order = models.Order.objects.create(
+            payment_type=payment_type,
+            order_number=generate_number("O"),
+            account_id=account_id,
+            actual_amount=amount,
+            status=0 if amount == 0 else 1,
+            pay_time=now if amount == 0 else None,
+        )
+
+        models.OrderDetail.objects.bulk_create([
+            models.OrderDetail(
+                order=order,
+                content_type=course_content_type,
+                object_id=item["course_id"],
+                original_price=item["original_price"],
+                price=item["price"],
+                valid_period_display=item["valid_period_display"],
+                valid_period=item["valid_period"],
+            ) for item in details
+        ])
+
+        if used_coupons:
+            models.CouponRecord.objects.filter(id__in=used_coupons).update(status=1, used_time=now, order=order)
+
+        if balance:
+            models.Account.objects.filter(id=account_id).update(balance=F('balance') - balance)
+            models.TransactionRecord.objects.bulk_create([
+                models.TransactionRecord(
+                    account_id=account_id,
+                    amount=balance,
+                    balance=account.balance - balance,
+                    transaction_type=1,
+                    content_type=ContentType.objects.get_for_model(models.Order),
+                    object_id=order.id,
+                    transaction_number=generate_number("T"),
+                    memo="订单%s使用贝里" % order.order_number,
+                )
+            ])
+
+        if order.status == 0:
+            enroll(order, now)
+        else:
+            # 待支付订单放入超时队列，超时未支付由 cancel_timeout_orders 取消
+            from lufei.utils.order_timeout import order_timeout
+            deadline = now + datetime.timedelta(seconds=settings.LUFFY_ORDER_TIMEOUT_SECONDS)
+            transaction.on_commit(lambda: order_timeout.push(order.id, deadline))
+
+    # 已下单的课程从购物车和结算中心移除
+    pipe = CONN.pipeline()
+    pipe.hdel(ShoppingCar.key_for(account_id), *courses.keys())
+    pipe.hdel(settings.ACCOUNT_COUPON, account_id)
+    pipe.execute()
+    return order
+
+
+def enroll(order, now=None):
+    """
+    为已支付的订单开通课程，待支付订单在支付成功后调用
+    bulk_create在MySQL下不会回填主键，所以再查一次订单详情
+    """
+    today = timezone.localtime(now or timezone.now()).date()
+    details = models.OrderDetail.objects.filter(order=order).values_list('id', 'object_id', 'valid_period')
+    models.EnrolledCourse.objects.bulk_create([
+        models.EnrolledCourse(
+            account_id=order.account_id,
+            course_id=course_id,
+            valid_begin_date=today,
+            valid_end_date=today + datetime.timedelta(days=valid_period),
+            order_detail_id=detail_id,
+        ) for detail_id, course_id, valid_period in details
+    ])
+    # bulk_create不会触发信号
+    dashboard.refresh_on_commit([order.account_id])
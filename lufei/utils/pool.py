@@ -1,7 +1,173 @@
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
 import redis
+import redis.connection
+
+# settings.REDIS 中未配置的项使用默认值
+DEFAULTS = {
+    "HOST": "127.0.0.1",
+    "PORT": 6379,
+    "DB": 0,
+    "PASSWORD": None,
+    # 每个进程的最大连接数
+    "MAX_CONNECTIONS": 50,
+    # 连接用尽时等待的秒数，为None时不等待直接报错
+    "BLOCKING_TIMEOUT": 5,
+    "SOCKET_TIMEOUT": 5,
+    "SOCKET_CONNECT_TIMEOUT": 3,
+    "SOCKET_KEEPALIVE": True,
+    "RETRY_ON_TIMEOUT": True,
+    # 连接空闲超过该秒数后，使用前先PING检查 (redis-py>=3.3)
+    "HEALTH_CHECK_INTERVAL": 30,
+    # "hiredis" / "python"，为None时由redis-py决定(安装了hiredis就使用hiredis)
+    "PARSER": None,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'REDIS', {}))
+    return config
+
+
+def get_parser_class(name):
+    if name == "hiredis":
+        parser_class = getattr(redis.connection, 'HiredisParser', None) or getattr(redis.connection, '_HiredisParser')
+        if not getattr(redis.connection, 'HIREDIS_AVAILABLE', False):
+            raise ImportError("PARSER配置为hiredis，但hiredis没有安装")
+        return parser_class
+    if name == "python":
+        return getattr(redis.connection, 'PythonParser', None) or getattr(redis.connection, '_RESP2Parser')
+    raise ValueError("不支持的PARSER: %s" % name)
+
+
+def create_pool(**overrides):
+    """
+    根据 settings.REDIS 创建连接池
+    """
+    config = get_config()
+    config.update(overrides)
+
+    kwargs = {
+        "host": config["HOST"],
+        "port": config["PORT"],
+        "db": config["DB"],
+        "password": config["PASSWORD"],
+        "max_connections": config["MAX_CONNECTIONS"],
+        "socket_timeout": config["SOCKET_TIMEOUT"],
+        "socket_connect_timeout": config["SOCKET_CONNECT_TIMEOUT"],
+        "socket_keepalive": config["SOCKET_KEEPALIVE"],
+        "retry_on_timeout": config["RETRY_ON_TIMEOUT"],
+    }
+    if config["HEALTH_CHECK_INTERVAL"] and redis.VERSION >= (3, 3):
+        kwargs["health_check_interval"] = config["HEALTH_CHECK_INTERVAL"]
+    if config["PARSER"]:
+        kwargs["parser_class"] = get_parser_class(config["PARSER"])
+    if "CONNECTION_CLASS" in config:
+        connection_class = config["CONNECTION_CLASS"]
+        # settings中只能写类的路径，不能导入项目代码
+        if isinstance(connection_class, str):
+            connection_class = import_string(connection_class)
+        kwargs["connection_class"] = connection_class
+    kwargs.update(config.get("CONNECTION_KWARGS", {}))
+
+    if config["BLOCKING_TIMEOUT"] is None:
+        return redis.ConnectionPool(**kwargs)
+    return redis.BlockingConnectionPool(timeout=config["BLOCKING_TIMEOUT"], **kwargs)
+
+
+class ForkSafePool(object):
+    """
+    按进程创建连接池
+    WSGI的worker由主进程fork出来，如果继续使用主进程的连接池，多个进程会共用同一个socket
+    这里记录创建连接池的进程号，进程号变化(fork之后)时重新创建
+    其它属性和方法都转发给当前进程的连接池，可以直接用于 redis.Redis(connection_pool=POOL)
+    """
+
+    def __init__(self, factory=create_pool):
+        self._factory = factory
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.rebuilds = 0
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.checkouts = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def get(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # 不能断开继承来的连接，那些socket仍然属于父进程
+                    self._pool = self._factory()
+                    self._pid = os.getpid()
+                    self.rebuilds += 1
+                    self._reset_stats()
+        return self._pool
+
+    def configure(self, factory):
+        """
+        更换连接池的创建方法，下次使用时生效(如压测时使用fakeredis)
+        """
+        with self._lock:
+            self._factory = factory
+            self._pid = None
+
+    def get_connection(self, *args, **kwargs):
+        start = time.time()
+        connection = self.get().get_connection(*args, **kwargs)
+        wait = time.time() - start
+        with self._stats_lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            self.wait_time += wait
+            self.max_wait_time = max(self.max_wait_time, wait)
+        return connection
 
-POOL = redis.ConnectionPool(host='192.168.20.58',port=6379)
+    def release(self, connection):
+        with self._stats_lock:
+            self.in_use = max(0, self.in_use - 1)
+        self.get().release(connection)
 
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
 
+    def stats(self):
+        """
+        当前进程的连接池使用情况，用于评估MAX_CONNECTIONS
+        """
+        pool = self.get()
+        if hasattr(pool, '_in_use_connections'):
+            created = pool._created_connections
+            available = len(pool._available_connections)
+        else:
+            created = len(pool._connections)
+            available = sum(1 for connection in list(pool.pool.queue) if connection is not None)
+        with self._stats_lock:
+            return {
+                "pid": self._pid,
+                "rebuilds": self.rebuilds,
+                "max_connections": pool.max_connections,
+                "created_connections": created,
+                "available_connections": available,
+                "in_use_connections": self.in_use,
+                "peak_in_use_connections": self.peak_in_use,
+                "checkouts": self.checkouts,
+                "avg_wait_ms": self.wait_time / self.checkouts * 1000 if self.checkouts else 0.0,
+                "max_wait_ms": self.max_wait_time * 1000,
+            }
 
 
+POOL = ForkSafePool()
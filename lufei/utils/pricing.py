@@ -0,0 +1,106 @@
+import bisect
+
+# 优惠券类型: 0 通用券  1 满减券  2 折扣券
+# 优惠券使用规则:
+#   每个课程最多使用一张绑定该课程的课程券，每个订单最多使用一张通用券(未绑定课程的券)
+#   课程券先抵扣课程价格，通用券再抵扣课程券抵扣后的合计
+#   满减券的门槛按原价计算: 课程券按课程原价，通用券按订单原价合计
+
+
+def coupon_discount(price, coupon, threshold_price=None):
+    """
+    优惠券在价格price上能抵扣的金额，不会超过price
+    :param coupon: 结算信息中的优惠券，content_type为券类型
+    :param threshold_price: 满减券判断门槛的价格，默认为price
+    """
+    if threshold_price is None:
+        threshold_price = price
+    coupon_type = coupon["content_type"]
+    if coupon_type == 0:
+        discount = coupon["money_equivalent_value"]
+    elif coupon_type == 1:
+        discount = coupon["money_equivalent_value"] if threshold_price >= coupon["minimum_consume"] else 0
+    else:
+        discount = price * (100 - (coupon["off_percent"] or 100)) / 100.0
+    return min(price, discount)
+
+
+class CouponIndex(object):
+    """
+    一组优惠券按类型建立的有序索引，O(log M)找出在某个价格上抵扣最多的券
+        通用券: 只需面额最大的一张
+        满减券: 按门槛升序，记录前缀中面额最大的券，二分查找门槛
+        折扣券: 只需折扣百分比最小的一张
+    """
+
+    def __init__(self, coupons):
+        self.best_cash = None
+        self.best_percent = None
+        full_cut = []
+        for coupon in coupons:
+            coupon_type = coupon["content_type"]
+            if coupon_type == 0:
+                if self.best_cash is None or coupon["money_equivalent_value"] > self.best_cash["money_equivalent_value"]:
+                    self.best_cash = coupon
+            elif coupon_type == 1:
+                full_cut.append(coupon)
+            elif coupon["off_percent"] is not None:
+                if self.best_percent is None or coupon["off_percent"] < self.best_percent["off_percent"]:
+                    self.best_percent = coupon
+
+        full_cut.sort(key=lambda item: item["minimum_consume"])
+        self.thresholds = [coupon["minimum_consume"] for coupon in full_cut]
+        # prefix_best[i]: 门槛最低的 i+1 张满减券中面额最大的一张
+        self.prefix_best = []
+        for coupon in full_cut:
+            if not self.prefix_best or coupon["money_equivalent_value"] > self.prefix_best[-1]["money_equivalent_value"]:
+                self.prefix_best.append(coupon)
+            else:
+                self.prefix_best.append(self.prefix_best[-1])
+
+    def best(self, price, threshold_price=None):
+        """
+        :return: (抵扣金额, 优惠券)，没有可用的券时返回 (0, None)
+        """
+        if threshold_price is None:
+            threshold_price = price
+        candidates = [self.best_cash, self.best_percent]
+        index = bisect.bisect_right(self.thresholds, threshold_price)
+        if index:
+            candidates.append(self.prefix_best[index - 1])
+
+        best_discount, best_coupon = 0, None
+        for coupon in candidates:
+            if coupon is None:
+                continue
+            discount = coupon_discount(price, coupon, threshold_price)
+            if discount > best_discount:
+                best_discount, best_coupon = discount, coupon
+        return best_discount, best_coupon
+
+
+def best_assignment(courses, global_coupons):
+    """
+    计算最优的优惠券组合
+    课程券只能用于绑定的课程，各课程互不影响，每个课程取抵扣最多的课程券；
+    对任意通用券，实付金额随课程券抵扣后的合计单调不减，所以在合计最小时再选最优通用券即为全局最优
+    :param courses: [{"id": 课程ID, "price": 价格, "coupons": [该课程可用的课程券]}]
+    :param global_coupons: [通用券]
+    :return: {"courses": {课程ID: {"coupon": 课程券记录ID, "price": 折后价格}},
+              "global_coupon": 通用券记录ID, "original_price": 原价合计, "total": 实付金额}
+    """
+    result = {"courses": {}, "global_coupon": None}
+    original_price = subtotal = 0
+    for course in courses:
+        discount, coupon = CouponIndex(course["coupons"]).best(course["price"])
+        price = course["price"] - discount
+        result["courses"][course["id"]] = {"coupon": coupon["id"] if coupon else None, "price": round(price, 2)}
+        original_price += course["price"]
+        subtotal += price
+
+    discount, coupon = CouponIndex(global_coupons).best(subtotal, original_price)
+    if coupon:
+        result["global_coupon"] = coupon["id"]
+    result["original_price"] = round(original_price, 2)
+    result["total"] = round(subtotal - discount, 2)
+    return result
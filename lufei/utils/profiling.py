@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+
+from django.conf import settings
+
+import redis.connection
+
+# 请求耗时直方图的桶(毫秒)
+BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+
+DEFAULTS = {
+    "ENABLED": True,
+    # 采样率，0.1 为只统计10%的请求；未采样的请求只多一次随机数判断
+    "SAMPLE_RATE": 1.0,
+    # 是否在响应中加 Server-Timing 头(浏览器开发者工具中可以看到)
+    "SERVER_TIMING": True,
+}
+
+_local = threading.local()
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'PROFILING', {}))
+    return config
+
+
+class Recorder(object):
+    """
+    一个请求中的SQL和redis耗时，由中间件在请求开始时挂到当前线程上
+    """
+    __slots__ = ('sql_count', 'sql_time', 'redis_count', 'redis_time')
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.redis_count = 0
+        self.redis_time = 0.0
+
+
+def start():
+    _local.recorder = Recorder()
+    return _local.recorder
+
+
+def stop():
+    recorder = getattr(_local, 'recorder', None)
+    _local.recorder = None
+    return recorder
+
+
+def current():
+    return getattr(_local, 'recorder', None)
+
+
+# ######################## SQL ########################
+
+def sql_wrapper(execute, sql, params, many, context):
+    """
+    通过 lufei.utils.sql_hooks.execute_wrapper 注册
+    """
+    recorder = current()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    start_time = time.time()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.sql_count += 1
+        recorder.sql_time += time.time() - start_time
+
+
+# ######################## redis ########################
+
+class InstrumentedConnection(redis.connection.Connection):
+    """
+    统计redis命令数和耗时的连接，通过 settings.REDIS["CONNECTION_CLASS"] 用于 POOL
+    命令数按收到的回复计，pipeline中的每个命令各算一次；耗时包括发送和等待回复
+    """
+
+    def send_packed_command(self, command, *args, **kwargs):
+        recorder = current()
+        if recorder is None:
+            return super(InstrumentedConnection, self).send_packed_command(command, *args, **kwargs)
+        start_time = time.time()
+        try:
+            return super(InstrumentedConnection, self).send_packed_command(command, *args, **kwargs)
+        finally:
+            recorder.redis_time += time.time() - start_time
+
+    def read_response(self, *args, **kwargs):
+        recorder = current()
+        if recorder is None:
+            return super(InstrumentedConnection, self).read_response(*args, **kwargs)
+        start_time = time.time()
+        try:
+            return super(InstrumentedConnection, self).read_response(*args, **kwargs)
+        finally:
+            recorder.redis_count += 1
+            recorder.redis_time += time.time() - start_time
+
+
+# ######################## 汇总 ########################
+
+class EndpointStats(object):
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.redis_count = 0
+        self.redis_time = 0.0
+        self.errors = 0
+
+    def add(self, elapsed, recorder, status_code):
+        ms = elapsed * 1000
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        for index, bound in enumerate(BUCKETS):
+            if ms <= bound:
+                self.buckets[index] += 1
+                break
+        self.sql_count += recorder.sql_count
+        self.sql_time += recorder.sql_time * 1000
+        self.redis_count += recorder.redis_count
+        self.redis_time += recorder.redis_time * 1000
+        if status_code >= 500:
+            self.errors += 1
+
+    def percentile(self, percent):
+        """
+        由直方图估算的分位数(所在桶的上界)
+        """
+        rank = self.count * percent / 100.0
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound if bound != float('inf') else self.max
+        return self.max
+
+    def to_dict(self):
+        count = self.count or 1
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": self.total / count,
+            "max_ms": self.max,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "buckets": {("+Inf" if bound == float('inf') else str(bound)): value
+                        for bound, value in zip(BUCKETS, self.buckets)},
+            "sql_queries_per_request": self.sql_count / count,
+            "sql_ms_per_request": self.sql_time / count,
+            "redis_commands_per_request": self.redis_count / count,
+            "redis_ms_per_request": self.redis_time / count,
+        }
+
+
+class Metrics(object):
+    """
+    当前进程中各接口的耗时统计，每个worker进程各自统计
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.started = time.time()
+
+    def record(self, endpoint, elapsed, recorder, status_code):
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.add(elapsed, recorder, status_code)
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+            self.started = time.time()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "pid": os.getpid(),
+                "uptime": time.time() - self.started,
+                "sample_rate": get_config()["SAMPLE_RATE"],
+                "endpoints": {endpoint: stats.to_dict() for endpoint, stats in sorted(self.endpoints.items())},
+            }
+
+    def prometheus(self):
+        """
+        Prometheus 文本格式
+        """
+        lines = []
+        with self.lock:
+            for endpoint, stats in sorted(self.endpoints.items()):
+                label = 'endpoint="%s",pid="%s"' % (endpoint.replace('"', ''), os.getpid())
+                seen = 0
+                for bound, count in zip(BUCKETS, stats.buckets):
+                    seen += count
+                    le = "+Inf" if bound == float('inf') else bound
+                    lines.append('luffy_request_ms_bucket{%s,le="%s"} %s' % (label, le, seen))
+                lines.append('luffy_request_ms_sum{%s} %s' % (label, stats.total))
+                lines.append('luffy_request_ms_count{%s} %s' % (label, stats.count))
+                lines.append('luffy_request_errors_total{%s} %s' % (label, stats.errors))
+                lines.append('luffy_sql_queries_total{%s} %s' % (label, stats.sql_count))
+                lines.append('luffy_sql_ms_total{%s} %s' % (label, stats.sql_time))
+                lines.append('luffy_redis_commands_total{%s} %s' % (label, stats.redis_count))
+                lines.append('luffy_redis_ms_total{%s} %s' % (label, stats.redis_time))
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -0,0 +1,127 @@
+import logging
+import os
+import re
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from lufei.utils import sql_hooks
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # 线上默认关闭，排查问题时打开；测试中打开并设置RAISE
+    "ENABLED": False,
+    # 超出预算时抛出 QueryBudgetExceeded，否则只记录日志
+    "RAISE": False,
+    # 同一形状的SQL在一个请求中执行超过这个次数视为N+1
+    "REPEAT_LIMIT": 3,
+    # 日志中每条SQL保留的调用栈层数
+    "STACK_DEPTH": 6,
+}
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 调用栈中不显示的文件
+SKIP_FILES = {os.path.abspath(__file__), os.path.abspath(sql_hooks.__file__)}
+
+IN_LIST_RE = re.compile(r'\(\s*%s(\s*,\s*%s)+\s*\)')
+NUMBER_RE = re.compile(r'\b\d+\b')
+SPACE_RE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'QUERY_BUDGET', {}))
+    return config
+
+
+def shape(sql):
+    """
+    SQL的形状: 参数已经是%s，再把IN列表和SQL中的数字(LIMIT/OFFSET)归一
+    """
+    sql = IN_LIST_RE.sub('(%s...)', sql)
+    sql = NUMBER_RE.sub('?', sql)
+    return SPACE_RE.sub(' ', sql).strip()
+
+
+def project_stack(depth):
+    """
+    调用栈中属于本项目的帧，不包括本模块和第三方库
+    """
+    frames = []
+    for frame in traceback.extract_stack():
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(PROJECT_ROOT) and 'site-packages' not in filename and filename not in SKIP_FILES:
+            frames.append(frame)
+    return traceback.format_list(frames[-depth:])
+
+
+class QueryLog(object):
+    """
+    记录一段代码中执行的SQL和调用位置，通过 sql_hooks.execute_wrapper 注册
+    """
+
+    def __init__(self, stack_depth=DEFAULTS["STACK_DEPTH"]):
+        self.stack_depth = stack_depth
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, project_stack(self.stack_depth)))
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def repeated(self, limit):
+        """
+        :return: [(形状, 次数, 第一次执行的调用栈)]
+        """
+        counts = Counter(shape(sql) for sql, _ in self.queries)
+        result, seen = [], set()
+        for sql, stack in self.queries:
+            key = shape(sql)
+            if counts[key] > limit and key not in seen:
+                seen.add(key)
+                result.append((key, counts[key], stack))
+        return result
+
+    def problems(self, budget=None, repeat_limit=DEFAULTS["REPEAT_LIMIT"]):
+        problems = []
+        if budget is not None and len(self) > budget:
+            problems.append("执行了 %s 条SQL，预算 %s 条:\n%s" % (
+                len(self), budget, "\n".join("  %s" % sql for sql, _ in self.queries)))
+        for key, count, stack in self.repeated(repeat_limit):
+            problems.append("疑似N+1，同一形状的SQL执行了 %s 次: %s\n%s" % (count, key, "".join(stack)))
+        return problems
+
+
+def budget_for(view_class, method):
+    """
+    视图类的 query_budget 可以是整数，或按请求方法的字典 {"get": 2, "post": 5}
+    :return: (SQL数预算, N+1的重复次数上限)
+    """
+    budget = getattr(view_class, 'query_budget', None)
+    if isinstance(budget, dict):
+        budget = budget.get(method.lower())
+    return budget, getattr(view_class, 'query_repeat_limit', None)
+
+
+@contextmanager
+def assert_queries(budget=None, repeat_limit=None):
+    """
+    测试中检查一段代码的SQL数和N+1:
+        with assert_queries(3):
+            ...
+    """
+    log = QueryLog()
+    with sql_hooks.execute_wrapper(log):
+        yield log
+    problems = log.problems(budget, repeat_limit or get_config()["REPEAT_LIMIT"])
+    if problems:
+        raise QueryBudgetExceeded("\n".join(problems))
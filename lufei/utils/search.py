@@ -0,0 +1,336 @@
+import math
+import re
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+
+import redis
+from lufei import models
+from lufei.utils.pool import POOL
+
+try:
+    import jieba
+except ImportError:
+    jieba = None
+
+CONN = redis.Redis(connection_pool=POOL)
+
+COURSE = "course"
+ARTICLE = "article"
+
+# BM25参数
+K1 = 1.2
+B = 0.75
+
+# 字段权重，标题中的词按出现多次计算
+TITLE_WEIGHT = 3
+
+# 前缀最多展开的词数
+PREFIX_EXPANSIONS = 20
+
+TOKEN_RE = re.compile(r'[a-z0-9]+|[\u4e00-\u9fff]+')
+CJK_RE = re.compile(r'[\u4e00-\u9fff]')
+
+
+def cjk_tokens(text):
+    """
+    中文分词: 安装了jieba时用jieba的搜索引擎模式，否则切成二元组(单字的词保留单字)
+    """
+    if jieba is not None:
+        return [token for token in jieba.cut_for_search(text) if token.strip()]
+    if len(text) == 1:
+        return [text]
+    return [text[i:i + 2] for i in range(len(text) - 1)]
+
+
+def tokenize(text):
+    tokens = []
+    for token in TOKEN_RE.findall((text or '').lower()):
+        if CJK_RE.match(token):
+            tokens.extend(cjk_tokens(token))
+        else:
+            tokens.append(token)
+    return tokens
+
+
+def analyze(title, *texts):
+    """
+    :return: (词频, 文档长度)
+    """
+    terms = Counter()
+    for token in tokenize(title):
+        terms[token] += TITLE_WEIGHT
+    for text in texts:
+        terms.update(tokenize(text))
+    return terms, sum(terms.values())
+
+
+# 更新一个文档: 删除旧的倒排记录，写入新的，维护文档数和总长度
+# 用到的倒排key都通过KEYS传入，文档当前的词有不在其中的(读取旧词之后被并发修改)时不做修改，返回0
+# KEYS: 文档的词频hash, 文档长度hash, 统计hash, 词典zset, 每个词的倒排key...
+# ARGV: 文档, 长度, 词, 词频, 词, 词频...  词频为0的是只在旧文档中出现的词，与倒排key一一对应
+INDEX_LUA = """
+local postings = {}
+for i = 3, #ARGV, 2 do
+    postings[ARGV[i]] = KEYS[(i - 1) / 2 + 4]
+end
+local old = redis.call('HKEYS', KEYS[1])
+for i = 1, #old do
+    if not postings[old[i]] then
+        return 0
+    end
+end
+for i = 1, #old do
+    redis.call('HDEL', postings[old[i]], ARGV[1])
+    if redis.call('HLEN', postings[old[i]]) == 0 then
+        redis.call('ZREM', KEYS[4], old[i])
+    end
+end
+redis.call('DEL', KEYS[1])
+local old_length = redis.call('HGET', KEYS[2], ARGV[1])
+if old_length then
+    redis.call('HINCRBY', KEYS[3], 'docs', -1)
+    redis.call('HINCRBY', KEYS[3], 'length', -tonumber(old_length))
+    redis.call('HDEL', KEYS[2], ARGV[1])
+end
+if tonumber(ARGV[2]) > 0 then
+    for i = 3, #ARGV, 2 do
+        if tonumber(ARGV[i + 1]) > 0 then
+            redis.call('HSET', postings[ARGV[i]], ARGV[1], ARGV[i + 1])
+            redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+            redis.call('ZADD', KEYS[4], 0, ARGV[i])
+        end
+    end
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+    redis.call('HINCRBY', KEYS[3], 'docs', 1)
+    redis.call('HINCRBY', KEYS[3], 'length', ARGV[2])
+end
+return 1
+"""
+
+index_script = CONN.register_script(INDEX_LUA)
+
+
+def course_documents(course_ids=None):
+    """
+    课程名、课程概述、我将学到哪些内容、为什么学习这门课程，只索引上线的课程
+    :return: [(文档, 标题, 正文...)]
+    """
+    queryset = models.Course.objects.filter(status=0)
+    if course_ids is not None:
+        queryset = queryset.filter(id__in=course_ids)
+    rows = queryset.values_list('id', 'name', 'brief', 'coursedetail__what_to_study_brief', 'coursedetail__why_study')
+    return [("%s:%s" % (COURSE, row[0]),) + tuple(row[1:]) for row in rows.iterator()]
+
+
+def article_documents(article_ids=None):
+    """
+    文章标题、摘要、正文，只索引在线的文章
+    """
+    queryset = models.Article.objects.filter(status=0)
+    if article_ids is not None:
+        queryset = queryset.filter(id__in=article_ids)
+    rows = queryset.values_list('id', 'title', 'brief', 'content')
+    return [("%s:%s" % (ARTICLE, row[0]),) + tuple(row[1:]) for row in rows.iterator()]
+
+
+class SearchIndex(object):
+    """
+    课程和文章的倒排索引，文档为 "course:<id>" / "article:<id>"
+        luffy_search:term:<词>  hash: 文档 -> 词频
+        luffy_search:doc:<文档>  hash: 词 -> 词频，更新和删除文档时用于清除旧的倒排记录
+        luffy_search:length      hash: 文档 -> 文档长度
+        luffy_search:stats       hash: docs 文档数, length 总长度
+        luffy_search:terms       zset: 所有词，分数都为0，用ZRANGEBYLEX做前缀匹配
+    增量更新的lua脚本用到的key都在KEYS中声明；key没有hash tag，Redis Cluster下仍需要单实例部署
+    查询按BM25排序，最后一个词按前缀匹配
+    """
+
+    def __init__(self, conn=None, prefix=None):
+        self.conn = conn or CONN
+        self.prefix = prefix or settings.LUFFY_SEARCH
+        self.term_prefix = "%s:term:" % self.prefix
+        self.length = "%s:length" % self.prefix
+        self.stats = "%s:stats" % self.prefix
+        self.terms = "%s:terms" % self.prefix
+
+    def doc_key(self, doc):
+        return "%s:doc:%s" % (self.prefix, doc)
+
+    def index(self, doc, title, *texts):
+        """
+        增量更新一个文档，标题为None时删除文档
+        """
+        terms, length = analyze(title, *texts) if title is not None else (Counter(), 0)
+        while True:
+            # 先读出旧的词，连同新的词一起把倒排key传给脚本；期间文档被并发修改时脚本返回0，重新读取
+            all_terms = dict(terms)
+            for term in self.conn.hkeys(self.doc_key(doc)):
+                all_terms.setdefault(term.decode('utf-8'), 0)
+            keys = [self.doc_key(doc), self.length, self.stats, self.terms]
+            args = [doc, length]
+            for term, tf in all_terms.items():
+                keys.append(self.term_prefix + term)
+                args.extend([term, tf])
+            if index_script(keys=keys, args=args, client=self.conn):
+                return
+
+    def remove(self, doc):
+        self.index(doc, None)
+
+    def clear(self):
+        keys = []
+        for key in self.conn.scan_iter(match="%s:*" % self.prefix, count=1000):
+            keys.append(key)
+            if len(keys) >= 1000:
+                self.conn.delete(*keys)
+                keys = []
+        if keys:
+            self.conn.delete(*keys)
+
+    def bulk_index(self, documents, batch_size=500):
+        """
+        全量建索引，只能写入空的索引(先clear)，在内存中合并倒排记录后批量写入
+        :param documents: [(文档, 标题, 正文...)]
+        :return: 文档数
+        """
+        postings, lengths, terms, total = {}, {}, set(), 0
+        pipe = self.conn.pipeline(transaction=False)
+        for count, (doc, title, *texts) in enumerate(documents, 1):
+            doc_terms, length = analyze(title, *texts)
+            if not length:
+                continue
+            for term, tf in doc_terms.items():
+                postings.setdefault(term, {})[doc] = tf
+            terms.update(doc_terms)
+            lengths[doc] = length
+            total += length
+            pipe.hmset(self.doc_key(doc), dict(doc_terms))
+            if count % batch_size == 0:
+                pipe.execute()
+
+        for term, docs in postings.items():
+            pipe.hmset(self.term_prefix + term, docs)
+            if len(pipe) >= batch_size:
+                pipe.execute()
+        term_list = list(terms)
+        for start in range(0, len(term_list), batch_size):
+            pipe.zadd(self.terms, {term: 0 for term in term_list[start:start + batch_size]})
+        if lengths:
+            pipe.hmset(self.length, lengths)
+        pipe.hmset(self.stats, {"docs": len(lengths), "length": total})
+        pipe.execute()
+        return len(lengths)
+
+    def expand(self, prefix):
+        prefix = prefix.encode('utf-8')
+        return [term.decode('utf-8') for term in self.conn.zrangebylex(
+            self.terms, b"[" + prefix, b"[" + prefix + b"\xff", start=0, num=PREFIX_EXPANSIONS)]
+
+    def search(self, query, doc_type=None, size=20, prefix=True):
+        """
+        :param doc_type: course/article，None为全部
+        :param prefix: 最后一个词是否按前缀匹配(输入过程中的联想搜索)
+        :return: [(文档类型, ID, 分数)]，按分数倒序
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        terms = tokens
+        if prefix and not query[-1:].isspace():
+            # 最后一个词还没输入完，展开为以它开头的词
+            terms = tokens[:-1] + (self.expand(tokens[-1]) or tokens[-1:])
+
+        pipe = self.conn.pipeline(transaction=False)
+        pipe.hmget(self.stats, ["docs", "length"])
+        for term in terms:
+            pipe.hgetall(self.term_prefix + term)
+        stats, *postings = pipe.execute()
+        docs, total = int(stats[0] or 0), int(stats[1] or 0)
+        if not docs:
+            return []
+        avgdl = total / docs
+
+        doc_prefix = ("%s:" % doc_type).encode('utf-8') if doc_type else b''
+        candidates = {}
+        for term_postings in postings:
+            if not term_postings:
+                continue
+            idf = math.log(1 + (docs - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+            for doc, tf in term_postings.items():
+                if doc.startswith(doc_prefix):
+                    candidates.setdefault(doc, []).append((idf, int(tf)))
+        if not candidates:
+            return []
+
+        doc_list = list(candidates)
+        lengths = self.conn.hmget(self.length, doc_list)
+        scores = []
+        for doc, length in zip(doc_list, lengths):
+            norm = K1 * (1 - B + B * int(length or avgdl) / avgdl)
+            score = sum(idf * tf * (K1 + 1) / (tf + norm) for idf, tf in candidates[doc])
+            scores.append((score, doc))
+        scores.sort(reverse=True)
+
+        result = []
+        for score, doc in scores[:size]:
+            doc_type_, doc_id = doc.decode('utf-8').split(':')
+            result.append((doc_type_, int(doc_id), score))
+        return result
+
+
+search_index = SearchIndex()
+
+
+def index_courses(course_ids):
+    """
+    更新课程的索引，下线或删除的课程从索引中移除
+    """
+    documents = {doc[0]: doc for doc in course_documents(course_ids)}
+    for course_id in course_ids:
+        doc = "%s:%s" % (COURSE, course_id)
+        if doc in documents:
+            search_index.index(*documents[doc])
+        else:
+            search_index.remove(doc)
+
+
+def index_articles(article_ids):
+    documents = {doc[0]: doc for doc in article_documents(article_ids)}
+    for article_id in article_ids:
+        doc = "%s:%s" % (ARTICLE, article_id)
+        if doc in documents:
+            search_index.index(*documents[doc])
+        else:
+            search_index.remove(doc)
+
+
+# 当前线程(数据库连接)中等待索引的 文档类型 -> ID集合
+_pending = threading.local()
+
+
+def index_on_commit(doc_type, ids):
+    """
+    在当前事务提交后更新索引，不在事务中时立即更新
+    同一个事务中多次修改的文档只索引一次: 每次修改都注册回调，第一个回调索引全部，其余的什么都不做
+    回滚的修改留在集合中，下次提交时按数据库中的数据重新索引一遍，结果不变
+    """
+    pending = getattr(_pending, 'docs', None)
+    if pending is None:
+        pending = _pending.docs = {COURSE: set(), ARTICLE: set()}
+    pending[doc_type].update(ids)
+    transaction.on_commit(flush_pending)
+
+
+def flush_pending():
+    pending = getattr(_pending, 'docs', None)
+    if not pending:
+        return
+    course_ids, article_ids = pending[COURSE], pending[ARTICLE]
+    _pending.docs = None
+    if course_ids:
+        index_courses(course_ids)
+    if article_ids:
+        index_articles(article_ids)
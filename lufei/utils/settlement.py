@@ -0,0 +1,118 @@
+import datetime
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+from django.utils import timezone
+
+from lufei import models
+from lufei.serializer import CouponSerializer
+
+COUPON_FIELDS = (
+    'id',
+    'get_time',
+    'coupon_id',
+    'coupon__name',
+    'coupon__coupon_type',
+    'coupon__money_equivalent_value',
+    'coupon__off_percent',
+    'coupon__minimum_consume',
+    'coupon__object_id',
+    'coupon__valid_begin_date',
+    'coupon__valid_end_date',
+    'coupon__coupon_valid_days',
+)
+
+
+def coupon_queryset(account_id, course_ids, today):
+    """
+    用户可用于这些课程的未使用优惠券: 一次 CouponRecord join Coupon 的查询
+    通用券(未绑定课程) + 绑定了这些课程的课程券，过滤掉不在有效期内的
+    自领取时开始计算有效期的券(coupon_valid_days)只能按领取时间计算，在python中过滤
+    """
+    course_content_type = ContentType.objects.get_for_model(models.Course)
+    return models.CouponRecord.objects.filter(
+        account_id=account_id,
+        status=0,
+    ).filter(
+        Q(coupon__object_id__isnull=True) |
+        Q(coupon__content_type=course_content_type, coupon__object_id__in=course_ids)
+    ).filter(
+        Q(coupon__valid_begin_date__lte=today, coupon__valid_end_date__gte=today) |
+        Q(coupon__valid_end_date__isnull=True, coupon__coupon_valid_days__isnull=False)
+    ).values_list(*COUPON_FIELDS)
+
+
+def get_account_coupons(account_id, course_ids, today=None):
+    """
+    获取用户的可用优惠券
+    :return: (通用券列表, {course_id: 课程券列表})
+    """
+    today = today or timezone.now().date()
+    global_coupons = []
+    course_coupons = {int(course_id): [] for course_id in course_ids}
+
+    for row in coupon_queryset(account_id, list(course_coupons), today):
+        item = dict(zip(COUPON_FIELDS, row))
+        valid_begin_date = item['coupon__valid_begin_date']
+        valid_end_date = item['coupon__valid_end_date']
+        if valid_end_date is None:
+            valid_begin_date = timezone.localtime(item['get_time']).date()
+            valid_end_date = valid_begin_date + datetime.timedelta(days=item['coupon__coupon_valid_days'])
+            if valid_end_date < today:
+                continue
+
+        coupon = {
+            "id": item['id'],
+            "coupon_id": item['coupon_id'],
+            "name": item['coupon__name'],
+            "coupon_type": item['coupon__coupon_type'],
+            "money_equivalent_value": item['coupon__money_equivalent_value'],
+            "off_percent": item['coupon__off_percent'],
+            "minimum_consume": item['coupon__minimum_consume'],
+            "valid_begin_date": valid_begin_date,
+            "valid_end_date": valid_end_date,
+        }
+        if item['coupon__object_id'] is None:
+            global_coupons.append(coupon)
+        else:
+            course_coupons[item['coupon__object_id']].append(coupon)
+
+    return global_coupons, course_coupons
+
+
+def serialize_coupons(coupons):
+    """
+    [{优惠券记录ID: 优惠券信息}, ...]
+    """
+    data = CouponSerializer(coupons, many=True).data
+    return [{item["id"]: item} for item in data]
+
+
+def build_course_settlement(course_id, cart_course, price_policy_id, coupons):
+    """
+    单个课程的结算信息
+    :param cart_course: 购物车中的课程
+    :param coupons: 该课程可用的课程券
+    """
+    price_policy = {}
+    for item in cart_course["price_policy_list"]:
+        if item["id"] == price_policy_id:
+            price_policy = item
+            break
+
+    return {
+        str(course_id): {
+            "course_title": cart_course["title"],
+            "course_img": cart_course["img"],
+            "default_price_policy_id": price_policy_id,
+            "valid_period": price_policy.get("valid_period"),
+            "price": price_policy.get("price"),
+            "course_coupon_list": serialize_coupons(coupons),
+        }
+    }
+
+
+def build_my_coupon(global_coupons):
+    return {
+        "my_coupon_list": serialize_coupons(global_coupons),
+    }
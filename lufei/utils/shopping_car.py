@@ -0,0 +1,105 @@
+import json
+
+from django.conf import settings
+
+import redis
+from lufei.utils.pool import POOL
+
+CONN = redis.Redis(connection_pool=POOL)
+
+# 修改默认价格策略: 在redis中完成 读取课程->校验价格策略->写回，一次往返且原子执行
+# 返回 1: 修改成功  0: 价格策略不存在  -1: 购物车中无此课程
+SET_DEFAULT_PRICE_POLICY_LUA = """
+local course = redis.call('HGET', KEYS[1], ARGV[1])
+if not course then
+    return -1
+end
+local data = cjson.decode(course)
+local price_policy_id = tonumber(ARGV[2])
+for _, policy in ipairs(data['price_policy_list']) do
+    if policy['id'] == price_policy_id then
+        data['default_price_policy'] = price_policy_id
+        redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(data))
+        return 1
+    end
+end
+return 0
+"""
+
+# register_script 使用EVALSHA执行，脚本未加载时自动SCRIPT LOAD
+set_default_price_policy_script = CONN.register_script(SET_DEFAULT_PRICE_POLICY_LUA)
+
+
+def load_scripts(conn=None):
+    """
+    预加载购物车脚本，避免第一次请求时的NOSCRIPT重试
+    """
+    conn = conn or CONN
+    conn.script_load(SET_DEFAULT_PRICE_POLICY_LUA)
+
+
+class ShoppingCar(object):
+    """
+    用户购物车
+    每个用户一个redis hash，field为课程ID，value为该课程的json：
+        luffy_shopping_car:<user_id> -> {course_id: course_dict}
+    添加/删除/修改价格策略只读写一个field，查看购物车只需一次HGETALL
+    """
+
+    def __init__(self, user_id, conn=None):
+        self.conn = conn or CONN
+        self.key = self.key_for(user_id)
+
+    @staticmethod
+    def key_for(user_id):
+        return "%s:%s" % (settings.LUFFY_SHOPPING_CAR, user_id)
+
+    def all(self):
+        """
+        获取购物车中的所有课程
+        :return: {course_id(str): course_dict}
+        """
+        data = self.conn.hgetall(self.key)
+        return {k.decode('utf-8'): json.loads(v.decode('utf-8')) for k, v in data.items()}
+
+    def get(self, course_id):
+        """
+        获取购物车中的某个课程，不存在返回None
+        """
+        course = self.conn.hget(self.key, course_id)
+        if not course:
+            return None
+        return json.loads(course.decode('utf-8'))
+
+    def get_many(self, course_ids):
+        """
+        一次HMGET获取购物车中的多个课程
+        :return: {course_id(str): course_dict}，购物车中没有的课程不返回
+        """
+        course_ids = [str(course_id) for course_id in course_ids]
+        if not course_ids:
+            return {}
+        courses = self.conn.hmget(self.key, course_ids)
+        return {
+            course_id: json.loads(course.decode('utf-8'))
+            for course_id, course in zip(course_ids, courses) if course
+        }
+
+    def add(self, course_dict):
+        """
+        添加课程，课程已存在则覆盖
+        """
+        self.conn.hset(self.key, course_dict["id"], json.dumps(course_dict))
+
+    def delete(self, course_id):
+        """
+        删除课程，返回购物车中是否存在该课程
+        """
+        return bool(self.conn.hdel(self.key, course_id))
+
+    def set_default_price_policy(self, course_id, price_policy_id):
+        """
+        修改课程的默认价格策略
+        :return: 1 修改成功, 0 价格策略不存在, -1 购物车中无此课程
+        """
+        return set_default_price_policy_script(keys=[self.key], args=[course_id, price_policy_id], client=self.conn)
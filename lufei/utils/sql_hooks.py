@@ -0,0 +1,61 @@
+import functools
+import threading
+from contextlib import ExitStack, contextmanager
+
+from django.db import connection, connections
+
+_local = threading.local()
+
+
+def install_fallback():
+    """
+    Django<2.0 没有 connection.execute_wrapper，给 CursorWrapper 的 execute/executemany 套一层，
+    按 execute_wrapper 的协议调用当前线程注册的回调，没有回调时只多一次属性读取
+    """
+    from django.db.backends import utils
+
+    if getattr(utils.CursorWrapper, '_sql_hooks_installed', False):
+        return
+
+    def wrap(method, many):
+        def wrapper(self, sql, params=None):
+            wrappers = getattr(_local, 'wrappers', None)
+            if not wrappers:
+                return method(self, sql, params)
+
+            def execute(sql, params, many, context):
+                return method(self, sql, params)
+
+            # 与Django相同，后注册的在外层
+            for callback in wrappers:
+                execute = functools.partial(callback, execute)
+            return execute(sql, params, many, {'connection': self.db, 'cursor': self})
+        return wrapper
+
+    utils.CursorWrapper.execute = wrap(utils.CursorWrapper.execute, False)
+    utils.CursorWrapper.executemany = wrap(utils.CursorWrapper.executemany, True)
+    utils.CursorWrapper._sql_hooks_installed = True
+
+
+@contextmanager
+def execute_wrapper(wrapper):
+    """
+    在当前线程的所有数据库连接上注册 wrapper(execute, sql, params, many, context)
+    Django>=2.0 时直接使用 connection.execute_wrapper
+    """
+    if hasattr(connection, 'execute_wrapper'):
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(wrapper))
+            yield
+        return
+
+    install_fallback()
+    wrappers = getattr(_local, 'wrappers', None)
+    if wrappers is None:
+        wrappers = _local.wrappers = []
+    wrappers.append(wrapper)
+    try:
+        yield
+    finally:
+        wrappers.pop()
@@ -1,19 +1,35 @@
 import json
 
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
-from django.http import JsonResponse
+from django.db.models import Prefetch
+from django.http import HttpResponse,JsonResponse,Http404
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
 from . import models
-from .serializer import AuthSerializer
+from .serializer import AuthSerializer,CourseListSerializer,CourseDetailSerializer
 from.models import Account,UserAuthToken
 from lufei.utils.auth.api_view import AuthApiView
-from lufei.utils.exceptions import PricePolicyDoesNotExist,KeyDoesNotExist
+from lufei.utils.exceptions import PricePolicyDoesNotExist,KeyDoesNotExist,PaymentError
 from lufei.utils.pool import POOL
+from lufei.utils.profiling import metrics
+from lufei.utils.shopping_car import ShoppingCar
+from lufei.utils.catalog import catalog
+from lufei.utils.feed import POSITIONS,article_feed
+from lufei.utils.comment_tree import comment_queryset,comment_subtree
+from lufei.utils.counters import ARTICLE_COUNTER_FIELDS,USER_COUNTER_INTERVALS,article_counter
+from lufei.utils.coupon_stock import coupon_stock,CLAIMED,SOLD_OUT,ALREADY_CLAIMED
+from lufei.utils.dashboard import dashboard
+from lufei.utils.course_version import CourseVersion,course_version
+from lufei.utils.outline import outline_tree
+from lufei.utils.payment import create_order
+from lufei.utils.search import COURSE,ARTICLE,search_index
+from lufei.utils.settlement import get_account_coupons,build_course_settlement,build_my_coupon
 from .utils.auth.token_auth import LuffyTokenAuthentication
+from .utils.auth.token_cache import token_cache
 
 import redis
 CONN = redis.Redis(connection_pool=POOL)
@@ -21,6 +37,8 @@ CONN = redis.Redis(connection_pool=POOL)
 
 
 class AuthView(APIView):
+    query_budget = {"post":6}
+
     def post(self,request,*args,**kwargs):
         response = {"code":1000,"errors":None}
         ser = AuthSerializer(data=request.data)
@@ -30,6 +48,8 @@ class AuthView(APIView):
                 user = Account.objects.get(**ser.validated_data)
                 #get_or_create方法会根据其参数，从数据库中查询符合条件的记录，如果没有符合条件的记录，则会依据参数创建一条新纪录。
                 token_obj,is_create = UserAuthToken.objects.get_or_create(user=user)
+                # 登录后的第一次请求也不需要查库
+                token_cache.set(token_obj)
                 response['token'] = token_obj.token
                 response['name'] = user.username
                 response['code'] = 1002
@@ -44,6 +64,7 @@ class AuthView(APIView):
 
 
 class ShoppingCarView(APIView):
+    query_budget = {"get":1,"post":4,"put":1,"delete":1}
 
     authentication_classes = [LuffyTokenAuthentication,]
     def get(self,request,*args,**kwargs):
@@ -56,9 +77,8 @@ class ShoppingCarView(APIView):
         """
         response = {"code":1000,"data":None}
         try:
-            course = CONN.hget(settings.LUFFY_SHOPPING_CAR,request.user.id)
-            if course:
-                course_dict = json.loads(course.decode('utf-8'))
+            course_dict = ShoppingCar(request.user.id).all()
+            if course_dict:
                 response["data"] = course_dict
         except Exception as e:
             response["code"] = 1001
@@ -76,22 +96,22 @@ class ShoppingCarView(APIView):
         """
         ret = {"code":1000,"msg":None}
         try:
-            course_id = request.data.get('course_id')
+            try:
+                course_id = int(request.data.get('course_id'))
+            except (TypeError,ValueError):
+                raise models.Course.DoesNotExist()
             price_policy_id = request.data.get('price_policy_id')
 
-            # 获取课程
-            course_obj = models.Course.objects.get(id=course_id)
+            # 获取课程及当前课程的所有价格策略： id  有效期 价格 (走缓存，不查数据库)
+            course = catalog.get(course_id)
+            price_policy_list = course["price_policy_list"]
 
-            # 获取当前课程的所有价格策略： id  有效期 价格
-            price_policy_list = []
+            # 用户传递过来的价格策略id在数据库中存在
             flag = False
-            # price_policy是 model表中的一个反向查询的字段(数据库不存在)
-            price_policy_objs = course_obj.price_policy.all()
-            for item in price_policy_objs:
-                # 用户传递过来的价格策略id在数据库中存在
-                if item.id == price_policy_id:
+            for item in price_policy_list:
+                if item["id"] == price_policy_id:
                     flag = True
-                price_policy_list.append({"id":item.id,'valid_period':item.get_valid_period_display(),'price':item.price})
+                    break
 
             if not flag:
                 raise PricePolicyDoesNotExist()
@@ -100,26 +120,15 @@ class ShoppingCarView(APIView):
             # 课程id,课程图片地址，课程标题，课程价格策略，默认价格策略
 
             course_dict = {
-                "id": course_obj.id,
-                "img": course_obj.course_img,
-                "title":course_obj.name,
+                "id": course["id"],
+                "img": course["course_img"],
+                "title":course["name"],
                 "price_policy_list":price_policy_list,
                 "default_price_policy":price_policy_id
             }
 
-            # a 获取当前用户购物车中的课程
-            # b car["course_obj.id"] = course_dict
-            # c conn.hset("luffy_shopping_car",request.user.id,car)
-            nothing = CONN.hget(settings.LUFFY_SHOPPING_CAR,request.user.id)
-            if not nothing:
-                data = {course_obj.id:course_dict}
-            else:
-                data = json.loads(nothing.decode('utf-8'))
-                # 更新
-                data[course_obj.id] = course_dict
-
-            CONN.hset(settings.LUFFY_SHOPPING_CAR,request.user.id,json.dumps(data))
-            # CONN.hset(settings.LUFFY_SHOPPING_CAR,request.user.id,json.dumps(course_dict))
+            # 购物车中每个课程单独一个field，只写当前课程
+            ShoppingCar(request.user.id).add(course_dict)
         except ObjectDoesNotExist as e:
             ret["code"] = 1001
             ret["msg"] = "课程不存在"
@@ -145,14 +154,8 @@ class ShoppingCarView(APIView):
         response = {"code":1000}
         try:
             course_id = str(request.data.get("course_id"))
-            course_dict = CONN.hget(settings.LUFFY_SHOPPING_CAR,request.user.id)
-            if not course_dict:
-                raise Exception("购物车中不存在课程")
-            course_dict = json.loads(course_dict.decode("utf-8"))
-            if course_id not in course_dict:
+            if not ShoppingCar(request.user.id).delete(course_id):
                 raise Exception("购物车中无此课程")
-            del course_dict[course_id]
-            CONN.hset(settings.LUFFY_SHOPPING_CAR,request.user.id,json.dumps(course_dict))
             response["msg"] = "删除课程成功"
         except Exception as e:
             response["code"] = 1001
@@ -171,24 +174,16 @@ class ShoppingCarView(APIView):
         response = {"code":1000}
         try:
             course_id = str(request.data.get("course_id"))
-            price_policy_id = request.data.get("price_policy_id")
-            course_dict = CONN.hget(settings.LUFFY_SHOPPING_CAR,request.user.id)
-            if not course_dict:
-                raise Exception("购物车清单不存在")
-            course_dict = json.loads(course_dict.decode("utf-8"))
-            if course_id not in course_dict:
+            try:
+                price_policy_id = int(request.data.get("price_policy_id"))
+            except (TypeError,ValueError):
+                raise PricePolicyDoesNotExist()
+            # 校验和修改都在redis脚本中完成
+            result = ShoppingCar(request.user.id).set_default_price_policy(course_id,price_policy_id)
+            if result == -1:
                 raise Exception("购物车清单中的商品不存在")
-
-            policy_exist = False
-            for policy in course_dict[course_id]["price_policy_list"]:
-                if policy['id'] == price_policy_id:
-                    policy_exist = True
-                    break
-            if not policy_exist:
+            if result == 0:
                 raise PricePolicyDoesNotExist()
-
-            course_dict[course_id]["default_price_policy"] = price_policy_id
-            CONN.hset(settings.LUFFY_SHOPPING_CAR,request.user.id,json.dumps(course_dict))
             response["msg"] = "价格策略修改成功"
 
         except PricePolicyDoesNotExist as e:
@@ -202,6 +197,7 @@ class ShoppingCarView(APIView):
 
 
 class AccountView(AuthApiView,APIView):
+    query_budget = {"get":1,"post":5}
 
 
     def post(self,request,*args,**kwargs):
@@ -218,77 +214,31 @@ class AccountView(AuthApiView,APIView):
             course_id = str(request.data.get('course_id'))
             de_price_policy_id = request.data.get('de_price_policy_id')
 
-            # 根据课程ID获取课程对象
-            course_obj = models.Course.objects.get(id=course_id)
+            # 根据课程ID获取课程(走缓存)
+            course = catalog.get(course_id)
 
             # 从redis中获取价格策略，判断用户传递过来的价格策略是否在本课程价格策略中
 
-            course_dict = json.loads(CONN.hget(settings.LUFFY_SHOPPING_CAR,request.user.id).decode("utf-8"))
+            course_dict = ShoppingCar(request.user.id).get(course_id)
+            if not course_dict:
+                raise KeyDoesNotExist()
 
-            price_policy_id_list = course_dict[course_id]["price_policy_list"]
+            price_policy_id_list = course_dict["price_policy_list"]
             price_policy_list = []
             for price_policy_id in price_policy_id_list:
                 price_policy_list.append(price_policy_id["id"])
             if de_price_policy_id not in price_policy_list:
                 raise KeyDoesNotExist()
 
-            global_coupons = []
-            course_coupons = []
-            coupon_set = request.user.couponrecord_set.filter(status=0)
-            for item in coupon_set:
-                if not item.coupon.object_id:
-                    global_coupons.append(item.coupon)
-                else:
-                    course_coupons.append(item.coupon)
-            tmp = {}
-            temp = {}
-
-            global_coup = []
-            course_coup = []
-
-
-            for global_coupon in global_coupons:
-                tmp[global_coupon.id] = temp
-                temp["name"] = global_coupon.name
-                temp["content_type"] = global_coupon.coupon_type
-                temp["money_equivalent_value"] = global_coupon.money_equivalent_value
-                temp["off_percent"] = global_coupon.off_percent
-                temp["minimum_consume"] = global_coupon.minimum_consume
-                temp["valid_begin_date"] = global_coupon.valid_begin_date.strftime('%Y-%m-%d')
-                temp["valid_end_date"] = global_coupon.valid_end_date.strftime('%Y-%m-%d')
-
-                global_coup.append(tmp)
-
-            course_cpon = {}
-            course_coupon_dict = {}
-            for course_coupon in course_coupons:
-                course_cpon[course_coupon.id] = course_coupon_dict
-                course_coupon_dict["name"] = course_coupon.name
-                course_coupon_dict["content_type"] = course_coupon.coupon_type
-                course_coupon_dict["money_equivalent_value"] = course_coupon.money_equivalent_value
-                course_coupon_dict["off_percent"] = course_coupon.off_percent
-                course_coupon_dict["minimum_consume"] = course_coupon.minimum_consume
-                course_coupon_dict["valid_begin_date"] = course_coupon.valid_begin_date.strftime('%Y-%m-%d')
-                course_coupon_dict["valid_end_date"] = course_coupon.valid_end_date.strftime('%Y-%m-%d')
-
-                course_coup.append(course_cpon)
-
-            ret["data"] = []
-            course_dict = {
-                course_id: {
-                    "course_title": course_obj.name,
-                    "course_img": course_obj.course_img,
-                    "default_price_policy_id": de_price_policy_id,
-                    "course_coupon_list": course_coup,
-                }
-            }
-
-            my_coupon = {
-                "my_coupon_list": global_coup,
-            }
-            ret["data"].append(course_dict)
-            ret["data"].append(my_coupon)
+            # 通用券和本课程的课程券，一次查询
+            global_coupons,course_coupons = get_account_coupons(request.user.id,[course["id"]])
 
+            course_dict["title"] = course["name"]
+            course_dict["img"] = course["course_img"]
+            ret["data"] = [
+                build_course_settlement(course_id,course_dict,de_price_policy_id,course_coupons[course["id"]]),
+                build_my_coupon(global_coupons),
+            ]
 
             CONN.hset(settings.ACCOUNT_COUPON,request.user.id,json.dumps(ret["data"]))
 
@@ -308,18 +258,459 @@ class AccountView(AuthApiView,APIView):
         reponse = json.loads(reponse.decode('utf-8'))
         return Response(reponse)
 
-class PayView(APIView):
+def parse_batch_courses(courses):
+    """
+    校验 [{"course_id":1,"price_policy_id":2},...]
+    :return: {课程ID字符串: 价格策略ID}
+    """
+    if not isinstance(courses,list):
+        raise KeyDoesNotExist("courses必须是列表")
+    if not courses:
+        raise KeyDoesNotExist("没有选择要结算的课程")
+    price_policy_ids = {}
+    for item in courses:
+        try:
+            price_policy_ids[str(int(item["course_id"]))] = int(item["price_policy_id"])
+        except (TypeError,ValueError,KeyError):
+            raise KeyDoesNotExist("参数格式错误: %s" % (item,))
+    return price_policy_ids
+
+
+class BatchAccountView(AuthApiView,APIView):
+    query_budget = {"post":4}
+
+    def post(self,request,*args,**kwargs):
+        """
+        一次结算多个课程
+        courses: [{"course_id":1,"price_policy_id":2},...]，不传则结算整个购物车(使用各课程的默认价格策略)
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        ret = {"code":1000}
+        try:
+            courses = request.data.get('courses')
+            shopping_car = ShoppingCar(request.user.id)
+
+            # 一次从redis中读取要结算的课程，只有不传courses时才结算整个购物车
+            if courses is not None:
+                price_policy_ids = parse_batch_courses(courses)
+                car = shopping_car.get_many(price_policy_ids.keys())
+            else:
+                car = shopping_car.all()
+                price_policy_ids = {course_id:course["default_price_policy"] for course_id,course in car.items()}
+            if not price_policy_ids:
+                raise KeyDoesNotExist("购物车中没有课程")
+
+            for course_id,price_policy_id in price_policy_ids.items():
+                if course_id not in car:
+                    raise KeyDoesNotExist("购物车中无此课程: %s" % course_id)
+                if price_policy_id not in [item["id"] for item in car[course_id]["price_policy_list"]]:
+                    raise KeyDoesNotExist("价格策略不存在: %s" % course_id)
+
+            # 一次查询所有课程
+            course_objs = models.Course.objects.only('id','name','course_img').in_bulk(list(price_policy_ids))
+            for course_id in price_policy_ids:
+                if int(course_id) not in course_objs:
+                    raise models.Course.DoesNotExist("课程不存在: %s" % course_id)
+
+            # 一次查询所有可用优惠券
+            global_coupons,course_coupons = get_account_coupons(request.user.id,course_objs.keys())
+
+            ret["data"] = []
+            for course_id,price_policy_id in price_policy_ids.items():
+                course_obj = course_objs[int(course_id)]
+                course_dict = car[course_id]
+                course_dict["title"] = course_obj.name
+                course_dict["img"] = course_obj.course_img
+                ret["data"].append(build_course_settlement(course_id,course_dict,price_policy_id,course_coupons[course_obj.id]))
+            ret["data"].append(build_my_coupon(global_coupons))
+
+            CONN.hset(settings.ACCOUNT_COUPON,request.user.id,json.dumps(ret["data"]))
+
+        except KeyDoesNotExist as e:
+            ret["code"] = 1001
+            ret["msg"] = str(e)
+        except ObjectDoesNotExist as e:
+            ret["code"] = 1002
+            ret["msg"] = str(e)
+
+        return Response(ret)
+
+
+class PayView(AuthApiView,APIView):
+    query_budget = {"post":16}
 
     def post(self,request,*args,**kwargs):
-        pass
+        """
+        根据结算中心的信息创建订单
+        payment_type: 支付方式
+        course_coupon: {course_id: 课程券记录ID}
+        global_coupon: 通用券记录ID
+        balance: 使用的贝里
+        actual_amount: 前端计算的实付金额，与后端计算不一致时不创建订单
+        auto_coupon: 为true时忽略course_coupon/global_coupon，自动使用最优的优惠券组合
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        ret = {"code":1000}
+        try:
+            payment_type = int(request.data.get('payment_type',3))
+            balance = int(request.data.get('balance') or 0)
+            actual_amount = request.data.get('actual_amount')
+            if actual_amount is not None:
+                actual_amount = float(actual_amount)
+            course_coupon = request.data.get('course_coupon') or {}
+            if not isinstance(course_coupon,dict):
+                raise ValueError()
+        except (TypeError,ValueError):
+            return Response({"code":1001,"msg":"参数错误"})
 
+        try:
+            order = create_order(
+                request.user.id,
+                payment_type=payment_type,
+                course_coupon_ids={str(k):v for k,v in course_coupon.items()},
+                global_coupon_id=request.data.get('global_coupon'),
+                balance=balance,
+                actual_amount=actual_amount,
+                auto_coupon=bool(request.data.get('auto_coupon')),
+            )
+            ret["data"] = {
+                "order_number":order.order_number,
+                "actual_amount":order.actual_amount,
+                "status":order.status,
+            }
+        except PaymentError as e:
+            ret["code"] = 1001
+            ret["msg"] = str(e)
+        except ObjectDoesNotExist as e:
+            ret["code"] = 1002
+            ret["msg"] = "账户不存在"
+
+        return Response(ret)
 
 
+class CouponClaimView(AuthApiView,APIView):
+    query_budget = {"post":1}
 
+    def post(self,request,*args,**kwargs):
+        """
+        领取优惠券，只访问redis，领取记录由 drain_coupon_claims 异步写入数据库
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        ret = {"code":1000}
+        try:
+            coupon_id = int(request.data.get('coupon_id'))
+        except (TypeError,ValueError):
+            return Response({"code":1001,"msg":"优惠券不存在"})
+
+        result = coupon_stock.claim(coupon_id,request.user.id)
+        if result == CLAIMED:
+            ret["msg"] = "领取成功"
+        elif result == SOLD_OUT:
+            ret["code"] = 1002
+            ret["msg"] = "优惠券已领完"
+        elif result == ALREADY_CLAIMED:
+            ret["code"] = 1003
+            ret["msg"] = "已经领取过该优惠券"
+        else:
+            ret["code"] = 1004
+            ret["msg"] = "不在领取时间内"
+        return Response(ret)
 
 
+class DashboardView(AuthApiView,APIView):
+    query_budget = {"get":7}
 
+    def get(self,request,*args,**kwargs):
+        """
+        我的课程和学习进度，读取预先生成的读模型
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        return Response({"code":1000,"data":dashboard.get(request.user.id)})
 
 
+class CommentView(APIView):
+    query_budget = {"get":3}
 
+    def get(self,request,*args,**kwargs):
+        """
+        评论树，按评论的先后层级分页
+        type: article/course  object_id: 文章或课程ID
+        root: 只看某条评论及其回复  depth: 最多展开的层级  cursor: 上一页返回的next_cursor  size: 每页条数
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        params = request.query_params
+        if params.get('type') not in ('article','course'):
+            return Response({"code":1001,"msg":"不支持的评论类型"})
+        try:
+            object_id = int(params.get('object_id'))
+            max_depth = int(params['depth']) if params.get('depth') else None
+            root_id = int(params['root']) if params.get('root') else None
+            size = int(params.get('size',50))
+            if (max_depth is not None and max_depth < 0) or size < 1:
+                raise ValueError
+            size = min(200,size)
+        except (TypeError,ValueError):
+            return Response({"code":1002,"msg":"参数错误"},status=400)
+
+        content_type = ContentType.objects.get_by_natural_key('lufei',params['type'])
+        queryset = comment_queryset(content_type=content_type,object_id=object_id)
+        root = None
+        if root_id is not None:
+            root = queryset.filter(id=root_id).only('id','path','depth').first()
+            if not root:
+                return Response({"code":1003,"msg":"评论不存在"})
+
+        tree,next_cursor = comment_subtree(queryset,root=root,max_depth=max_depth,cursor=params.get('cursor'),size=size)
+        return Response({"code":1000,"data":tree,"next_cursor":next_cursor})
+
+
+class ArticleFeedView(APIView):
+    query_budget = {"get":2}
 
+    def get(self,request,*args,**kwargs):
+        """
+        文章信息流，按权重、上架时间倒序
+        position: 0信息流/1banner大图/2banner小图  cursor: 上一页返回的next_cursor  size: 每页条数
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        params = request.query_params
+        try:
+            position = int(params.get('position',0))
+            size = min(50,max(1,int(params.get('size',20))))
+        except (TypeError,ValueError):
+            return Response({"code":1001,"msg":"参数错误"})
+        if position not in POSITIONS:
+            return Response({"code":1001,"msg":"参数错误"})
+
+        try:
+            article_ids,next_cursor = article_feed.page(position,cursor=params.get('cursor'),size=size)
+        except ValueError:
+            return Response({"code":1002,"msg":"游标无效"},status=400)
+
+        articles = models.Article.objects.filter(id__in=article_ids).values(
+            'id','title','brief','head_img','article_type','vid','pub_date','source__name',*ARTICLE_COUNTER_FIELDS)
+        articles = {article['id']:article for article in article_counter.apply(list(articles))}
+        data = [articles[article_id] for article_id in article_ids if article_id in articles]
+        return Response({"code":1000,"data":data,"next_cursor":next_cursor})
+
+
+class ArticleCounterView(APIView):
+    query_budget = {"get":1,"post":2}
+
+    def get(self,request,pk,*args,**kwargs):
+        """
+        文章的观看/点赞/收藏/评论数，数据库中的值加上redis中未落库的增量
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        rows = list(models.Article.objects.filter(id=pk).values('id',*ARTICLE_COUNTER_FIELDS))
+        if not rows:
+            return Response({"code":1001,"msg":"文章不存在"})
+        return Response({"code":1000,"data":article_counter.apply(rows)[0]})
+
+    def post(self,request,pk,*args,**kwargs):
+        """
+        观看或点赞，需要登录，只累加redis中的计数
+        同一用户点赞只计一次，观看在间隔时间内只计一次
+        field: view_num/agree_num
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        # 读取计数不需要登录，只在这里验证
+        user,token = LuffyTokenAuthentication().authenticate(request)
+        field = request.data.get('field')
+        if field not in USER_COUNTER_INTERVALS:
+            return Response({"code":1002,"msg":"参数错误"})
+        if not models.Article.objects.filter(id=pk).exists():
+            return Response({"code":1001,"msg":"文章不存在"},status=404)
+        counted = article_counter.incr_once(pk,field,user.id)
+        return Response({"code":1000,"counted":counted})
+
+
+class SearchView(APIView):
+    query_budget = {"get":2}
+
+    def get(self,request,*args,**kwargs):
+        """
+        搜索课程和文章，按BM25相关度排序
+        q: 关键词  type: course/article，不传为全部  prefix: 0为关闭最后一个词的前缀匹配  size: 条数
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        params = request.query_params
+        query = params.get('q','')
+        doc_type = params.get('type') or None
+        if not query.strip() or doc_type not in (None,COURSE,ARTICLE):
+            return Response({"code":1001,"msg":"参数错误"})
+        try:
+            size = min(50,max(1,int(params.get('size',20))))
+        except ValueError:
+            return Response({"code":1001,"msg":"参数错误"})
+
+        hits = search_index.search(query,doc_type=doc_type,size=size,prefix=params.get('prefix') != '0')
+        ids = {COURSE:[],ARTICLE:[]}
+        for hit_type,hit_id,score in hits:
+            ids[hit_type].append(hit_id)
+        objects = {}
+        for course in models.Course.objects.filter(id__in=ids[COURSE]).values('id','name','course_img','brief'):
+            objects[(COURSE,course['id'])] = course
+        for article in models.Article.objects.filter(id__in=ids[ARTICLE]).values('id','title','head_img','brief'):
+            objects[(ARTICLE,article['id'])] = article
+
+        data = []
+        for hit_type,hit_id,score in hits:
+            if (hit_type,hit_id) in objects:
+                data.append(dict(objects[(hit_type,hit_id)],type=hit_type,score=round(score,4)))
+        return Response({"code":1000,"data":data})
+
+
+class CourseView(APIView):
+    query_budget = {"get":3}
+
+    def get(self,request,*args,**kwargs):
+        """
+        课程列表，page/size分页
+        客户端带上次的ETag(If-None-Match)且课程数据没有变化时返回304
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        try:
+            page = max(1,int(request.query_params.get('page',1)))
+            size = min(100,max(1,int(request.query_params.get('size',20))))
+        except ValueError:
+            return Response({"code":1001,"msg":"分页参数错误"})
+
+        etag = course_version.etag(CourseVersion.LIST,course_version.get(CourseVersion.LIST),page,size)
+        if etag_matches(request,etag):
+            return not_modified(etag)
+
+        queryset = models.Course.objects.filter(status=0).select_related('sub_category').prefetch_related(
+            Prefetch('price_policy',queryset=models.PricePolicy.objects.order_by('valid_period'))
+        ).order_by('order','id')[(page-1)*size:page*size]
+
+        response = Response({"code":1000,"data":CourseListSerializer(queryset,many=True).data})
+        return with_etag(response,etag)
+
+
+class CourseDetailView(APIView):
+    query_budget = {"get":8}
+
+    def get(self,request,pk,*args,**kwargs):
+        """
+        课程详情: 课程、详情、讲师、推荐课程、大纲、章节和课时、价格策略
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        etag = course_version.etag(pk,course_version.get(pk))
+        if etag_matches(request,etag):
+            return not_modified(etag)
+
+        try:
+            course = models.Course.objects.select_related('sub_category','coursedetail').prefetch_related(
+                Prefetch('price_policy',queryset=models.PricePolicy.objects.order_by('valid_period')),
+                'coursedetail__teachers',
+                'coursedetail__recommend_courses',
+                Prefetch('coursedetail__courseoutline_set',queryset=models.CourseOutline.objects.order_by('order')),
+                Prefetch('coursechapters',queryset=models.CourseChapter.objects.order_by('chapter')),
+                Prefetch('coursechapters__coursesections',queryset=models.CourseSection.objects.order_by('order')),
+            ).get(id=pk,status=0)
+        except ObjectDoesNotExist:
+            return Response({"code":1001,"msg":"课程不存在"},status=404)
+
+        response = Response({"code":1000,"data":CourseDetailSerializer(course).data})
+        return with_etag(response,etag)
+
+
+class CourseOutlineView(APIView):
+    query_budget = {"get":7}
+
+    def get(self,request,pk,*args,**kwargs):
+        """
+        课程大纲: 详情、讲师、推荐课程、大纲、章节和课时，从物化缓存中读取
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        try:
+            return Response({"code":1000,"data":outline_tree.get(pk)})
+        except ObjectDoesNotExist:
+            return Response({"code":1001,"msg":"课程不存在"},status=404)
+
+
+def etag_matches(request,etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH','')
+    return etag in [item.strip().lstrip('W/') for item in if_none_match.split(',')]
+
+
+def not_modified(etag):
+    return with_etag(Response(status=304),etag)
+
+
+def with_etag(response,etag):
+    response['ETag'] = etag
+    # 允许CDN缓存，但每次都要用ETag验证
+    response['Cache-Control'] = 'public, no-cache'
+    return response
+
+
+class RedisPoolView(APIView):
+    query_budget = 0
+
+    def get(self,request,*args,**kwargs):
+        """
+        当前worker进程的redis连接池使用情况，只允许INTERNAL_IPS访问
+        """
+        if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+            raise Http404
+        return Response(POOL.stats())
+
+
+class MetricsView(APIView):
+    query_budget = 0
+
+    def get(self,request,*args,**kwargs):
+        """
+        当前worker进程的接口耗时、SQL、redis统计和token缓存命中率，只允许INTERNAL_IPS访问
+        output=prometheus 时返回Prometheus文本格式，reset=1 时读取后清零(token缓存的计数不清零)
+        """
+        if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+            raise Http404
+        if request.query_params.get('output') == 'prometheus':
+            response = HttpResponse(metrics.prometheus() + token_cache.prometheus(),
+                                    content_type="text/plain; version=0.0.4")
+        else:
+            snapshot = metrics.snapshot()
+            snapshot["token_cache"] = token_cache.stats()
+            response = Response(snapshot)
+        if request.query_params.get('reset') == '1':
+            metrics.reset()
+        return response